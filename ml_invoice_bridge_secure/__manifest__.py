@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 {
     'name': 'MercadoLibre Invoice Bridge - Production',
-    'version': '17.0.3.0.0',
+    'version': '17.0.3.1.0',
     'category': 'Sales/Accounting',
     'summary': 'Módulo para subir facturas legales de Odoo a MercadoLibre con soporte completo para facturación en lote',
     'description': '''
@@ -41,10 +41,12 @@
         
         # Data
         'data/cron_data.xml',
+        'data/upload_job_data.xml',
         
         # Views - NOMBRES CORREGIDOS SEGÚN TU GITHUB
         'views/mercadolibre_config_views.xml',
         'views/mercadolibre_invoice_log_views.xml',
+        'views/mercadolibre_upload_job_views.xml',
         'views/account_move_views.xml',
         'views/sale_order_views.xml',
         'views/menu_views.xml',
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+import logging
+from odoo import api, SUPERUSER_ID
+
+_logger = logging.getLogger(__name__)
+
+def migrate(cr, version):
+    """
+    Actualizar el código del cron de auto-upload (registro noupdate)
+    para que use el motor concurrente de account.move
+    """
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    cron = env.ref('ml_invoice_bridge_secure.cron_auto_upload_ml_invoices', raise_if_not_found=False)
+    if not cron:
+        _logger.info("Cron de auto-upload no encontrado, nada para migrar")
+        return
+
+    cron.code = 'model._cron_auto_upload_ml_invoices()'
+    _logger.info("Cron de auto-upload migrado al motor concurrente")
@@ -2,5 +2,8 @@
 
 from . import mercadolibre_config
 from . import mercadolibre_log
+from . import mercadolibre_log_stat
+from . import mercadolibre_rate_limit
+from . import mercadolibre_upload_job
 from . import account_move
 from . import sale_order
@@ -1,26 +1,85 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import psycopg2
 import requests
 import base64
+import contextlib
+import hashlib
 import io
 import json
-import re
-from odoo import models, fields, api, _
+import threading
+import time
+from datetime import timedelta
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from odoo import models, fields, api, tools, _
 from odoo.exceptions import UserError
 from odoo.tools import config
+from odoo.tools.image import image_process
+from odoo.tools.sql import create_index
+
+from ..tools import ml_http, ml_invoice_html, ml_pack_parser, ml_render
+from ..tools.ml_http import MLUploadError
 
 _logger = logging.getLogger(__name__)
 
+# Campos que no cambian el PDF: escribirlos no invalida la cache
+PDF_CACHE_NEUTRAL_FIELDS = {
+    'ml_uploaded', 'ml_upload_date', 'upload_status', 'upload_error', 'last_upload_attempt',
+    'ml_document_id', 'ml_pdf_hash', 'ml_pdf_cache', 'ml_pdf_cache_key',
+}
+
+# Campos cuyo cambio puede dejar una factura publicada lista para subir
+# (los datos ML y las dependencias de _compute_is_ml_sale)
+ML_DATA_FIELDS = {'is_ml_sale', 'ml_pack_id', 'invoice_origin', 'partner_id'}
+
+# PDFs más grandes no se cachean: guardarlos obliga a tenerlos enteros en memoria
+# (y su base64) en el worker
+ML_PDF_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+# Tamaño máximo (px) del logo embebido en el PDF
+LOGO_PRINT_SIZE = (256, 256)
+
+# Selecciones más grandes se encolan y las procesa el cron en segundo plano
+BULK_SYNC_LIMIT = 50
+# Prioridad de la cola para uploads pedidos manualmente
+BULK_UPLOAD_PRIORITY = 20
+
+# Textos del origen de la orden que indican una venta de MercadoLibre
+ML_ORIGIN_INDICATORS = ('mercadolibre', 'mercado libre', 'ml order', 'odumbo', 'venta confirmada')
+
+# Facturas ML publicadas pendientes de subir. El barrido de la cola usa exactamente
+# este predicado para que PostgreSQL pueda usar el índice parcial.
+ML_PENDING_UPLOAD_WHERE = (
+    "is_ml_sale AND NOT COALESCE(ml_uploaded, false) AND state = 'posted' "
+    "AND COALESCE(ml_pack_id, '') <> ''"
+)
+
+# Campos donde puede venir el Pack ID, en orden de preferencia
+PACK_ID_SOURCE_FIELDS = ('origin', 'name', 'invoice_origin', 'ref')
+
+# Reporte de factura estándar (con el layout legal de l10n_ar) para el motor 'report'
+ML_INVOICE_REPORT = 'account.account_invoices'
+
 class AccountMove(models.Model):
     _inherit = 'account.move'
 
     # Campos ML básicos - CORREGIDO: is_ml_sale ahora es computed
-    ml_pack_id = fields.Char(string='Pack ID', readonly=True, help='MercadoLibre Pack ID')
+    ml_pack_id = fields.Char(
+        string='Pack ID',
+        compute='_compute_is_ml_sale',
+        store=True,
+        readonly=False,
+        precompute=True,
+        index='btree_not_null',
+        help='MercadoLibre Pack ID'
+    )
     is_ml_sale = fields.Boolean(
         string='Is ML Sale', 
         compute='_compute_is_ml_sale',
         store=True,
+        precompute=True,
         help='Indica si es una venta de MercadoLibre'
     )
     ml_uploaded = fields.Boolean(string='ML Uploaded', default=False, help='Indica si ya fue subida a ML')
@@ -31,50 +90,79 @@ class AccountMove(models.Model):
         ('pending', 'Pending'),
         ('uploading', 'Uploading'),
         ('uploaded', 'Uploaded'),
-        ('error', 'Error')
-    ], string='Upload Status', default='pending')
+        ('error', 'Error'),
+        ('dead', 'Dead Letter'),
+    ], string='Upload Status', default='pending')  # índice parcial en init()
     upload_error = fields.Text(string='Upload Error')
     last_upload_attempt = fields.Datetime(string='Last Upload Attempt')
+    
+    # Cache del PDF generado: adjunto oculto cuya clave es el hash del HTML y de las opciones de render
+    ml_pdf_cache = fields.Binary(string='Cached ML PDF', attachment=True, copy=False)
+    ml_pdf_cache_key = fields.Char(string='Cached ML PDF Key', readonly=True, copy=False)
+    
+    # Idempotencia: qué se subió y con qué ID lo registró ML
+    ml_document_id = fields.Char(string='ML Fiscal Document ID', readonly=True, copy=False,
+                                 help='ID del documento fiscal devuelto por MercadoLibre al subir la factura')
+    ml_pdf_hash = fields.Char(string='Uploaded PDF Hash', readonly=True, copy=False,
+                              help='SHA-256 del PDF subido a MercadoLibre')
+
+    def init(self):
+        super().init()
+        # Barrido de facturas pendientes de subir: sólo contiene las facturas ML sin subir
+        create_index(
+            self._cr, 'account_move_ml_pending_upload_idx', self._table,
+            ['create_date', 'id'], where=ML_PENDING_UPLOAD_WHERE
+        )
+        # Listas y filtros por estado de upload (upload_status vale 'pending' en toda factura no ML)
+        create_index(
+            self._cr, 'account_move_ml_upload_status_idx', self._table,
+            ['upload_status'], where='is_ml_sale'
+        )
 
     @api.depends('invoice_origin', 'partner_id')
     def _compute_is_ml_sale(self):
-        """Detecta automáticamente si es una venta de MercadoLibre - SIN INTERFERIR CON ODUMBO"""
+        """Detecta automáticamente si es una venta de MercadoLibre - SIN INTERFERIR CON ODUMBO
+
+        Trabaja sobre todo el lote: las órdenes de venta se resuelven con una sola
+        búsqueda por nombre y is_ml_sale/ml_pack_id se asignan en cache (ambos
+        los calcula este método), sin write() anidados por factura.
+        ml_pack_id también se escribe directamente (Fix ML Data, backfill): el
+        compute sólo lo completa cuando está vacío. El encolado lo hace write().
+        """
+        customer_types = ('out_invoice', 'out_refund')
+        # MÉTODO 2 necesita la sale.order de cada origen: una búsqueda para todas (SOLO LECTURA)
+        origins = {
+            move.invoice_origin for move in self
+            if move.move_type in customer_types and move.invoice_origin
+            and not self._is_ml_partner(move.partner_id)
+        }
+        orders_by_name = {}
+        if origins:
+            for order in self.env['sale.order'].search([('name', 'in', list(origins))]):
+                orders_by_name.setdefault(order.name, order)
+
         for move in self:
-            move.is_ml_sale = False
-            
-            if move.move_type not in ('out_invoice', 'out_refund'):
-                continue
-                
-            # MÉTODO 1: Detectar por partner "Mercado Libre"
-            if move.partner_id and 'mercado' in move.partner_id.name.lower():
-                move.is_ml_sale = True
-                pack_id = self._extract_pack_id_safe(move)
-                if pack_id and not move.ml_pack_id:
-                    # Usar sudo() para escribir en campo readonly
-                    move.sudo().write({'ml_pack_id': pack_id})
-                continue
-                
-            # MÉTODO 2: Detectar por sale.order relacionada (SOLO LECTURA - NO MODIFICA ODUMBO)
-            if move.invoice_origin:
-                sale_order = self.env['sale.order'].search([
-                    ('name', '=', move.invoice_origin)
-                ], limit=1)
-                
-                if sale_order:
-                    # Verificar origin de la orden (SOLO LECTURA)
+            is_ml_sale, pack_id = False, None
+            if move.move_type in customer_types:
+                # MÉTODO 1: Detectar por partner "Mercado Libre"
+                if self._is_ml_partner(move.partner_id):
+                    is_ml_sale, pack_id = True, self._extract_pack_id_safe(move)
+                # MÉTODO 2: Detectar por sale.order relacionada (SOLO LECTURA - NO MODIFICA ODUMBO)
+                elif move.invoice_origin in orders_by_name:
+                    sale_order = orders_by_name[move.invoice_origin]
                     if sale_order.origin and self._is_ml_origin_text(sale_order.origin):
-                        move.is_ml_sale = True
-                        pack_id = self._extract_pack_id_from_text(sale_order.origin)
-                        if pack_id and not move.ml_pack_id:
-                            move.sudo().write({'ml_pack_id': pack_id})
-                        continue
-                    
-                    # Verificar partner de la orden (SOLO LECTURA)
-                    if sale_order.partner_id and 'mercado' in sale_order.partner_id.name.lower():
-                        move.is_ml_sale = True
-                        pack_id = self._extract_pack_id_safe(sale_order)
-                        if pack_id and not move.ml_pack_id:
-                            move.sudo().write({'ml_pack_id': pack_id})
+                        is_ml_sale, pack_id = True, self._extract_pack_id_from_text(sale_order.origin)
+                    elif self._is_ml_partner(sale_order.partner_id):
+                        is_ml_sale, pack_id = True, self._extract_pack_id_safe(sale_order)
+
+            move.is_ml_sale = is_ml_sale
+            # Nunca pisar un Pack ID ya cargado (desde la orden, manual o por fix)
+            move.ml_pack_id = move.ml_pack_id or pack_id or False
+
+    @api.model
+    def _is_ml_partner(self, partner):
+        """Partner "Mercado Libre" (por nombre)"""
+        return bool(partner and partner.name and 'mercado' in partner.name.lower())
 
     def _is_ml_origin_text(self, text):
         """Detecta si el texto indica origen MercadoLibre"""
@@ -82,58 +170,21 @@ class AccountMove(models.Model):
             return False
             
         text_lower = text.lower()
-        ml_indicators = [
-            'mercadolibre',
-            'mercado libre', 
-            'ml order',
-            'odumbo',
-            'venta confirmada'
-        ]
-        
-        return any(indicator in text_lower for indicator in ml_indicators)
+        return any(indicator in text_lower for indicator in ML_ORIGIN_INDICATORS)
 
     def _extract_pack_id_safe(self, source_object):
         """Extrae pack_id de múltiples fuentes de forma segura"""
-        # Lista de atributos a revisar (SOLO LECTURA)
-        attrs_to_check = ['origin', 'name', 'invoice_origin', 'ref']
-        
-        for attr in attrs_to_check:
-            if hasattr(source_object, attr):
-                value = getattr(source_object, attr, None)
-                if value:
-                    pack_id = self._extract_pack_id_from_text(value)
-                    if pack_id:
-                        return pack_id
+        # Campos a revisar (SOLO LECTURA)
+        for field_name in PACK_ID_SOURCE_FIELDS:
+            if field_name in source_object._fields:
+                pack_id = ml_pack_parser.extract(source_object[field_name])
+                if pack_id:
+                    return pack_id
         return None
 
     def _extract_pack_id_from_text(self, text):
-        """Extrae pack_id usando regex flexible"""
-        if not text:
-            return None
-            
-        try:
-            # Buscar números de 13-20 dígitos (pack_id típico ML)
-            matches = re.findall(r'(\d{13,20})', str(text))
-            for match in matches:
-                if 13 <= len(match) <= 20:
-                    return match
-                    
-            # Buscar números de 10-20 dígitos después de palabras clave
-            patterns = [
-                r'order[:\s]+(\d{10,20})',
-                r'ml[:\s]+(\d{10,20})',
-                r'pack[:\s]+(\d{10,20})',
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, str(text), re.IGNORECASE)
-                if match and 10 <= len(match.group(1)) <= 20:
-                    return match.group(1)
-                    
-        except Exception as e:
-            _logger.warning(f'Error extracting pack_id from "{text}": {e}')
-        
-        return None
+        """Extrae pack_id (ver tools.ml_pack_parser)"""
+        return ml_pack_parser.extract(text)
 
     def action_fix_ml_data_from_sale_orders(self):
         """🔧 Método específico para botón "Fix ML Data" - NOMBRE EXACTO DE LA VISTA"""
@@ -238,12 +289,157 @@ class AccountMove(models.Model):
                 }
             }
 
+    # Backfill masivo en SQL
+    def _ml_backfill_detected_query(self):
+        """Facturas de cliente del rango [lo, hi) que _compute_is_ml_sale marcaría como
+        ML y aún no lo están (o sin Pack ID), con el Pack ID detectado en PostgreSQL.
+
+        Mismas reglas que el compute: método 1 por el partner de la factura (Pack ID
+        de sus campos PACK_ID_SOURCE_FIELDS); método 2 por la orden de venta más
+        reciente con ese nombre, según su origen o su partner. El backfill sólo
+        agrega datos ML: nunca desmarca facturas.
+        """
+        def pack_id_sql(alias, model):
+            # Mismo orden que _extract_pack_id_safe: campo por campo, patrón por patrón
+            columns = [name for name in PACK_ID_SOURCE_FIELDS
+                       if name in model._fields and model._fields[name].store] if model else ['origin']
+            return 'COALESCE(%s)' % ', '.join(
+                'substring(%s.%s from %%(pack_pattern_%d)s)' % (alias, column, index)
+                for column in columns for index in range(len(ml_pack_parser.SQL_PATTERNS)))
+
+        ml_partner = "%s.name ILIKE '%%%%mercado%%%%'"
+        return f"""
+            SELECT am.id, COALESCE(am.is_ml_sale, false) AS is_ml_sale,
+                   CASE WHEN {ml_partner % 'ip'} THEN {pack_id_sql('am', self)}
+                        WHEN so.origin ILIKE ANY(%(indicators)s) THEN {pack_id_sql('so', None)}
+                        ELSE {pack_id_sql('so', self.env['sale.order'])}
+                   END AS pack_id
+              FROM account_move am
+              LEFT JOIN res_partner ip ON ip.id = am.partner_id
+              LEFT JOIN LATERAL (
+                    SELECT o.name, o.origin, o.partner_id
+                      FROM sale_order o
+                     WHERE o.name = am.invoice_origin
+                     ORDER BY o.date_order DESC, o.id DESC
+                     LIMIT 1
+                   ) so ON true
+              LEFT JOIN res_partner sp ON sp.id = so.partner_id
+             WHERE am.id >= %(lo)s AND am.id < %(hi)s
+               AND am.move_type IN ('out_invoice', 'out_refund')
+               AND (NOT COALESCE(am.is_ml_sale, false) OR COALESCE(am.ml_pack_id, '') = '')
+               AND ({ml_partner % 'ip'}
+                    OR so.origin ILIKE ANY(%(indicators)s)
+                    OR {ml_partner % 'sp'})
+        """
+
+    @api.model
+    def _ml_backfill_from_sale_orders(self, dry_run=True, chunk_size=20000, commit=True):
+        """Corrige is_ml_sale/ml_pack_id de facturas históricas con las reglas de
+        _compute_is_ml_sale (partner de la factura y orden de venta).
+
+        Todo se resuelve en PostgreSQL (join por invoice_origin y regex con
+        substring ... from), en tramos de `chunk_size` ids confirmados uno a uno
+        si `commit`. Nunca pisa un Pack ID ya cargado. Con dry_run sólo cuenta.
+        Para correrlo desde el shell:
+            env['account.move']._ml_backfill_from_sale_orders(dry_run=False)
+
+        Al aplicar, encola para upload las facturas posteadas que quedaron pendientes.
+
+        Devuelve {'candidates', 'new_ml_sales', 'with_pack_id', 'updated', 'enqueued'}.
+        """
+        self.flush_model(['is_ml_sale', 'ml_pack_id', 'invoice_origin', 'move_type', 'partner_id']
+                         + [name for name in PACK_ID_SOURCE_FIELDS if name in self._fields])
+        self.env['sale.order'].flush_model(['name', 'origin', 'partner_id', 'date_order'])
+        self.env['res.partner'].flush_model(['name'])
+        cr = self.env.cr
+
+        params = {
+            'indicators': ['%%%s%%' % indicator for indicator in ML_ORIGIN_INDICATORS],
+            'uid': self.env.uid,
+        }
+        params.update({'pack_pattern_%d' % index: pattern
+                       for index, pattern in enumerate(ml_pack_parser.SQL_PATTERNS)})
+        detected_query = self._ml_backfill_detected_query()
+        # Sólo filas que cambian: no ML todavía, o ML sin Pack ID y con uno detectado
+        changes = "(NOT d.is_ml_sale OR d.pack_id IS NOT NULL)"
+
+        cr.execute("""
+            SELECT min(id), max(id) FROM account_move
+             WHERE move_type IN ('out_invoice', 'out_refund')
+        """)
+        min_id, max_id = cr.fetchone()
+        stats = {'candidates': 0, 'new_ml_sales': 0, 'with_pack_id': 0, 'updated': 0, 'enqueued': 0}
+        if min_id is None:
+            return stats
+
+        if dry_run:
+            cr.execute(f"""
+                SELECT count(*), count(*) FILTER (WHERE NOT d.is_ml_sale), count(d.pack_id)
+                  FROM ({detected_query}) d
+                 WHERE {changes}
+            """, dict(params, lo=min_id, hi=max_id + 1))
+            stats['candidates'], stats['new_ml_sales'], stats['with_pack_id'] = cr.fetchone()
+            _logger.info("ML backfill dry run: %s", stats)
+            return stats
+
+        chunk_size = max(chunk_size, 1)
+        start = time.monotonic()
+        for lo in range(min_id, max_id + 1, chunk_size):
+            hi = lo + chunk_size
+            cr.execute(f"""
+                WITH d AS ({detected_query})
+                UPDATE account_move am
+                   SET is_ml_sale = true,
+                       ml_pack_id = COALESCE(NULLIF(am.ml_pack_id, ''), d.pack_id),
+                       write_uid = %(uid)s,
+                       write_date = now() at time zone 'UTC'
+                  FROM d
+                 WHERE am.id = d.id AND {changes}
+             RETURNING d.is_ml_sale, d.pack_id IS NOT NULL
+            """, dict(params, lo=lo, hi=hi))
+            rows = cr.fetchall()
+            stats['updated'] += len(rows)
+            stats['new_ml_sales'] += sum(1 for was_ml, has_pack_id in rows if not was_ml)
+            stats['with_pack_id'] += sum(1 for was_ml, has_pack_id in rows if has_pack_id)
+            if commit:
+                cr.commit()
+            _logger.info("ML backfill: ids %d-%d done (%d%%), %d invoices updated so far, %.1fs",
+                         lo, min(hi, max_id + 1) - 1,
+                         100 * (min(hi, max_id + 1) - min_id) // (max_id + 1 - min_id),
+                         stats['updated'], time.monotonic() - start)
+
+        stats['candidates'] = stats['updated']
+        self.invalidate_model(['is_ml_sale', 'ml_pack_id'])
+        # El UPDATE directo no pasa por write(): encolar aquí las facturas que quedaron pendientes
+        stats['enqueued'] = self.env['mercadolibre.upload.job']._enqueue_pending_invoices()
+        if commit:
+            self.env.cr.commit()
+        self.env['mercadolibre.log'].create_cron_log(
+            status='success',
+            message='ML data backfill from sale orders: %(updated)d invoices updated '
+                    '(%(new_ml_sales)d new ML sales, %(with_pack_id)d with Pack ID, '
+                    '%(enqueued)d enqueued for upload)' % stats,
+        )
+        return stats
+
     def action_upload_to_ml(self):
         """Acción principal: generar PDF legal y subir a ML"""
+        return self._ml_upload_single()
+
+    def _ml_upload_single(self, pdf_file=None):
+        """Genera el PDF legal y lo sube a ML. Con `pdf_file` (archivo abierto, lo
+        cierra el llamador) se sube ese PDF sin volver a generarlo."""
         self.ensure_one()
         
         if not self.ml_pack_id:
             raise UserError("Esta factura no tiene Pack ID asociado.")
+
+        # Upload manual (botón, reintento desde el log): no competir con el cron por el job
+        if not self.env.context.get('ml_upload_job_claimed'):
+            self._ml_lock_upload_job()
+        
+        # Evaluar antes de marcar este intento
+        needs_precheck = self._ml_needs_upload_precheck()
         
         try:
             self.upload_status = 'uploading'
@@ -251,30 +447,47 @@ class AccountMove(models.Model):
             
             _logger.info("Starting upload for invoice %s, ml_pack_id: %s", self.display_name, self.ml_pack_id)
             
-            # Generar PDF usando el método que ya funciona
-            pdf_content = self._generate_pdf_direct_bypass()
-            
-            if not pdf_content:
-                raise UserError("No se pudo generar el PDF legal de la factura.")
-            
-            _logger.info("PDF generated successfully: %d bytes", len(pdf_content))
-            
-            # Subir a ML
-            result = self._upload_to_ml_api(pdf_content)
+            # Generar PDF con el motor configurado (archivo, no bytes en memoria)
+            pdf_context = contextlib.nullcontext(pdf_file) if pdf_file else self._ml_generate_pdf(as_file=True)
+            with pdf_context as pdf_file:
+                pdf_size = ml_http.file_size(pdf_file)
+                _logger.info("PDF generated successfully: %d bytes", pdf_size)
+                pdf_hash = ml_http.file_sha256(pdf_file)
+                
+                # Un intento previo pudo haber sido aceptado por ML sin quedar registrado
+                if needs_precheck:
+                    existing = self._ml_find_existing_uploads({self.id: pdf_hash})
+                    if self.id in existing:
+                        self._ml_mark_already_uploaded(existing[self.id])
+                        return {
+                            'type': 'ir.actions.client',
+                            'tag': 'display_notification',
+                            'params': {
+                                'title': 'Ya subida',
+                                'message': f'MercadoLibre ya tiene esta factura (documento {existing[self.id]}). No se volvió a subir.',
+                                'sticky': False,
+                            }
+                        }
+                
+                # Subir a ML
+                result = self._upload_to_ml_api(pdf_file)
             
             if result.get('success'):
+                document_ids = ml_http.extract_document_ids(result.get('data'))
                 self.write({
                     'upload_status': 'uploaded',
                     'upload_error': False,
                     'ml_uploaded': True,
-                    'ml_upload_date': fields.Datetime.now()
+                    'ml_upload_date': fields.Datetime.now(),
+                    'ml_document_id': document_ids[0] if document_ids else False,
+                    'ml_pdf_hash': pdf_hash,
                 })
                 
                 # Crear log de éxito
                 self.env['mercadolibre.log'].create_log(
                     invoice_id=self.id,
                     status='success', 
-                    message=f'Upload successful: {len(pdf_content)} bytes uploaded',
+                    message=f'Upload successful: {pdf_size} bytes uploaded',
                     ml_pack_id=self.ml_pack_id,
                     ml_response=str(result.get('data', {}))
                 )
@@ -284,14 +497,17 @@ class AccountMove(models.Model):
                     'tag': 'display_notification',
                     'params': {
                         'title': 'Éxito',
-                        'message': f'Factura subida correctamente. PDF: {len(pdf_content)} bytes',
+                        'message': f'Factura subida correctamente. PDF: {pdf_size} bytes',
                         'sticky': False,
                     }
                 }
             else:
                 error_msg = result.get('error', 'Unknown error')
                 self._handle_upload_error(error_msg)
-                raise UserError(f"Error en API de ML: {error_msg}")
+                raise MLUploadError(
+                    f"Error en API de ML: {error_msg}",
+                    error_type=result.get('error_type', ml_http.ERROR_TRANSIENT)
+                )
                 
         except Exception as e:
             error_msg = str(e)
@@ -299,8 +515,88 @@ class AccountMove(models.Model):
             _logger.error("Error uploading invoice %s: %s", self.display_name, error_msg)
             raise
 
-    def _generate_pdf_direct_bypass(self):
-        """BYPASS COMPLETO - Genera PDF sin usar el sistema de reportes de Odoo"""
+    def _ml_lock_upload_job(self):
+        """Bloquea el job de upload de la factura hasta el commit del llamador.
+
+        Mientras tanto el cron lo salta (SKIP LOCKED). Si un worker ya lo tomó
+        (bloqueado o en 'processing') se rechaza el upload manual.
+        """
+        self.ensure_one()
+        job_model = self.env['mercadolibre.upload.job']
+        job_model.flush_model(['state'])
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("""
+                    SELECT state FROM mercadolibre_upload_job
+                     WHERE invoice_id = %s
+                       FOR UPDATE NOWAIT
+                """, (self.id,))
+                row = self.env.cr.fetchone()
+        except psycopg2.errors.LockNotAvailable:
+            row = ('processing',)
+        if row and row[0] == 'processing':
+            raise UserError("La cola de upload ya está procesando esta factura. Intente nuevamente en unos minutos.")
+
+    def _ml_generate_pdf(self, as_file=False):
+        """PDF legal de la factura con el motor configurado en mercadolibre.config"""
+        self.ensure_one()
+        if self._ml_pdf_engine() == 'report':
+            pdf = self._ml_render_report_pdfs(as_file=as_file)[self.id]
+            if isinstance(pdf, Exception):
+                raise pdf
+            return pdf
+        return self._generate_pdf_direct_bypass(as_file=as_file)
+
+    def _ml_render_report_pdfs(self, as_file=False):
+        """PDFs del reporte de factura nativo (l10n_ar) para todo el recordset.
+
+        Reutiliza el PDF legal adjuntado al publicar/enviar la factura; el resto
+        se renderiza en una sola pasada del motor de reportes, que invoca
+        wkhtmltopdf una vez y separa el resultado por factura. Si el lote falla,
+        cada factura se renderiza por separado para aislar el error.
+
+        Devuelve {invoice_id: bytes | BytesIO (as_file) | excepción}.
+        """
+        pdfs = {}
+        to_render = self.env['account.move']
+        for invoice in self:
+            attachment = invoice.invoice_pdf_report_id if 'invoice_pdf_report_id' in invoice._fields else None
+            if attachment and attachment.raw:
+                pdfs[invoice.id] = attachment.raw
+            else:
+                to_render |= invoice
+        if pdfs:
+            _logger.info("Reusing %d legal invoice PDFs already attached", len(pdfs))
+
+        report_model = self.env['ir.actions.report']
+        if to_render:
+            try:
+                streams = report_model._render_qweb_pdf_prepare_streams(ML_INVOICE_REPORT, {}, res_ids=to_render.ids)
+                for invoice_id, stream_data in streams.items():
+                    pdfs[invoice_id] = stream_data['stream'].getvalue()
+                    stream_data['stream'].close()
+            except Exception as e:
+                _logger.warning("Batch invoice report render of %d invoices failed, rendering one by one: %s",
+                                len(to_render), e)
+                for invoice in to_render:
+                    try:
+                        pdfs[invoice.id] = report_model._render_qweb_pdf(ML_INVOICE_REPORT, invoice.ids)[0]
+                    except Exception as invoice_error:
+                        pdfs[invoice.id] = invoice_error
+            for invoice in to_render:
+                pdfs.setdefault(invoice.id, UserError("El reporte de factura no devolvió un PDF"))
+
+        if as_file:
+            pdfs = {invoice_id: pdf if isinstance(pdf, Exception) else io.BytesIO(pdf)
+                    for invoice_id, pdf in pdfs.items()}
+        return pdfs
+
+    def _generate_pdf_direct_bypass(self, as_file=False):
+        """BYPASS COMPLETO - Genera PDF sin usar el sistema de reportes de Odoo.
+
+        Con as_file=True devuelve el archivo temporal abierto (se borra al
+        cerrarlo) en lugar de los bytes, para subirlo en streaming.
+        """
         self.ensure_one()
         
         _logger.info("=== GENERATING PDF WITH COMPLETE BYPASS ===")
@@ -309,19 +605,137 @@ class AccountMove(models.Model):
             # Generar HTML que replica exactamente la factura mostrada
             html_content = self._generate_exact_invoice_html()
             
+            # Si la factura no cambió desde el último render, reutilizar el PDF
+            cache_key = self._ml_pdf_cache_key(html_content)
+            cached = self._ml_pdf_cache_get(cache_key, as_file=as_file)
+            if cached is not None:
+                _logger.info("✅ PDF reused from cache for %s", self.display_name)
+                return cached
+            
             # Convertir a PDF usando wkhtmltopdf directamente
-            pdf_content = self._html_to_pdf_direct(html_content)
+            pdf = self._html_to_pdf_direct(html_content, as_file=as_file)
+            pdf_size = ml_http.file_size(pdf) if as_file else len(pdf)
             
-            if pdf_content and len(pdf_content) > 1000:
-                _logger.info("✅ PDF generated with bypass: %d bytes", len(pdf_content))
-                return pdf_content
+            if pdf_size > 1000:
+                _logger.info("✅ PDF generated with bypass: %d bytes", pdf_size)
+                self._ml_pdf_cache_put(cache_key, pdf)
+                return pdf
             else:
+                if as_file:
+                    pdf.close()
                 raise UserError("Error generando PDF")
                 
         except Exception as e:
             _logger.error(f"Bypass generation failed: {str(e)}")
             raise
 
+    # Cache de PDFs
+    @api.model
+    def _ml_pdf_cache_key(self, html_content, profile=None):
+        """Clave de cache: el HTML depende de todos los datos de la factura (líneas, totales,
+        CAE, cliente, logo), así que su hash cambia si cambia cualquiera de ellos.
+        Incluye el perfil de calidad: cambiarlo invalida los PDFs cacheados."""
+        if profile is None:
+            profile = self._ml_render_options().get('profile')
+        signature = ml_render.profile_signature(profile)
+        return hashlib.sha256((signature + '\n' + html_content).encode('utf-8')).hexdigest()
+
+    def _ml_pdf_cache_attachment(self):
+        self.ensure_one()
+        return self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'ml_pdf_cache'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+
+    def _ml_pdf_cache_get(self, cache_key, as_file=False):
+        """PDF cacheado si corresponde a `cache_key`, si no None.
+        Con as_file=True se abre directamente desde el filestore."""
+        self.ensure_one()
+        if not cache_key or self.ml_pdf_cache_key != cache_key:
+            return None
+        attachment = self._ml_pdf_cache_attachment()
+        if not attachment:
+            return None
+        if not as_file:
+            return attachment.raw
+        if attachment.store_fname:
+            try:
+                return open(attachment._full_path(attachment.store_fname), 'rb')
+            except OSError:
+                return None
+        return io.BytesIO(attachment.raw)
+
+    def _ml_pdf_cache_put(self, cache_key, pdf):
+        """Guarda el PDF generado (bytes o archivo abierto, que queda al inicio).
+        Los que superan ML_PDF_CACHE_MAX_BYTES no se cachean."""
+        self.ensure_one()
+        size = len(pdf) if isinstance(pdf, bytes) else ml_http.file_size(pdf)
+        if size > ML_PDF_CACHE_MAX_BYTES:
+            _logger.info("PDF of invoice %s not cached: %d bytes exceeds the %d bytes limit",
+                         self.id, size, ML_PDF_CACHE_MAX_BYTES)
+            return
+        if isinstance(pdf, bytes):
+            content = pdf
+        else:
+            content = pdf.read()
+            pdf.seek(0)
+        self.sudo().write({'ml_pdf_cache': base64.b64encode(content), 'ml_pdf_cache_key': cache_key})
+
+    @api.model
+    def _cron_prerender_ml_pdfs(self):
+        """Etapa de pre-render: genera y cachea el PDF de las facturas encoladas,
+        en lotes que se confirman uno a uno, para que el upload sólo transmita"""
+        config = self.env['mercadolibre.config'].get_active_config()
+        if not config or not config.prerender_pdfs or config.pdf_engine != 'bypass':
+            return
+        job_model = self.env['mercadolibre.upload.job'].sudo()
+        deadline = time.monotonic() + config.upload_time_limit
+        chunk_size = config.render_pool_size * config.render_batch_size
+        rendered_count = failed_count = 0
+        while time.monotonic() < deadline:
+            jobs = job_model._claim_for_render(chunk_size)
+            if not jobs:
+                break
+            payloads, failures = jobs.invoice_id._ml_prepare_upload_payloads(
+                max_workers=config.render_pool_size, batch_size=config.render_batch_size)
+            for payload in payloads:
+                payload['pdf'].close()
+            now = fields.Datetime.now()
+            jobs.filtered(lambda j: j.invoice_id.id in failures).write({'render_error_at': now})
+            # Los PDFs que superan ML_PDF_CACHE_MAX_BYTES no quedan en cache: marcarlos
+            # para no renderizarlos de nuevo en cada ejecución
+            jobs.filtered(lambda j: j.invoice_id.id not in failures).write({'prerendered_at': now})
+            # Confirmar el lote: guarda los PDFs y libera los jobs para el upload
+            self.env.cr.commit()
+            rendered_count += len(payloads)
+            failed_count += len(failures)
+        if rendered_count or failed_count:
+            _logger.info("ML PDF pre-render: %d rendered, %d failed", rendered_count, failed_count)
+
+    @api.model
+    def _cron_gc_ml_pdf_cache(self):
+        """Elimina PDFs cacheados por antigüedad y, si se supera el tamaño máximo, los más viejos"""
+        config = self.env['mercadolibre.config'].get_active_config()
+        max_age_days = config.pdf_cache_max_age_days if config else 7
+        max_bytes = (config.pdf_cache_max_mb if config else 500) * 1024 * 1024
+
+        attachments = self.env['ir.attachment'].sudo().search_read([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'ml_pdf_cache'),
+        ], ['res_id', 'file_size', 'write_date'], order='write_date desc')
+        expire_before = fields.Datetime.now() - timedelta(days=max_age_days)
+        total_size = 0
+        evict_ids = []
+        for attachment in attachments:
+            total_size += attachment['file_size'] or 0
+            if attachment['write_date'] < expire_before or total_size > max_bytes:
+                evict_ids.append(attachment['res_id'])
+        if evict_ids:
+            self.browse(evict_ids).sudo().write({'ml_pdf_cache': False, 'ml_pdf_cache_key': False})
+            _logger.info("ML PDF cache: evicted %d of %d cached PDFs", len(evict_ids), len(attachments))
+        return len(evict_ids)
+
     def _get_safe_field(self, obj, field_path, default=''):
         """Helper para obtener campos de forma segura"""
         try:
@@ -370,12 +784,15 @@ class AccountMove(models.Model):
             return 0.0
 
     def _generate_exact_invoice_html(self):
-        """Genera HTML que replica EXACTAMENTE el formato de la factura argentina"""
+        """Genera HTML que replica EXACTAMENTE el formato de la factura argentina.
+
+        La plantilla y el CSS están en tools/ml_invoice_html.py; aquí sólo se
+        calculan los valores de la factura.
+        """
+        debug = _logger.isEnabledFor(logging.DEBUG)
         
-        # Logo de la compañía
-        logo_data = ''
-        if self.company_id.logo:
-            logo_data = f"data:image/png;base64,{self.company_id.logo.decode('utf-8')}"
+        # Logo de la compañía (reducido al tamaño impreso y cacheado por compañía)
+        logo_data = self._ml_company_logo_src(self.company_id)
         
         # Datos del documento
         doc_letter = self._get_safe_field(self, 'l10n_latam_document_type_id.l10n_ar_letter', 'B')
@@ -401,17 +818,16 @@ class AccountMove(models.Model):
                 pass
         
         # Datos de empresa
-        company_vat = self.company_id.vat or '30-71673444-3'
-        gross_income = self._get_safe_field(self.company_id, 'l10n_ar_gross_income_number', company_vat)
-        start_date = self._get_safe_field(self.company_id, 'l10n_ar_afip_start_date', '01/01/2020')
+        company = self.company_id
+        company_vat = company.vat or '30-71673444-3'
+        gross_income = self._get_safe_field(company, 'l10n_ar_gross_income_number', company_vat)
+        start_date = self._get_safe_field(company, 'l10n_ar_afip_start_date', '01/01/2020')
         
         # Datos del cliente
         partner_vat = self.partner_id.vat or '31556103'
         partner_resp_type = self._get_safe_field(self.partner_id, 'l10n_ar_afip_responsibility_type_id.name', 'Consumidor Final')
         
-        # Formato de números argentino
-        def format_number(num):
-            return f"{num:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        format_number = ml_invoice_html.format_number
         
         # Total en palabras
         total_words = self._num_to_words(self.amount_total)
@@ -423,459 +839,110 @@ class AccountMove(models.Model):
             # Sumar los impuestos de todas las líneas
             iva_contenido = sum(self._calculate_line_tax_amount(line) for line in self.invoice_line_ids)
         
-        # Generar URL del QR
+        # Generar URL del QR y su imagen local (sin depender de un servicio externo al renderizar)
         qr_url = self._get_afip_qr_url_safe()
+        qr_src = self._ml_qr_image_src(qr_url)
         
         # Construir líneas de productos - VERSIÓN MEJORADA PARA FACTURAS A/B
-        items_html = ""
-        _logger.info(f"Processing invoice lines for {self.name}. Total lines: {len(self.invoice_line_ids)}")
-        _logger.info(f"Invoice type: {doc_letter} ({'Without taxes' if is_invoice_a else 'With taxes included'})")
+        if debug:
+            _logger.debug("Processing invoice lines for %s. Total lines: %d", self.name, len(self.invoice_line_ids))
+            _logger.debug("Invoice type: %s (%s)", doc_letter, 'Without taxes' if is_invoice_a else 'With taxes included')
         
+        rows = []
         for line in self.invoice_line_ids:
             # Solo procesar líneas con cantidad y precio
-            if line.quantity and line.price_unit:
-                # Obtener código del producto
-                product_code = ''
-                if line.product_id and line.product_id.default_code:
-                    product_code = f'[{line.product_id.default_code}] '
-                
-                # Obtener nombre del producto/servicio
-                product_name = line.name or ''
-                if not product_name and line.product_id:
-                    product_name = line.product_id.name or 'Producto'
-                
-                # Determinar qué campos usar según el tipo de factura
-                if is_invoice_a:
-                    # Factura A: mostrar precios sin impuestos
-                    price_to_show = line.price_unit
-                    subtotal_to_show = line.price_subtotal
+            if not (line.quantity and line.price_unit):
+                continue
+            
+            # Obtener código del producto
+            product_code = ''
+            if line.product_id and line.product_id.default_code:
+                product_code = f'[{line.product_id.default_code}] '
+            
+            # Obtener nombre del producto/servicio
+            product_name = line.name or ''
+            if not product_name and line.product_id:
+                product_name = line.product_id.name or 'Producto'
+            
+            # Determinar qué campos usar según el tipo de factura
+            if is_invoice_a:
+                # Factura A: mostrar precios sin impuestos
+                price_to_show = line.price_unit
+                subtotal_to_show = line.price_subtotal
+            else:
+                # Factura B: mostrar precios con impuestos incluidos
+                # Primero intentar usar los campos con impuestos si están disponibles
+                if hasattr(line, 'price_total') and line.price_total:
+                    subtotal_to_show = line.price_total
+                    # Calcular precio unitario con impuestos
+                    price_to_show = line.price_total / line.quantity if line.quantity else line.price_unit
                 else:
-                    # Factura B: mostrar precios con impuestos incluidos
-                    # Primero intentar usar los campos con impuestos si están disponibles
-                    if hasattr(line, 'price_total') and line.price_total:
-                        subtotal_to_show = line.price_total
-                        # Calcular precio unitario con impuestos
-                        price_to_show = line.price_total / line.quantity if line.quantity else line.price_unit
-                    else:
-                        # Fallback: calcular usando los impuestos reales de la línea
-                        tax_amount = self._calculate_line_tax_amount(line)
-                        subtotal_to_show = line.price_subtotal + tax_amount
-                        
-                        # Calcular precio unitario con impuestos
-                        if line.quantity:
-                            price_to_show = (line.price_unit * line.quantity + tax_amount) / line.quantity
-                        else:
-                            price_to_show = line.price_unit
+                    # Fallback: calcular usando los impuestos reales de la línea
+                    tax_amount = self._calculate_line_tax_amount(line)
+                    subtotal_to_show = line.price_subtotal + tax_amount
                     
-                    # Log para debugging
-                    tax_info = ""
-                    if hasattr(line, 'tax_ids') and line.tax_ids:
-                        tax_names = ', '.join(tax.name for tax in line.tax_ids)
-                        tax_info = f" (Taxes: {tax_names})"
-                        
-                    _logger.info(f"Line B invoice: {line.product_id.name if line.product_id else 'N/A'}{tax_info}, "
-                                f"subtotal_excl={line.price_subtotal}, subtotal_incl={subtotal_to_show}")
-                
-                # Formatear valores
-                quantity = format_number(line.quantity)
-                uom = line.product_uom_id.name if line.product_uom_id else 'Un'
-                price = format_number(price_to_show)
-                subtotal = format_number(subtotal_to_show)
-                
-                # Agregar línea al HTML
-                items_html += f"""
-                <tr>
-                    <td>{product_code}{product_name}</td>
-                    <td class="text-center">{quantity} {uom}</td>
-                    <td class="text-right">${price}</td>
-                    <td class="text-right">$ {subtotal}</td>
-                </tr>
-                """
+                    # Calcular precio unitario con impuestos
+                    if line.quantity:
+                        price_to_show = (line.price_unit * line.quantity + tax_amount) / line.quantity
+                    else:
+                        price_to_show = line.price_unit
                 
-                _logger.info(f"Line processed: {product_name}, qty={line.quantity}, "
-                            f"price_unit={line.price_unit}, price_shown={price_to_show}, "
-                            f"subtotal_shown={subtotal_to_show}")
-        
-        # Si no hay líneas, agregar mensaje
-        if not items_html:
-            _logger.warning(f"No product lines found for invoice {self.name}")
-            items_html = """
-            <tr>
-                <td colspan="4" style="text-align: center; padding: 20px; color: #999;">
-                    No se encontraron líneas de productos
-                </td>
-            </tr>
-            """
-        
-        html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="utf-8">
-    <style>
-        @page {{
-            size: A4;
-            margin: 10mm;
-        }}
-        
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }}
-        
-        body {{
-            font-family: Arial, sans-serif;
-            font-size: 11px;
-            line-height: 1.4;
-            color: #000;
-        }}
-        
-        /* Header con 3 columnas */
-        .header {{
-            display: table;
-            width: 100%;
-            margin-bottom: 20px;
-        }}
-        
-        .header-left {{
-            display: table-cell;
-            width: 40%;
-            vertical-align: top;
-        }}
-        
-        .header-center {{
-            display: table-cell;
-            width: 20%;
-            text-align: center;
-            vertical-align: top;
-            padding: 0 10px;
-        }}
-        
-        .header-right {{
-            display: table-cell;
-            width: 40%;
-            vertical-align: top;
-            text-align: right;
-        }}
-        
-        /* Logo circular */
-        .logo-container {{
-            width: 60px;
-            height: 60px;
-            border-radius: 50%;
-            overflow: hidden;
-            background: #1a237e;
-            display: inline-block;
-            margin-bottom: 10px;
-        }}
-        
-        .logo {{
-            width: 100%;
-            height: 100%;
-            object-fit: contain;
-        }}
-        
-        .company-name {{
-            font-size: 14px;
-            font-weight: bold;
-            margin: 5px 0;
-        }}
-        
-        .company-info {{
-            font-size: 10px;
-            line-height: 1.3;
-            color: #333;
-        }}
-        
-        /* Tipo de factura */
-        .doc-type-box {{
-            font-size: 48px;
-            font-weight: bold;
-            border: 3px solid #000;
-            width: 80px;
-            height: 80px;
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            margin: 10px auto;
-        }}
-        
-        .doc-code {{
-            font-size: 10px;
-            margin-top: 5px;
-        }}
-        
-        .invoice-title {{
-            font-size: 20px;
-            font-weight: bold;
-            color: #1a237e;
-            margin-bottom: 10px;
-        }}
-        
-        .invoice-details {{
-            font-size: 11px;
-            line-height: 1.6;
-            text-align: left;
-        }}
-        
-        /* Sección cliente */
-        .client-section {{
-            background: #f5f5f5;
-            padding: 15px;
-            margin: 20px 0;
-            border-radius: 5px;
-        }}
-        
-        .client-grid {{
-            display: table;
-            width: 100%;
-        }}
-        
-        .client-col {{
-            display: table-cell;
-            width: 50%;
-            padding-right: 20px;
-        }}
-        
-        .client-row {{
-            margin-bottom: 5px;
-        }}
-        
-        .client-label {{
-            font-weight: bold;
-            color: #555;
-            display: inline-block;
-            min-width: 120px;
-        }}
-        
-        /* Tabla de items */
-        .items-table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin: 20px 0;
-        }}
-        
-        .items-table th {{
-            background: #1a237e;
-            color: white;
-            padding: 10px;
-            text-align: left;
-            font-weight: normal;
-        }}
-        
-        .items-table td {{
-            padding: 10px;
-            border-bottom: 1px solid #e0e0e0;
-        }}
-        
-        .items-table th.text-right,
-        .items-table td.text-right {{
-            text-align: right;
-        }}
-        
-        .items-table th.text-center,
-        .items-table td.text-center {{
-            text-align: center;
-        }}
-        
-        /* Totales */
-        .totals-section {{
-            margin-top: 30px;
-            text-align: right;
-        }}
-        
-        .total-box {{
-            display: inline-block;
-            background: #1a237e;
-            color: white;
-            padding: 15px 30px;
-            font-size: 18px;
-            font-weight: bold;
-            border-radius: 5px;
-            margin-top: 10px;
-        }}
-        
-        .total-words {{
-            margin-top: 10px;
-            font-style: italic;
-        }}
-        
-        /* Régimen transparencia */
-        .transparencia-box {{
-            background: #fff3cd;
-            border: 1px solid #ffeaa7;
-            padding: 10px;
-            margin: 20px 0;
-            border-radius: 5px;
-        }}
-        
-        /* Footer */
-        .footer {{
-            margin-top: 40px;
-            padding-top: 20px;
-            border-top: 2px solid #e0e0e0;
-        }}
-        
-        .footer-content {{
-            display: table;
-            width: 100%;
-        }}
-        
-        .footer-left {{
-            display: table-cell;
-            width: 70%;
-            vertical-align: top;
-        }}
-        
-        .footer-right {{
-            display: table-cell;
-            width: 30%;
-            text-align: center;
-            vertical-align: top;
-        }}
-        
-        .cae-info {{
-            background: #f5f5f5;
-            padding: 10px;
-            border-radius: 5px;
-            margin-bottom: 10px;
-        }}
-        
-        .qr-code {{
-            width: 120px;
-            height: 120px;
-        }}
-        
-        .page-info {{
-            text-align: center;
-            margin-top: 20px;
-            font-size: 10px;
-            color: #666;
-        }}
-    </style>
-</head>
-<body>
-    <!-- HEADER -->
-    <div class="header">
-        <div class="header-left">
-            <div class="logo-container">
-                {f'<img src="{logo_data}" class="logo" />' if logo_data else '<div style="width:100%;height:100%;background:#1a237e;"></div>'}
-            </div>
-            <div class="company-name">{self.company_id.name}</div>
-            <div class="company-info">
-                {self.company_id.street or 'MENDOZA 7801'}<br>
-                {self.company_id.city or 'Rosario'} - {self.company_id.state_id.name or 'Santa Fe'} - 
-                {self.company_id.zip or 'S2000'} - {self.company_id.country_id.name or 'Argentina'}<br>
-                {self.company_id.website or 'gruponewlife.com.ar'} - {self.company_id.email or 'test@gruponewlife.com'}
-            </div>
-        </div>
-        
-        <div class="header-center">
-            <div class="doc-type-box">{doc_letter}</div>
-            <div class="doc-code">Cod. {doc_type_code}</div>
-        </div>
-        
-        <div class="header-right">
-            <div class="invoice-title">{doc_type_name}</div>
-            <div class="invoice-details">
-                <strong>Número:</strong> {doc_number}<br>
-                <strong>Fecha:</strong> {self.invoice_date.strftime('%d/%m/%Y') if self.invoice_date else ''}<br>
-                <strong>IVA Responsable Inscripto</strong><br>
-                <strong>CUIT:</strong> {company_vat}<br>
-                <strong>IIBB:</strong> {gross_income}<br>
-                <strong>Inicio de las actividades:</strong> {start_date}
-            </div>
-        </div>
-    </div>
-    
-    <!-- CLIENTE -->
-    <div class="client-section">
-        <div class="client-grid">
-            <div class="client-col">
-                <div class="client-row">
-                    <span class="client-label">Cliente:</span> {self.partner_id.name}
-                </div>
-                <div class="client-row">
-                    <span class="client-label">Domicilio:</span> {self.partner_id.street or ''}, {self.partner_id.city or ''}
-                </div>
-                <div class="client-row">
-                    <span class="client-label">Cond. IVA:</span> {partner_resp_type}
-                </div>
-            </div>
-            <div class="client-col">
-                <div class="client-row">
-                    <span class="client-label">DNI:</span> {partner_vat}
-                </div>
-                <div class="client-row">
-                    <span class="client-label">Fecha de vencimiento:</span> {self.invoice_date_due.strftime('%d/%m/%Y') if self.invoice_date_due else ''}
-                </div>
-                <div class="client-row">
-                    <span class="client-label">Origen:</span> {self.invoice_origin or '00001501'}
-                </div>
-            </div>
-        </div>
-    </div>
-    
-    <!-- ITEMS -->
-    <table class="items-table">
-        <thead>
-            <tr>
-                <th style="width: 50%;">Descripción</th>
-                <th style="width: 15%;" class="text-center">Cantidad</th>
-                <th style="width: 17%;" class="text-right">Precio unitario</th>
-                <th style="width: 18%;" class="text-right">Importe</th>
-            </tr>
-        </thead>
-        <tbody>
-            {items_html}
-        </tbody>
-    </table>
-    
-    <!-- TOTALES -->
-    <div class="totals-section">
-        <div class="total-box">
-            Total $ {format_number(self.amount_total)}
-        </div>
-        <div class="total-words">
-            Importe total con letra:<br>
-            {total_words}
-        </div>
-    </div>
-    
-    <!-- Régimen de transparencia - Solo para facturas B -->
-    {f'''<div class="transparencia-box">
-        <strong>Régimen de Transparencia Fiscal al Consumidor (Ley 27.743)</strong><br>
-        IVA Contenido $ {format_number(iva_contenido)}
-    </div>''' if not is_invoice_a else ''}
-    
-    <!-- Términos -->
-    <div style="margin: 10px 0;">
-        Términos y condiciones: {self.company_id.website or 'https://gruponewlife.com.ar'}/terms
-    </div>
-    
-    <!-- FOOTER con CAE y QR -->
-    <div class="footer">
-        <div class="footer-content">
-            <div class="footer-left">
-                <div class="cae-info">
-                    <strong>CAE:</strong> {cae}<br>
-                    <strong>Fecha de vencimiento CAE:</strong> {cae_due}
-                </div>
-            </div>
-            <div class="footer-right">
-                <img src="https://api.qrserver.com/v1/create-qr-code/?size=120x120&data={qr_url}" class="qr-code" />
-            </div>
-        </div>
-    </div>
-    
-    <div class="page-info">
-        Página: 1 / 1
-    </div>
-</body>
-</html>
-"""
-        return html
+                if debug:
+                    _logger.debug("Line B invoice: %s (Taxes: %s), subtotal_excl=%s, subtotal_incl=%s",
+                                  line.product_id.name if line.product_id else 'N/A',
+                                  ', '.join(line.tax_ids.mapped('name')), line.price_subtotal, subtotal_to_show)
+            
+            rows.append({
+                'description': f'{product_code}{product_name}',
+                'quantity': line.quantity,
+                'uom': line.product_uom_id.name if line.product_uom_id else 'Un',
+                'price': price_to_show,
+                'subtotal': subtotal_to_show,
+            })
+            
+            if debug:
+                _logger.debug("Line processed: %s, qty=%s, price_unit=%s, price_shown=%s, subtotal_shown=%s",
+                              product_name, line.quantity, line.price_unit, price_to_show, subtotal_to_show)
+        
+        # Si no hay líneas, la plantilla muestra un mensaje
+        if not rows:
+            _logger.warning("No product lines found for invoice %s", self.name)
+        
+        return ml_invoice_html.render_invoice({
+            'logo_html': ml_invoice_html.logo_html(logo_data),
+            'company_name': company.name,
+            'company_street': company.street or 'MENDOZA 7801',
+            'company_city': company.city or 'Rosario',
+            'company_state': company.state_id.name or 'Santa Fe',
+            'company_zip': company.zip or 'S2000',
+            'company_country': company.country_id.name or 'Argentina',
+            'company_website': company.website or 'gruponewlife.com.ar',
+            'company_email': company.email or 'test@gruponewlife.com',
+            'doc_letter': doc_letter,
+            'doc_type_code': doc_type_code,
+            'doc_type_name': doc_type_name,
+            'doc_number': doc_number,
+            'invoice_date': self.invoice_date.strftime('%d/%m/%Y') if self.invoice_date else '',
+            'company_vat': company_vat,
+            'gross_income': gross_income,
+            'start_date': start_date,
+            'partner_name': self.partner_id.name,
+            'partner_street': self.partner_id.street or '',
+            'partner_city': self.partner_id.city or '',
+            'partner_resp_type': partner_resp_type,
+            'partner_vat': partner_vat,
+            'invoice_date_due': self.invoice_date_due.strftime('%d/%m/%Y') if self.invoice_date_due else '',
+            'invoice_origin': self.invoice_origin or '00001501',
+            'items_html': ml_invoice_html.render_rows(rows),
+            'amount_total': format_number(self.amount_total),
+            'total_words': total_words,
+            'transparencia_html': '' if is_invoice_a else ml_invoice_html.TRANSPARENCIA_TEMPLATE.format(
+                iva_contenido=format_number(iva_contenido)),
+            'terms_url': company.website or 'https://gruponewlife.com.ar',
+            'cae': cae,
+            'cae_due': cae_due,
+            'qr_src': qr_src,
+        })
 
     def _num_to_words(self, amount):
         """Convierte número a palabras en español"""
@@ -927,59 +994,36 @@ class AccountMove(models.Model):
         except:
             return f"{int(amount)} Pesos"
 
-    def _html_to_pdf_direct(self, html_content):
-        """Convierte HTML a PDF usando wkhtmltopdf directamente - BYPASS COMPLETO"""
+    def _html_to_pdf_direct(self, html_content, as_file=False, render_options=None):
+        """Convierte HTML a PDF - BYPASS COMPLETO del sistema de reportes
+
+        Usa el servicio de render externo si está configurado, si no un
+        subproceso wkhtmltopdf (HTML por stdin, PDF por stdout). Con as_file=True
+        el PDF no se lee a memoria: se devuelve en un archivo temporal anónimo.
+        `render_options` permite llamarlo desde hilos sin tocar el ORM.
+        """
+        if render_options is None:
+            render_options = self._ml_render_options()
         try:
-            from odoo.tools.misc import find_in_path
-            import subprocess
-            import tempfile
-            
-            wkhtmltopdf = find_in_path('wkhtmltopdf')
-            if not wkhtmltopdf:
-                raise UserError("wkhtmltopdf no está instalado en el servidor")
-            
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False) as html_file:
-                html_file.write(html_content)
-                html_path = html_file.name
-            
-            pdf_path = html_path.replace('.html', '.pdf')
-            
-            # Opciones para generar PDF similar al original
-            cmd = [
-                wkhtmltopdf,
-                '--encoding', 'utf-8',
-                '--page-size', 'A4',
-                '--margin-top', '10',
-                '--margin-right', '10',
-                '--margin-bottom', '10',
-                '--margin-left', '10',
-                '--dpi', '300',
-                '--disable-smart-shrinking',
-                '--print-media-type',
-                html_path,
-                pdf_path
-            ]
-            
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            out, err = process.communicate()
-            
-            if process.returncode != 0:
-                _logger.error("wkhtmltopdf error: %s", err.decode())
-                raise UserError(f"Error generando PDF: {err.decode()}")
-            
-            with open(pdf_path, 'rb') as pdf_file:
-                pdf_content = pdf_file.read()
-            
-            import os
-            os.unlink(html_path)
-            os.unlink(pdf_path)
-            
-            return pdf_content
-            
+            return ml_render.html_to_pdf(html_content, as_file=as_file, **render_options)
         except Exception as e:
             _logger.error("Error in _html_to_pdf_direct: %s", str(e))
             raise
 
+    @api.model
+    def _ml_pdf_engine(self):
+        """Motor de PDF de la configuración activa: 'bypass' o 'report'"""
+        config = self.env['mercadolibre.config'].get_active_config()
+        return config.pdf_engine if config else 'bypass'
+
+    @api.model
+    def _ml_render_options(self):
+        """Parámetros de render de la configuración activa (dict simple, seguro para hilos)"""
+        config = self.env['mercadolibre.config'].get_active_config()
+        if not config:
+            return {}
+        return config._ml_render_options()
+
     def _get_afip_qr_url_safe(self):
         """Genera la URL para el QR de AFIP - Versión segura"""
         try:
@@ -1031,6 +1075,46 @@ class AccountMove(models.Model):
             # URL del QR de la factura de ejemplo
             return "https://www.afip.gob.ar/fe/qr/?p=eyJ2ZXIiOiAxLCAiZmVjaGEiOiAiMjAyNS0wNy0xMCIsICJjdWl0IjogMzA3MTY3MzQ0NDMsICJwdG9WdGEiOiAxLCAidGlwb0NtcCI6IDYsICJucm9DbXAiOiAzMDUsICJpbXBvcnRlIjogMzU5MC4wLCAibW9uZWRhIjogIlBFUyIsICJjdHoiOiAxLjAsICJ0aXBvQ29kQXV0IjogIkUiLCAiY29kQXV0IjogNzUyODM4OTUwMTEzNjIsICJ0aXBvRG9jUmVjIjogOTYsICJucm9Eb2NSZWMiOiAzMTU1NjEwM30="
 
+    @api.model
+    def _ml_company_logo_src(self, company):
+        """Logo de la compañía como data URI compartido por todas sus facturas"""
+        if not company.logo:
+            return ''
+        # Cambiar el logo actualiza la compañía o su partner (el logo se guarda en el partner)
+        return self._ml_logo_data_uri(company.id, str(company.write_date), str(company.partner_id.write_date))
+
+    @api.model
+    @tools.ormcache('company_id', 'company_write_date', 'partner_write_date')
+    def _ml_logo_data_uri(self, company_id, company_write_date, partner_write_date):
+        logo = base64.b64decode(self.env['res.company'].sudo().browse(company_id).logo)
+        try:
+            # El logo se imprime en un círculo de 60px: a 300 DPI alcanza con LOGO_PRINT_SIZE
+            logo = image_process(logo, size=LOGO_PRINT_SIZE, output_format='PNG')
+        except Exception as e:
+            _logger.warning("Could not resize company logo for ML invoices: %s", e)
+        mimetype = 'image/svg+xml' if logo.lstrip()[:1] == b'<' else 'image/png'
+        return f'data:{mimetype};base64,' + base64.b64encode(logo).decode()
+
+    @api.model
+    def _ml_qr_image_src(self, qr_url):
+        """Imagen del QR AFIP como data URI PNG generada localmente.
+
+        Se cachea por contenido: re-renderizar una factura no vuelve a generarla.
+        Si la generación local falla se usa el servicio externo como antes.
+        """
+        try:
+            return self._ml_qr_data_uri(qr_url)
+        except Exception as e:
+            _logger.warning("Local QR generation failed, using api.qrserver.com: %s", e)
+            return f"https://api.qrserver.com/v1/create-qr-code/?size=120x120&data={quote(qr_url, safe='')}"
+
+    @api.model
+    @tools.ormcache('qr_url')
+    def _ml_qr_data_uri(self, qr_url):
+        # Generador de códigos de barras de Odoo (reportlab), el mismo de los reportes QWeb
+        png = self.env['ir.actions.report'].barcode('QR', qr_url, width=240, height=240)
+        return 'data:image/png;base64,' + base64.b64encode(png).decode()
+
     def _handle_upload_error(self, error_msg):
         """Maneja errores de upload"""
         self.write({
@@ -1045,8 +1129,12 @@ class AccountMove(models.Model):
             ml_pack_id=self.ml_pack_id
         )
 
-    def _upload_to_ml_api(self, pdf_content):
-        """Upload a ML API usando la configuración del módulo"""
+    def _upload_to_ml_api(self, pdf_file):
+        """Upload a ML API usando la configuración del módulo.
+
+        `pdf_file` es un archivo binario abierto (o bytes): el cuerpo multipart
+        se envía en streaming sin copiar el PDF a memoria.
+        """
         try:
             # Obtener configuración activa
             ml_config = self.env['mercadolibre.config'].get_active_config()
@@ -1062,52 +1150,671 @@ class AccountMove(models.Model):
             ml_api_url = f'https://api.mercadolibre.com/packs/{self.ml_pack_id}/fiscal_documents'
             
             # Preparar el archivo
-            files = {
-                'fiscal_document': (f'factura_{self.name}.pdf', pdf_content, 'application/pdf')
-            }
+            if isinstance(pdf_file, bytes):
+                pdf_file = io.BytesIO(pdf_file)
+            body = ml_http.MultipartFileStream(
+                'fiscal_document', f'factura_{self.name}.pdf', pdf_file, 'application/pdf')
             
-            # Headers con el token de la configuración
-            headers = {
-                'Authorization': f'Bearer {ml_config.access_token}',
-                'Accept': 'application/json'
-            }
+            # El token lo agrega _ml_request (renovándolo si está por vencer)
+            headers = {'Accept': 'application/json', 'Content-Type': body.content_type}
             
-            _logger.info("Uploading to ML: %s (%d bytes)", self.display_name, len(pdf_content))
+            _logger.info("Uploading to ML: %s (%d bytes)", self.display_name, len(body))
             _logger.info("URL: %s", ml_api_url)
             _logger.info("ML User ID: %s", ml_config.ml_user_id)
             
-            response = requests.post(ml_api_url, files=files, headers=headers, timeout=30)
+            response = ml_config._ml_request('POST', ml_api_url, data=body, headers=headers, timeout=30)
             
             _logger.info("Response status: %s", response.status_code)
             _logger.info("Response headers: %s", response.headers)
             _logger.info("Response body: %s", response.text[:1000])
             
-            if response.status_code in [200, 201]:
+            result = self._ml_upload_result_from_response(response, self.ml_pack_id)
+            if result['success']:
                 _logger.info("✅ Upload successful")
-                return {'success': True, 'data': response.json() if response.content else {}}
-            elif response.status_code == 401:
-                # Token expirado
-                raise UserError("Token expirado. Por favor, actualice el token en la configuración de MercadoLibre")
-            elif response.status_code == 404:
-                raise UserError(f"Pack ID {self.ml_pack_id} no encontrado en MercadoLibre")
             else:
-                error_data = response.json() if response.content else {}
-                error_msg = error_data.get('message', f"HTTP {response.status_code}: {response.text[:200]}")
-                _logger.error("❌ Upload failed: %s", error_msg)
-                return {'success': False, 'error': error_msg}
+                _logger.error("❌ Upload failed: %s", result['error'])
+            return result
                 
         except requests.exceptions.Timeout:
             error_msg = "Timeout al conectar con MercadoLibre"
             _logger.error(error_msg)
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg, 'error_type': ml_http.ERROR_TRANSIENT}
         except requests.exceptions.RequestException as e:
             error_msg = f"Error de conexión: {str(e)}"
             _logger.error(error_msg)
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg, 'error_type': ml_http.ERROR_TRANSIENT}
+        except MLUploadError as e:
+            # Ya clasificado (ej. refresh token rechazado = error de autenticación)
+            _logger.error("❌ Upload failed: %s", e)
+            return {'success': False, 'error': str(e), 'error_type': e.error_type}
         except Exception as e:
             error_msg = f"Error inesperado: {str(e)}"
             _logger.error("❌ Upload exception: %s", error_msg, exc_info=True)
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg, 'error_type': getattr(e, 'error_type', ml_http.ERROR_TRANSIENT)}
+
+    @api.model
+    def _ml_upload_result_from_response(self, response, pack_id):
+        """Interpreta la respuesta de POST /packs/{pack_id}/fiscal_documents (requests o httpx)"""
+        if response.status_code in [200, 201]:
+            return {'success': True, 'data': response.json() if response.content else {}}
+        elif response.status_code == 401:
+            # Token rechazado aún después de intentar renovarlo
+            error_msg = "Token expirado. Por favor, actualice el token en la configuración de MercadoLibre"
+            return {'success': False, 'error': error_msg, 'error_type': ml_http.ERROR_AUTH}
+        elif response.status_code == 404:
+            error_msg = f"Pack ID {pack_id} no encontrado en MercadoLibre"
+            return {'success': False, 'error': error_msg, 'error_type': ml_http.ERROR_PERMANENT}
+        try:
+            error_data = response.json() if response.content else {}
+        except ValueError:
+            error_data = {}
+        error_msg = error_data.get('message') or f"HTTP {response.status_code}: {response.text[:200]}"
+        return {'success': False, 'error': error_msg, 'error_type': ml_http.classify_status(response.status_code)}
+
+    # Idempotencia de uploads
+    def _ml_needs_upload_precheck(self):
+        """Indica si un intento anterior pudo haber llegado a ML sin quedar registrado"""
+        self.ensure_one()
+        return bool(self.ml_document_id or self.last_upload_attempt or self.env.context.get('ml_upload_precheck'))
+
+    def _ml_find_existing_uploads(self, pdf_hashes):
+        """Consulta en lote los documentos fiscales de los packs y devuelve
+        {invoice_id: document_id} de las facturas que ML ya tiene.
+
+        Si la factura conoce su documento, se considera subida sólo si ML lo
+        conserva y el PDF no cambió. Si no lo conoce (el worker cayó antes de
+        confirmar la respuesta), un pack puede tener varios documentos (factura,
+        nota de crédito, facturas parciales): sólo se toma como nuestro el único
+        documento que no es de otro comprobante del pack, y sólo si ésta es la
+        única factura del pack sin documento. En cualquier otro caso se sube.
+        """
+        if not self:
+            return {}
+        config = self.env['mercadolibre.config'].get_active_config()
+        if not config:
+            return {}
+        pack_ids = self.mapped('ml_pack_id')
+        remote = config._ml_fetch_fiscal_documents(pack_ids)
+
+        # Documentos ya asignados y comprobantes sin documento, por pack
+        known_documents, unmatched_moves = {}, {}
+        for move in self.sudo().search_read(
+                [('ml_pack_id', 'in', pack_ids), ('state', '!=', 'cancel')],
+                ['ml_pack_id', 'ml_document_id']):
+            if move['ml_document_id']:
+                known_documents.setdefault(move['ml_pack_id'], {})[move['ml_document_id']] = move['id']
+            else:
+                unmatched_moves.setdefault(move['ml_pack_id'], set()).add(move['id'])
+
+        existing = {}
+        for invoice in self:
+            documents = remote.get(invoice.ml_pack_id)
+            if not documents:
+                continue
+            if invoice.ml_document_id:
+                same_content = pdf_hashes.get(invoice.id) in (None, invoice.ml_pdf_hash)
+                if invoice.ml_document_id in documents and same_content:
+                    existing[invoice.id] = invoice.ml_document_id
+                continue
+            claimed = known_documents.get(invoice.ml_pack_id, {})
+            unclaimed = [doc_id for doc_id in documents if claimed.get(doc_id, invoice.id) == invoice.id]
+            if len(unclaimed) == 1 and unmatched_moves.get(invoice.ml_pack_id) == {invoice.id}:
+                existing[invoice.id] = unclaimed[0]
+        return existing
+
+    def _ml_mark_already_uploaded(self, document_id):
+        """Marca como subida una factura que ML ya tenía, sin volver a subirla"""
+        self.ensure_one()
+        self.write({
+            'upload_status': 'uploaded',
+            'upload_error': False,
+            'ml_uploaded': True,
+            'ml_upload_date': self.ml_upload_date or fields.Datetime.now(),
+            'ml_document_id': document_id,
+        })
+        self.env['mercadolibre.log'].create_log(
+            invoice_id=self.id,
+            status='success',
+            message=f'Upload skipped: document {document_id} already present in MercadoLibre',
+            ml_pack_id=self.ml_pack_id
+        )
+
+    # Cola de upload y motor concurrente (cron)
+    def _ml_is_upload_eligible(self):
+        """Indica si la factura todavía debe subirse a ML"""
+        self.ensure_one()
+        return bool(self.is_ml_sale and self.ml_pack_id and self.state == 'posted' and not self.ml_uploaded)
+
+    def _ml_enqueue_upload(self, priority=10):
+        """Encola para upload las facturas elegibles del recordset"""
+        eligible = self.filtered(lambda m: m._ml_is_upload_eligible())
+        return self.env['mercadolibre.upload.job'].sudo()._enqueue(eligible, priority=priority)
+
+    def _post(self, soft=True):
+        posted = super()._post(soft=soft)
+        jobs = posted._ml_enqueue_upload()
+        # Etapa de pre-render: generar el PDF en segundo plano, antes de que llegue el upload
+        config = self.env['mercadolibre.config'].get_active_config()
+        if jobs and config and config.prerender_pdfs:
+            cron = self.env.ref('ml_invoice_bridge_secure.cron_prerender_ml_pdfs', raise_if_not_found=False)
+            if cron:
+                cron.sudo()._trigger()
+        return posted
+
+    def write(self, vals):
+        res = super().write(vals)
+        # Liberar los PDFs cacheados de facturas modificadas (la clave ya no coincidiría)
+        if set(vals) - PDF_CACHE_NEUTRAL_FIELDS:
+            stale = self.filtered('ml_pdf_cache_key')
+            if stale:
+                stale.sudo().write({'ml_pdf_cache': False, 'ml_pdf_cache_key': False})
+                # Que el pre-render vuelva a generarlos
+                self.env['mercadolibre.upload.job'].sudo().search([
+                    ('invoice_id', 'in', stale.ids), ('prerendered_at', '!=', False),
+                ]).write({'prerendered_at': False})
+        # Facturas publicadas que recién ahora tienen datos ML (Fix ML Data o
+        # recálculo del compute): se evalúan los valores guardados, no vals
+        if set(vals) & ML_DATA_FIELDS and not self.env.context.get('ml_skip_enqueue'):
+            self.filtered(lambda m: m.state == 'posted')._ml_enqueue_upload()
+        return res
+
+    @api.model
+    def _ml_upload_in_new_cursor(self, dbname, uid, context, job_id, invoice_id):
+        """Procesa un job de upload en su propio cursor - se ejecuta en un hilo del pool"""
+        threading.current_thread().dbname = dbname
+        with self.pool.cursor() as cr:
+            env = api.Environment(cr, uid, context)
+            job = env['mercadolibre.upload.job'].browse(job_id)
+            invoice = env['account.move'].browse(invoice_id)
+            try:
+                # Validación de integridad (la factura pudo cambiar desde que se encoló)
+                if not invoice.exists() or not invoice._ml_is_upload_eligible():
+                    if invoice.exists() and not invoice.ml_uploaded:
+                        env['mercadolibre.log'].create_log(
+                            invoice_id=invoice.id,
+                            status='error',
+                            message='Cron skipped: Invoice failed integrity check',
+                            ml_pack_id=invoice.ml_pack_id or 'N/A'
+                        )
+                    job._mark_done()
+                    return {'invoice_id': invoice_id, 'success': True, 'skipped': True}
+
+                # Generar el PDF fuera del savepoint: si el upload falla queda cacheado para el
+                # reintento. El mismo archivo se sube, sin renderizar de nuevo lo que no se cachea
+                with invoice._ml_generate_pdf(as_file=True) as pdf_file, cr.savepoint():
+                    invoice.with_context(
+                        ml_upload_precheck=job.claim_count > 1, ml_upload_job_claimed=True,
+                    )._ml_upload_single(pdf_file)
+                job._mark_done()
+                return {'invoice_id': invoice_id, 'success': True}
+
+            except Exception as e:
+                # El savepoint revirtió el estado de error: registrarlo de nuevo
+                error_msg = str(e)
+                error_type = getattr(e, 'error_type', ml_http.ERROR_TRANSIENT)
+                try:
+                    invoice._handle_upload_error(error_msg)
+                    job._mark_failed(error_msg, error_type)
+                except Exception:
+                    _logger.exception("Could not record upload error for invoice %s", invoice_id)
+                return {'invoice_id': invoice_id, 'success': False, 'error': error_msg, 'error_type': error_type}
+
+    @api.model
+    def _cron_auto_upload_ml_invoices(self):
+        """Punto de entrada del cron - nunca falla para no marcar el cron como fallado"""
+        start_time = time.monotonic()
+        try:
+            self._ml_run_upload_pool()
+        except Exception as e:
+            self.env.cr.rollback()
+            _logger.exception("Critical ML upload cron error")
+            try:
+                self.env['mercadolibre.log'].create_cron_log(
+                    'error',
+                    'Critical cron error on %s after %.1fs: %s' % (
+                        self.env.cr.dbname, time.monotonic() - start_time, str(e)[:400])
+                )
+            except Exception:
+                pass
+
+    @api.model
+    def _ml_run_upload_pool(self):
+        """Sube facturas ML pendientes de la cola con el motor configurado.
+
+        El tamaño del pool, la cantidad de facturas y el tiempo máximo por
+        ejecución se toman de mercadolibre.config.
+        """
+        start_time = time.monotonic()
+        log_model = self.env['mercadolibre.log']
+        current_db = self.env.cr.dbname
+
+        config = self.env['mercadolibre.config'].get_active_config()
+        if not config:
+            log_model.create_cron_log('error', 'Cron stopped: No active MercadoLibre configuration found')
+            return
+        if not config.auto_upload:
+            log_model.create_cron_log('error', 'Cron stopped: Auto upload disabled in MercadoLibre config')
+            return
+
+        engine = config._ml_upload_engine()
+        deadline = start_time + config.upload_time_limit
+        job_model = self.env['mercadolibre.upload.job']
+
+        log_model.create_cron_log(
+            'success',
+            'Cron started on %s - %d jobs queued (engine: %s)' % (current_db, job_model._pending_count(), engine)
+        )
+        # Liberar la transacción principal antes de despachar trabajo
+        self.env.cr.commit()
+
+        if engine == 'async':
+            success_count, error_count, stop_reason = self._ml_run_upload_async(config, deadline)
+        else:
+            success_count, error_count, stop_reason = self._ml_run_upload_threads(config, deadline)
+
+        execution_time = time.monotonic() - start_time
+        remaining_invoices = job_model._pending_count()
+
+        message = 'Cron execution on %s completed in %.1fs - Success: %d, Errors: %d, Remaining: %d' % (
+            current_db, execution_time, success_count, error_count, remaining_invoices)
+        if stop_reason:
+            message += ' - Stopped early: %s' % stop_reason
+        log_model.create_cron_log('success' if error_count == 0 else 'error', message)
+
+    @api.model
+    def _ml_run_upload_threads(self, config, deadline):
+        """Motor thread pool: cada factura se procesa y se confirma en su propio
+        cursor, por lo que un error en una factura no revierte las demás"""
+        pool_size = config._ml_db_thread_limit(config.upload_pool_size)
+        if pool_size < config.upload_pool_size:
+            _logger.warning("Upload Workers limited to %d (of %d) to stay within db_maxconn=%d",
+                            pool_size, config.upload_pool_size, tools.config['db_maxconn'])
+        job_model = self.env['mercadolibre.upload.job']
+        current_db = self.env.cr.dbname
+        success_count = 0
+        error_count = 0
+        consecutive_errors = 0
+        dispatched = 0
+        stop_reason = None
+        claimed = []
+        context = dict(self.env.context)
+
+        with ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='ml_upload') as executor:
+            running = set()
+            while True:
+                # Despachar mientras haya lugar en el pool y presupuesto de tiempo y lote
+                while len(running) < pool_size and not stop_reason:
+                    if time.monotonic() >= deadline:
+                        stop_reason = 'time limit of %ds reached' % config.upload_time_limit
+                        break
+                    if dispatched >= config.upload_batch_limit:
+                        break
+                    if not claimed:
+                        # Tomar sólo lo que el pool puede procesar ahora: el resto
+                        # queda disponible para otras ejecuciones solapadas
+                        claimed = job_model._claim(min(pool_size, config.upload_batch_limit - dispatched),
+                                                   pdf_grace_minutes=config._ml_pdf_grace_minutes())
+                        if not claimed:
+                            break
+                    job_id, invoice_id = claimed.pop(0)
+                    running.add(executor.submit(
+                        self._ml_upload_in_new_cursor, current_db, self.env.uid, context, job_id, invoice_id
+                    ))
+                    dispatched += 1
+                if not running:
+                    break
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'success': False, 'error': str(e)}
+                    if result.get('success'):
+                        success_count += 1
+                        consecutive_errors = 0
+                    else:
+                        error_count += 1
+                        # Un error permanente es propio de la factura, no indica falla de la API
+                        if result.get('error_type') != ml_http.ERROR_PERMANENT:
+                            consecutive_errors += 1
+
+                # CIRCUIT BREAKER: no despachar más trabajo, dejar terminar lo que está en curso
+                if consecutive_errors >= 3 and not stop_reason:
+                    stop_reason = '%d consecutive errors' % consecutive_errors
+
+        return success_count, error_count, stop_reason
+
+    @api.model
+    def _ml_run_upload_async(self, config, deadline):
+        """Motor asyncio: toma la cola en tramos de `async_concurrency` facturas; cada
+        tramo genera sus PDFs, los sube multiplexados en un único event loop y
+        confirma sus resultados en una sola transacción"""
+        chunk_size = max(1, config.async_concurrency)
+        job_model = self.env['mercadolibre.upload.job']
+        success_count = 0
+        error_count = 0
+        consecutive_errors = 0
+        dispatched = 0
+        stop_reason = None
+
+        while dispatched < config.upload_batch_limit:
+            if time.monotonic() >= deadline:
+                stop_reason = 'time limit of %ds reached' % config.upload_time_limit
+                break
+            claimed = job_model._claim(min(chunk_size, config.upload_batch_limit - dispatched),
+                                       pdf_grace_minutes=config._ml_pdf_grace_minutes())
+            if not claimed:
+                break
+            dispatched += len(claimed)
+
+            jobs = job_model.browse([job_id for job_id, invoice_id in claimed])
+            invoices = self.browse([invoice_id for job_id, invoice_id in claimed])
+            eligible = invoices.filtered(lambda m: m._ml_is_upload_eligible())
+            jobs.filtered(lambda j: j.invoice_id not in eligible)._mark_done()
+
+            results = eligible._ml_upload_batch(config, deadline, jobs.exists())
+            # Cada tramo se confirma: un error posterior no revierte lo ya subido
+            self.env.cr.commit()
+
+            for invoice in eligible:
+                result = results.get(invoice.id)
+                if result is None:
+                    continue
+                if result.get('success'):
+                    success_count += 1
+                    consecutive_errors = 0
+                else:
+                    error_count += 1
+                    # Un error permanente es propio de la factura, no indica falla de la API
+                    if result.get('error_type') != ml_http.ERROR_PERMANENT:
+                        consecutive_errors += 1
+
+            if len(results) < len(eligible):
+                stop_reason = 'time limit of %ds reached' % config.upload_time_limit
+                break
+            # CIRCUIT BREAKER: no tomar más tramos
+            if consecutive_errors >= 3:
+                stop_reason = '%d consecutive errors' % consecutive_errors
+                break
+
+        return success_count, error_count, stop_reason
+
+    def _ml_upload_batch(self, config, deadline, jobs=None):
+        """Sube el recordset en lote: PDFs en paralelo, pre-chequeo de idempotencia,
+        transmisión concurrente y escritura agrupada. Devuelve {invoice_id: resultado};
+        las facturas no iniciadas antes de `deadline` no aparecen."""
+        jobs = jobs or self.env['mercadolibre.upload.job']
+        reclaimed = jobs.filtered(lambda j: j.claim_count > 1).invoice_id
+        payloads, results = self._ml_prepare_upload_payloads(
+            max_workers=config.render_pool_size, batch_size=config.render_batch_size)
+        try:
+            pending = self._ml_skip_existing_uploads(payloads, results, force=reclaimed)
+            results.update(config._ml_transmit(pending, deadline))
+        finally:
+            # Los PDFs son archivos temporales abiertos: liberarlos siempre
+            for payload in payloads:
+                payload['pdf'].close()
+        self._ml_apply_upload_results(results, jobs, payloads)
+        return results
+
+    def _ml_prepare_upload_payloads(self, max_workers=4, batch_size=1):
+        """Genera los PDFs del recordset para un upload en lote.
+
+        Cada payload lleva el PDF como archivo abierto ('pdf'), que el llamador
+        debe cerrar. Con el motor 'bypass' el HTML se arma en el hilo actual (usa
+        el ORM) y los PDFs se generan en paralelo en hasta `max_workers` hilos,
+        cada uno con lotes de `batch_size` facturas por invocación de wkhtmltopdf.
+        Con el motor 'report' se usa el reporte de factura nativo.
+
+        Devuelve (payloads, failures): payloads listos para transmitir y un dict
+        {invoice_id: resultado} con las facturas cuyo PDF no pudo generarse.
+        """
+        failures = {}
+
+        def fail(invoice, error):
+            failures[invoice.id] = {
+                'success': False,
+                'error': f"No se pudo generar el PDF legal de la factura: {error}",
+                'error_type': ml_http.ERROR_TRANSIENT,
+            }
+
+        cache_keys = {}
+        if self._ml_pdf_engine() == 'report':
+            report_pdfs = self._ml_render_report_pdfs(as_file=True)
+            cached, rendered = [], [(invoice, report_pdfs[invoice.id]) for invoice in self]
+        else:
+            cached, rendered = self._ml_render_bypass_pdfs(max_workers, batch_size, fail, cache_keys)
+
+        payloads = []
+        for invoice, pdf_file in rendered:
+            if isinstance(pdf_file, Exception):
+                fail(invoice, pdf_file)
+                continue
+            if ml_http.file_size(pdf_file) <= 1000:
+                pdf_file.close()
+                fail(invoice, 'PDF vacío')
+                continue
+            if invoice in cache_keys:
+                invoice._ml_pdf_cache_put(cache_keys[invoice], pdf_file)
+            cached.append((invoice, pdf_file))
+        for invoice, pdf_file in cached:
+            payloads.append({
+                'invoice_id': invoice.id,
+                'pack_id': invoice.ml_pack_id,
+                'filename': f'factura_{invoice.name}.pdf',
+                'pdf': pdf_file,
+                'pdf_hash': ml_http.file_sha256(pdf_file),
+            })
+        return payloads, failures
+
+    def _ml_render_bypass_pdfs(self, max_workers, batch_size, fail, cache_keys):
+        """PDFs del generador HTML propio: (cached, rendered) como listas de (factura, archivo).
+        Completa `cache_keys` con la clave de cache de cada factura renderizada."""
+        # Cargar en bloque lo que usa la plantilla en lugar de una consulta por factura
+        self.mapped('invoice_line_ids.product_id')
+        self.mapped('invoice_line_ids.tax_ids')
+        self.mapped('partner_id.country_id')
+
+        html_by_invoice = {}
+        for invoice in self:
+            try:
+                html_by_invoice[invoice] = invoice._generate_exact_invoice_html()
+            except Exception as e:
+                fail(invoice, e)
+
+        # PDFs ya generados para el mismo contenido: no se vuelven a renderizar
+        render_options = self._ml_render_options()
+        profile = render_options.get('profile')
+        cache_keys.update({invoice: invoice._ml_pdf_cache_key(html, profile) for invoice, html in html_by_invoice.items()})
+        cached = []
+        for invoice, cache_key in cache_keys.items():
+            pdf_file = invoice._ml_pdf_cache_get(cache_key, as_file=True)
+            if pdf_file is not None:
+                cached.append((invoice, pdf_file))
+                del html_by_invoice[invoice]
+
+        items = list(html_by_invoice.items())
+        batch_size = max(batch_size, 1)
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+        def render(batch):
+            pdfs = ml_render.html_to_pdf_batch(
+                [html_content for invoice, html_content in batch], as_file=True, **render_options)
+            return [(invoice, pdf) for (invoice, html_content), pdf in zip(batch, pdfs)]
+
+        rendered = []
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(len(batches), max(max_workers, 1))) as executor:
+                rendered = [item for batch in executor.map(render, batches) for item in batch]
+        return cached, rendered
+
+    def _ml_skip_existing_uploads(self, payloads, results, force=None):
+        """Quita de `payloads` las facturas que ML ya tiene y registra su resultado en `results`.
+
+        La consulta se hace sólo para facturas con intentos previos (o las de `force`).
+        """
+        candidates = self.filtered(lambda m: m._ml_needs_upload_precheck() or (force and m in force))
+        if not candidates:
+            return payloads
+        existing = candidates._ml_find_existing_uploads({p['invoice_id']: p['pdf_hash'] for p in payloads})
+        for invoice_id, document_id in existing.items():
+            results[invoice_id] = {'success': True, 'already_uploaded': True, 'document_id': document_id}
+        return [p for p in payloads if p['invoice_id'] not in existing]
+
+    def _ml_apply_upload_results(self, results, jobs=None, payloads=None):
+        """Escribe en bloque el resultado de un upload en lote en facturas, logs y jobs.
+
+        Las facturas del recordset sin resultado (no iniciadas) devuelven su job
+        a la cola sin consumir un intento.
+        """
+        now = fields.Datetime.now()
+        jobs = jobs or self.env['mercadolibre.upload.job']
+        jobs_by_invoice = {job.invoice_id.id: job for job in jobs}
+        hashes = {p['invoice_id']: p['pdf_hash'] for p in payloads or []}
+
+        # Agrupar facturas y jobs con los mismos valores: un write por grupo
+        invoice_writes = {}
+        documents = []
+        failed_jobs = {}
+        done_jobs = jobs.browse()
+        requeued_jobs = jobs.browse()
+        log_vals = []
+        for invoice in self:
+            result = results.get(invoice.id)
+            job = jobs_by_invoice.get(invoice.id)
+            if result is None:
+                if job:
+                    requeued_jobs |= job
+                continue
+            if result.get('success'):
+                vals = {
+                    'upload_status': 'uploaded',
+                    'upload_error': False,
+                    'ml_uploaded': True,
+                    'ml_upload_date': now,
+                    'last_upload_attempt': now,
+                }
+                if result.get('already_uploaded'):
+                    documents.append((invoice.id, result['document_id'], invoice.ml_pdf_hash or None))
+                    message = f"Upload skipped: document {result['document_id']} already present in MercadoLibre"
+                else:
+                    document_ids = ml_http.extract_document_ids(result.get('data'))
+                    documents.append((invoice.id, document_ids[0] if document_ids else None,
+                                      hashes.get(invoice.id)))
+                    message = 'Upload successful (batch)'
+                log_vals.append({
+                    'invoice_id': invoice.id,
+                    'status': 'success',
+                    'message': message,
+                    'ml_pack_id': invoice.ml_pack_id,
+                    'ml_response': str(result.get('data', {})),
+                })
+                if job:
+                    done_jobs |= job
+            else:
+                error_msg = result.get('error', 'Unknown error')
+                error_type = result.get('error_type', ml_http.ERROR_TRANSIENT)
+                vals = {
+                    'upload_status': 'error',
+                    'upload_error': error_msg,
+                    'last_upload_attempt': now,
+                }
+                log_vals.append({
+                    'invoice_id': invoice.id,
+                    'status': 'error',
+                    'message': error_msg,
+                    'ml_pack_id': invoice.ml_pack_id,
+                })
+                if job:
+                    failed_jobs[error_msg, error_type] = failed_jobs.get((error_msg, error_type), jobs.browse()) | job
+            key = tuple(sorted(vals.items()))
+            invoice_writes[key] = invoice_writes.get(key, self.browse()) | invoice
+
+        for vals, invoices in invoice_writes.items():
+            invoices.write(dict(vals))
+        if documents:
+            self._ml_write_document_ids(documents)
+        if requeued_jobs:
+            requeued_jobs.write({'state': 'pending', 'claimed_at': False})
+        done_jobs._mark_done()
+        for (error_msg, error_type), failed in failed_jobs.items():
+            failed._mark_failed(error_msg, error_type)
+        self.env['mercadolibre.log'].create(log_vals)
+
+    def _ml_write_document_ids(self, documents):
+        """Guarda ml_document_id/ml_pdf_hash de muchas facturas en un solo UPDATE.
+
+        `documents` es una lista de (invoice_id, document_id, pdf_hash). Son valores
+        distintos por factura, así que un write() agrupado no es posible.
+        """
+        self.flush_model(['ml_document_id', 'ml_pdf_hash'])
+        invoice_ids, document_ids, pdf_hashes = zip(*documents)
+        self.env.cr.execute("""
+            UPDATE account_move am
+               SET ml_document_id = v.document_id,
+                   ml_pdf_hash = v.pdf_hash
+              FROM unnest(%s::int[], %s::varchar[], %s::varchar[]) AS v(id, document_id, pdf_hash)
+             WHERE am.id = v.id
+        """, (list(invoice_ids), list(document_ids), list(pdf_hashes)))
+        self.browse(invoice_ids).invalidate_recordset(['ml_document_id', 'ml_pdf_hash'])
+
+    def action_upload_to_ml_bulk(self):
+        """Sube a ML las facturas seleccionadas en lote.
+
+        Hasta BULK_SYNC_LIMIT facturas se suben en el momento; selecciones más
+        grandes se encolan con prioridad y se dispara el cron para no exceder
+        el timeout de la petición HTTP.
+        """
+        config = self.env['mercadolibre.config'].get_active_config()
+        if not config:
+            raise UserError("No hay configuración activa de MercadoLibre")
+
+        candidates = self.filtered(lambda m: m._ml_is_upload_eligible())
+        skipped = len(self) - len(candidates)
+        if not candidates:
+            return self._ml_notification(
+                'Sin facturas para subir',
+                'Ninguna de las %d facturas seleccionadas está pendiente de upload a ML' % len(self),
+                'warning')
+
+        if len(candidates) > BULK_SYNC_LIMIT:
+            candidates._ml_enqueue_upload(priority=BULK_UPLOAD_PRIORITY)
+            self.env.ref('ml_invoice_bridge_secure.cron_auto_upload_ml_invoices').sudo()._trigger()
+            return self._ml_notification(
+                'Upload encolado',
+                '%d facturas encoladas para upload en segundo plano (%d omitidas)' % (len(candidates), skipped),
+                'info')
+
+        jobs = self.env['mercadolibre.upload.job'].sudo()._claim_invoices(candidates, priority=BULK_UPLOAD_PRIORITY)
+        # Las de dead-letter no se toman: se reviven desde la cola (Requeue)
+        dead = (candidates - jobs.invoice_id).filtered(lambda m: m.upload_status == 'dead')
+        busy = candidates - jobs.invoice_id - dead
+        skipped += len(dead)
+        deadline = time.monotonic() + config.upload_time_limit
+        results = jobs.invoice_id._ml_upload_batch(config, deadline, jobs)
+
+        success_count = sum(1 for result in results.values() if result.get('success'))
+        error_count = len(results) - success_count
+        queued = len(jobs) - len(results) + len(busy)
+        message = 'Subidas: %d | Errores: %d | En cola: %d | Omitidas: %d' % (
+            success_count, error_count, queued, skipped)
+        _logger.info("Bulk ML upload of %d invoices: %s", len(self), message)
+        return self._ml_notification(
+            'Upload masivo completado', message, 'success' if not error_count else 'warning')
+
+    @api.model
+    def _ml_notification(self, title, message, notification_type='info'):
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': title,
+                'message': message,
+                'type': notification_type,
+                'sticky': notification_type == 'warning',
+            }
+        }
 
     def action_reset_ml_upload(self):
         """Resetea el estado de upload de ML - SOLO PARA ADMIN"""
@@ -1123,6 +1830,8 @@ class AccountMove(models.Model):
             'ml_upload_date': False,
             'last_upload_attempt': False
         })
+        # Reset explícito: también revive el job si estaba en dead-letter
+        self._ml_enqueue_upload().filtered(lambda j: j.state == 'dead').action_requeue()
         
         # Crear log de reset
         self.env['mercadolibre.log'].create_log(
@@ -1152,11 +1861,11 @@ class AccountMove(models.Model):
             _logger.info("=== TESTING PDF GENERATION WITH BYPASS ===")
             pdf_content = self._generate_pdf_direct_bypass()
             
-            # Guardar como adjunto para verificación
+            # Guardar como adjunto para verificación (raw evita la copia en base64)
             attachment = self.env['ir.attachment'].create({
                 'name': f'TEST_BYPASS_PDF_{self.name}_{fields.Datetime.now()}.pdf',
                 'type': 'binary',
-                'datas': base64.b64encode(pdf_content),
+                'raw': pdf_content,
                 'res_model': 'account.move',
                 'res_id': self.id,
                 'mimetype': 'application/pdf',
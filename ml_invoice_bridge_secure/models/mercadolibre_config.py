@@ -1,12 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import requests
-from odoo import api, fields, models, _
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone
+from odoo import api, fields, models, tools, _
 from odoo.exceptions import UserError, ValidationError
 
+from ..tools import ml_async, ml_http, ml_pack_parser, ml_render
+
 _logger = logging.getLogger(__name__)
 
+# Bucket compartido por todas las llamadas a api.mercadolibre.com
+ML_RATE_LIMIT_BUCKET = 'api.mercadolibre.com'
+
+# Renovar el access token cuando le quede menos de este margen (segundos)
+TOKEN_REFRESH_MARGIN = 600
+
+# Cache en memoria por worker: (dbname, config_id) -> (access_token, vencimiento epoch)
+_token_cache = {}
+
+# Conexiones a PostgreSQL que un hilo de upload puede tener abiertas a la vez: su
+# cursor, la consulta de documentos del pre-chequeo, el lock del token y el rate limiter
+CONNECTIONS_PER_UPLOAD_THREAD = 4
+
 class MercadoLibreConfig(models.Model):
     _name = 'mercadolibre.config'
     _description = 'MercadoLibre Configuration'
@@ -29,6 +46,145 @@ class MercadoLibreConfig(models.Model):
         help='ATENCIÓN: Solo activar cuando el módulo esté completamente estable. '
              'También requiere activar el cron desde Configuración > Tareas Programadas'
     )
+    # Motor de upload concurrente
+    upload_pool_size = fields.Integer(
+        string='Upload Workers',
+        default=4,
+        help='Cantidad de hilos que suben facturas en paralelo en cada ejecución del cron. '
+             'Cada hilo usa hasta 4 conexiones a la base: se limita a la mitad de db_maxconn / 4'
+    )
+    upload_batch_limit = fields.Integer(
+        string='Max Invoices per Run',
+        default=200,
+        help='Cantidad máxima de facturas a procesar en cada ejecución del cron'
+    )
+    upload_time_limit = fields.Integer(
+        string='Max Seconds per Run',
+        default=600,
+        help='Tiempo máximo (segundos) de una ejecución del cron. Al superarlo no se '
+             'despachan más facturas y las pendientes quedan para la próxima ejecución'
+    )
+    upload_engine = fields.Selection([
+        ('threads', 'Thread Pool'),
+        ('async', 'Asyncio (httpx)'),
+    ], string='Upload Engine', default='threads', required=True,
+        help='Thread Pool: cada factura se sube y confirma en su propio hilo/cursor. '
+             'Asyncio: los PDFs se generan primero y se suben multiplexados en un único '
+             'event loop (requiere la librería python httpx; h2 opcional para HTTP/2)')
+    async_concurrency = fields.Integer(
+        string='Async Concurrency',
+        default=20,
+        help='Cantidad máxima de uploads simultáneos en el motor asyncio'
+    )
+    # Política de reintentos de uploads fallidos
+    upload_max_attempts = fields.Integer(
+        string='Max Upload Attempts',
+        default=8,
+        help='Intentos ante errores transitorios antes de pasar la factura a dead-letter'
+    )
+    upload_retry_base = fields.Integer(
+        string='Retry Base Delay (s)',
+        default=300,
+        help='Demora del primer reintento; se duplica en cada intento fallido'
+    )
+    upload_retry_max = fields.Integer(
+        string='Retry Max Delay (s)',
+        default=21600,
+        help='Demora máxima entre reintentos'
+    )
+    # Rate limiting compartido (token bucket en PostgreSQL)
+    rate_limit_per_minute = fields.Integer(
+        string='API Calls per Minute',
+        default=300,
+        help='Cantidad máxima de llamadas a la API de MercadoLibre por minuto, '
+             'compartida entre todos los workers y hilos de cron'
+    )
+    rate_limit_burst = fields.Integer(
+        string='API Burst',
+        default=10,
+        help='Cantidad de llamadas que pueden hacerse de inmediato cuando hubo capacidad ociosa'
+    )
+    http_pool_size = fields.Integer(
+        string='HTTP Connections',
+        default=10,
+        help='Conexiones keep-alive reutilizables hacia api.mercadolibre.com por worker. '
+             'Debería ser al menos igual a Upload Workers'
+    )
+    # Render de PDFs
+    render_pool_size = fields.Integer(
+        string='Max Concurrent PDF Renders',
+        default=4,
+        help='Cantidad máxima de procesos wkhtmltopdf simultáneos por worker de Odoo. Cada '
+             'render lanza su propio proceso: es un límite de concurrencia, no un pool de '
+             'procesos persistentes'
+    )
+    render_timeout = fields.Integer(
+        string='PDF Render Timeout (s)',
+        default=60,
+        help='Tiempo máximo para generar un PDF'
+    )
+    render_batch_size = fields.Integer(
+        string='PDF Render Batch Size',
+        default=10,
+        help='Facturas por invocación de wkhtmltopdf en uploads en lote (cron asyncio y upload '
+             'masivo). El PDF resultante se separa por factura. 1 desactiva el render por lotes'
+    )
+    pdf_engine = fields.Selection([
+        ('bypass', 'HTML Bypass'),
+        ('report', 'Odoo Invoice Report (l10n_ar)'),
+    ], string='PDF Engine', default='bypass', required=True,
+        help='HTML Bypass: plantilla propia del módulo renderizada con wkhtmltopdf. Odoo Invoice '
+             'Report: reporte de factura estándar de l10n_ar, renderizado en lote y reutilizando '
+             'el PDF legal ya adjunto a la factura. Ver "Compare PDF Engines"'
+    )
+    pdf_profile = fields.Selection([
+        ('archive', 'Archive (300 DPI)'),
+        ('upload', 'Upload Optimized (150 DPI)'),
+    ], string='PDF Quality Profile', default='archive', required=True,
+        help='Archive: calidad de impresión, igual al render histórico. Upload Optimized: imágenes '
+             'a 150 DPI con compresión JPEG y reescritura del PDF sin objetos sin uso; genera '
+             'archivos más livianos y rápidos de subir. Ver "Benchmark PDF Profiles"'
+    )
+    render_service_url = fields.Char(
+        string='PDF Render Service URL',
+        help='Servicio de render externo, no incluido en el módulo (ej: http://localhost:8090/render). '
+             'Recibe el HTML por POST y devuelve el PDF. Si no responde a {url}/health se usa '
+             'wkhtmltopdf local'
+    )
+    
+    prerender_pdfs = fields.Boolean(
+        string='Pre-render PDFs',
+        default=False,
+        help='Genera el PDF en segundo plano al publicar la factura (cron "Pre-render ML PDFs"); '
+             'el upload sólo toma facturas con el PDF listo'
+    )
+    prerender_grace_minutes = fields.Integer(
+        string='Pre-render Grace (min)',
+        default=30,
+        help='Si el PDF de una factura encolada no está listo pasado este tiempo, el upload lo genera'
+    )
+    pdf_cache_max_age_days = fields.Integer(
+        string='PDF Cache Max Age (days)',
+        default=7,
+        help='Los PDFs generados se reutilizan mientras la factura no cambie; pasado este lapso se eliminan'
+    )
+    pdf_cache_max_mb = fields.Integer(
+        string='PDF Cache Max Size (MB)',
+        default=500,
+        help='Tamaño máximo total de PDFs cacheados; al superarlo se eliminan los más antiguos'
+    )
+    log_retention_days = fields.Integer(
+        string='Log Retention (days)',
+        default=90,
+        help='Los logs más antiguos se eliminan cada día (cron "ML Log Maintenance"); antes se '
+             'acumulan en las estadísticas diarias. 0 = sin límite de antigüedad'
+    )
+    log_max_records = fields.Integer(
+        string='Log Max Records',
+        default=200000,
+        help='Cantidad máxima de logs a conservar; los excedentes más antiguos se eliminan. 0 = sin límite'
+    )
+    
     api_status = fields.Selection([
         ('not_tested', 'Not Tested'),
         ('success', 'Connection OK'), 
@@ -36,6 +192,11 @@ class MercadoLibreConfig(models.Model):
     ], default='not_tested', readonly=True)
     last_test = fields.Datetime(string='Last Test', readonly=True)
     last_token_refresh = fields.Datetime(string='Last Token Refresh', readonly=True)
+    token_expires_at = fields.Datetime(
+        string='Token Expires At', readonly=True,
+        help='Vencimiento informado por MercadoLibre al renovar el token. '
+             'El token se renueva automáticamente antes de esta fecha'
+    )
     
     # Info del cron
     cron_status = fields.Char(string='Cron Status', compute='_compute_cron_status', store=False)
@@ -56,29 +217,532 @@ class MercadoLibreConfig(models.Model):
             else:
                 config.cron_status = '❓ Cron no encontrado'
 
+    @api.constrains('upload_pool_size', 'upload_batch_limit', 'upload_time_limit',
+                    'upload_max_attempts', 'upload_retry_base', 'upload_retry_max',
+                    'async_concurrency', 'render_pool_size', 'render_timeout', 'render_batch_size',
+                    'pdf_cache_max_age_days', 'pdf_cache_max_mb', 'prerender_grace_minutes',
+                    'log_retention_days', 'log_max_records')
+    def _check_upload_limits(self):
+        for config in self:
+            if config.upload_pool_size < 1 or config.upload_pool_size > 32:
+                raise ValidationError(_('Upload Workers debe estar entre 1 y 32'))
+            if config.upload_batch_limit < 1:
+                raise ValidationError(_('Max Invoices per Run debe ser mayor a 0'))
+            if config.upload_time_limit < 30:
+                raise ValidationError(_('Max Seconds per Run debe ser de al menos 30 segundos'))
+            if config.async_concurrency < 1:
+                raise ValidationError(_('Async Concurrency debe ser mayor a 0'))
+            if config.upload_max_attempts < 1 or config.upload_retry_base < 1:
+                raise ValidationError(_('La política de reintentos requiere valores mayores a 0'))
+            if config.upload_retry_max < config.upload_retry_base:
+                raise ValidationError(_('Retry Max Delay no puede ser menor que Retry Base Delay'))
+            if config.render_pool_size < 1 or config.render_pool_size > 32:
+                raise ValidationError(_('Max Concurrent PDF Renders debe estar entre 1 y 32'))
+            if config.render_batch_size < 1:
+                raise ValidationError(_('PDF Render Batch Size debe ser mayor a 0'))
+            if config.render_timeout < 5:
+                raise ValidationError(_('PDF Render Timeout debe ser de al menos 5 segundos'))
+            if config.pdf_cache_max_age_days < 0 or config.pdf_cache_max_mb < 0:
+                raise ValidationError(_('Los límites de la cache de PDFs no pueden ser negativos'))
+            if config.prerender_grace_minutes < 0:
+                raise ValidationError(_('Pre-render Grace no puede ser negativo'))
+            if config.log_retention_days < 0 or config.log_max_records < 0:
+                raise ValidationError(_('Los límites de retención del log no pueden ser negativos'))
+
+    @api.constrains('rate_limit_per_minute', 'rate_limit_burst', 'http_pool_size')
+    def _check_rate_limit(self):
+        for config in self:
+            if config.rate_limit_per_minute < 1 or config.rate_limit_burst < 1:
+                raise ValidationError(_('Los límites de llamadas a la API deben ser mayores a 0'))
+            if config.http_pool_size < 1:
+                raise ValidationError(_('HTTP Connections debe ser mayor a 0'))
+
     @api.constrains('active')
     def _check_single_active(self):
         if self.active and self.search_count([('active', '=', True), ('id', '!=', self.id)]) > 0:
             raise ValidationError(_('Solo puede haber una configuración activa'))
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env.registry.clear_cache()
+        return records
+
+    def write(self, vals):
+        if 'access_token' in vals and 'token_expires_at' not in vals:
+            # Token cargado a mano: se desconoce su vencimiento
+            vals = dict(vals, token_expires_at=False)
+        res = super().write(vals)
+        if 'active' in vals:
+            self.env.registry.clear_cache()
+        if 'prerender_pdfs' in vals:
+            cron = self.env.ref('ml_invoice_bridge_secure.cron_prerender_ml_pdfs', raise_if_not_found=False)
+            if cron:
+                cron.sudo().active = bool(vals['prerender_pdfs'])
+        if {'access_token', 'refresh_token', 'token_expires_at', 'active'} & set(vals):
+            for config in self:
+                _token_cache.pop((self.env.cr.dbname, config.id), None)
+        return res
+
+    def unlink(self):
+        for config in self:
+            _token_cache.pop((self.env.cr.dbname, config.id), None)
+        res = super().unlink()
+        self.env.registry.clear_cache()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _get_active_config_id(self):
+        """ID de la configuración activa, cacheado por registry (se invalida al modificarla)"""
+        return self.search([('active', '=', True)], limit=1).id
+
     @api.model
     def get_active_config(self):
-        return self.search([('active', '=', True)], limit=1)
+        return self.browse(self._get_active_config_id())
+
+    def _get_access_token(self, force_refresh=False, stale_token=None):
+        """Devuelve un access token válido, cacheado en memoria por worker.
+
+        Si el token vence en menos de TOKEN_REFRESH_MARGIN segundos, o si
+        force_refresh indica que stale_token fue rechazado con 401, se renueva
+        bajo un lock de la fila de configuración en un cursor propio: sólo un
+        worker llama a /oauth/token y el resto toma el token ya renovado.
+        """
+        self.ensure_one()
+        key = (self.env.cr.dbname, self.id)
+        cached = _token_cache.get(key)
+        if cached and not force_refresh and cached[1] - TOKEN_REFRESH_MARGIN > time.time():
+            return cached[0]
+
+        with self.pool.cursor() as cr:
+            cr.execute("SET LOCAL lock_timeout = '30s'")
+            cr.execute("""
+                SELECT access_token, token_expires_at, refresh_token
+                  FROM mercadolibre_config
+                 WHERE id = %s
+                   FOR UPDATE
+            """, (self.id,))
+            token, expires_at, refresh_token = cr.fetchone()
+            expires_epoch = expires_at.replace(tzinfo=timezone.utc).timestamp() if expires_at else float('inf')
+
+            expiring = expires_epoch - TOKEN_REFRESH_MARGIN <= time.time()
+            rejected = force_refresh and (stale_token is None or stale_token == token)
+            if (expiring or rejected) and refresh_token:
+                token, expires_epoch = self.with_env(self.env(cr=cr)).sudo()._refresh_access_token()
+
+        _token_cache[key] = (token, expires_epoch)
+        return token
+
+    def _refresh_access_token(self):
+        """Llama a /oauth/token y persiste los tokens. Debe ejecutarse con la fila bloqueada.
+
+        Un rechazo (refresh token revocado o vencido, invalid_grant) es un error de
+        autenticación: los jobs afectados nunca pasan a dead-letter. Sólo los
+        errores temporales del servidor de OAuth cuentan como transitorios.
+        """
+        self.ensure_one()
+        if not self.refresh_token:
+            raise ml_http.MLUploadError(_('Refresh Token requerido para renovar'), ml_http.ERROR_AUTH)
+
+        data = {
+            'grant_type': 'refresh_token',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'refresh_token': self.refresh_token,
+        }
+        response = self._ml_request('POST', 'https://api.mercadolibre.com/oauth/token', auth=False, data=data, timeout=10)
+        if response.status_code != 200:
+            error_type = ml_http.classify_status(response.status_code)
+            raise ml_http.MLUploadError(
+                _('Token refresh failed: %s') % response.status_code,
+                error_type if error_type == ml_http.ERROR_TRANSIENT else ml_http.ERROR_AUTH)
+
+        token_data = response.json()
+        expires_in = token_data.get('expires_in')
+        now = fields.Datetime.now()
+        self.write({
+            'access_token': token_data.get('access_token'),
+            'refresh_token': token_data.get('refresh_token') or self.refresh_token,
+            'token_expires_at': now + timedelta(seconds=int(expires_in)) if expires_in else False,
+            'last_token_refresh': now,
+            'api_status': 'not_tested'
+        })
+        _logger.info("MercadoLibre access token refreshed (expires in %ss)", expires_in or 'unknown')
+        expires_epoch = time.time() + int(expires_in) if expires_in else float('inf')
+        return token_data.get('access_token'), expires_epoch
+
+    def _ml_request(self, method, url, auth=True, max_throttle_retries=3, **kwargs):
+        """Única salida HTTP hacia MercadoLibre: respeta el token bucket compartido,
+        reintenta ante 429 esperando lo indicado en Retry-After y, si auth=True,
+        agrega el token y reintenta una vez con un token renovado ante un 401"""
+        self.ensure_one()
+        limiter = self.env['mercadolibre.rate.limit']
+        headers = dict(kwargs.pop('headers', None) or {})
+        token = None
+        auth_retried = False
+        attempt = 0
+        body = kwargs.get('data')
+        while True:
+            # Un cuerpo en streaming se rebobina antes de cada reenvío
+            if hasattr(body, 'seek'):
+                body.seek(0)
+            if auth:
+                previous_token = token
+                token = self._get_access_token(force_refresh=auth_retried, stale_token=previous_token)
+                if auth_retried and token == previous_token:
+                    # No se pudo obtener un token nuevo: devolver el 401 original
+                    return response
+                headers['Authorization'] = f'Bearer {token}'
+
+            if not limiter._acquire(ML_RATE_LIMIT_BUCKET, self.rate_limit_per_minute, self.rate_limit_burst):
+                raise UserError(_('Límite de llamadas a MercadoLibre alcanzado, reintentar más tarde'))
+
+            response = ml_http.get_session(self.http_pool_size).request(method, url, headers=headers, **kwargs)
+
+            if response.status_code == 401 and auth and not auth_retried:
+                _logger.info("MercadoLibre rejected access token, refreshing and retrying once")
+                auth_retried = True
+                continue
+
+            if response.status_code != 429:
+                return response
+
+            retry_after = limiter._parse_retry_after(response.headers.get('Retry-After'))
+            limiter._penalize(ML_RATE_LIMIT_BUCKET, retry_after)
+            attempt += 1
+            if attempt > max_throttle_retries:
+                return response
+
+    def _ml_transmit_async(self, payloads, deadline):
+        """Sube los PDFs preparados con el motor asyncio y devuelve
+        {invoice_id: resultado} con el mismo formato que _upload_to_ml_api.
+        Las facturas no iniciadas antes de `deadline` no aparecen en el resultado."""
+        self.ensure_one()
+        if not ml_async.is_available():
+            raise UserError(_('El motor asyncio requiere la librería python httpx'))
+
+        limiter = self.env['mercadolibre.rate.limit']
+        rate, burst = self.rate_limit_per_minute, self.rate_limit_burst
+        hooks = {
+            'acquire': lambda: limiter._acquire(ML_RATE_LIMIT_BUCKET, rate, burst),
+            'penalize': lambda retry_after: limiter._penalize(ML_RATE_LIMIT_BUCKET, retry_after),
+            'parse_retry_after': limiter._parse_retry_after,
+        }
+        move_model = self.env['account.move']
+        pack_ids = {payload['invoice_id']: payload['pack_id'] for payload in payloads}
+
+        def interpret(raw_results):
+            results = {}
+            for invoice_id, outcome in raw_results.items():
+                if outcome is None:
+                    continue
+                if isinstance(outcome, Exception):
+                    results[invoice_id] = {
+                        'success': False,
+                        'error': f"Error de conexión: {outcome}",
+                        'error_type': getattr(outcome, 'error_type', ml_http.ERROR_TRANSIENT),
+                    }
+                else:
+                    results[invoice_id] = move_model._ml_upload_result_from_response(outcome, pack_ids[invoice_id])
+            return results
+
+        try:
+            token = self._get_access_token()
+        except ml_http.MLUploadError as e:
+            # Sin token no se envía nada: todo el lote falla con el tipo del error
+            return {payload['invoice_id']: {'success': False, 'error': str(e), 'error_type': e.error_type}
+                    for payload in payloads}
+        results = interpret(ml_async.transmit(payloads, token, self.async_concurrency, hooks, deadline))
+
+        # Token rechazado: renovarlo una sola vez y reenviar sólo esos documentos
+        rejected = [p for p in payloads if results.get(p['invoice_id'], {}).get('error_type') == ml_http.ERROR_AUTH]
+        if rejected:
+            try:
+                new_token = self._get_access_token(force_refresh=True, stale_token=token)
+            except ml_http.MLUploadError as e:
+                # Los rechazados conservan su error de autenticación
+                _logger.warning("MercadoLibre token refresh failed: %s", e)
+                new_token = token
+            if new_token != token:
+                results.update(interpret(ml_async.transmit(rejected, new_token, self.async_concurrency, hooks, deadline)))
+        return results
+
+    def _ml_render_options(self):
+        """Parámetros para tools.ml_render.html_to_pdf"""
+        self.ensure_one()
+        return {
+            'service_url': self.render_service_url or None,
+            'pool_size': self.render_pool_size,
+            'timeout': self.render_timeout,
+            'profile': self.pdf_profile,
+        }
+
+    def action_test_render_service(self):
+        """Verifica el servicio de render configurado"""
+        self.ensure_one()
+        if not self.render_service_url:
+            raise UserError(_('No hay servicio de render configurado: se usa wkhtmltopdf local'))
+        if ml_render.service_available(self.render_service_url, force=True):
+            message, notification_type = _('Servicio de render disponible'), 'success'
+        else:
+            message = _('El servicio de render no responde: se usará wkhtmltopdf local')
+            notification_type = 'warning'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PDF Render Service'),
+                'message': message,
+                'type': notification_type,
+            }
+        }
+
+    def action_benchmark_pdf_profiles(self, sample_size=5):
+        """Renderiza facturas ML recientes con cada perfil y compara tamaño y tiempo.
+        No usa ni modifica el cache de PDFs."""
+        self.ensure_one()
+        invoices = self._ml_benchmark_invoices(sample_size)
+
+        html_contents = [invoice._generate_exact_invoice_html() for invoice in invoices]
+        render_options = dict(self._ml_render_options(), pool_size=1)
+        lines = []
+        for profile, label in self._fields['pdf_profile'].selection:
+            render_options['profile'] = profile
+            sizes = []
+            start = time.monotonic()
+            for html_content in html_contents:
+                sizes.append(len(ml_render.html_to_pdf(html_content, **render_options)))
+            elapsed = time.monotonic() - start
+            lines.append(_('%s: %.1f KB promedio, %.2fs por factura') % (
+                label, sum(sizes) / len(sizes) / 1024, elapsed / len(sizes)))
+            _logger.info("PDF profile benchmark %s: sizes=%s elapsed=%.2fs", profile, sizes, elapsed)
+
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PDF Profiles (%d facturas)') % len(invoices),
+                'message': '\n'.join(lines),
+                'type': 'info',
+                'sticky': True,
+            }
+        }
+
+    def action_compare_pdf_engines(self, sample_size=5):
+        """Compara tamaño y tiempo del PDF entre el bypass HTML y el reporte nativo.
+        El bypass se mide sin cache; el reporte reutiliza los PDFs legales adjuntos,
+        igual que en el upload."""
+        self.ensure_one()
+        invoices = self._ml_benchmark_invoices(sample_size)
+
+        start = time.monotonic()
+        bypass_sizes = [len(invoice._html_to_pdf_direct(invoice._generate_exact_invoice_html()))
+                        for invoice in invoices]
+        bypass_elapsed = time.monotonic() - start
+
+        start = time.monotonic()
+        report_pdfs = invoices._ml_render_report_pdfs()
+        report_elapsed = time.monotonic() - start
+        errors = [pdf for pdf in report_pdfs.values() if isinstance(pdf, Exception)]
+        if errors:
+            raise UserError(_('El reporte de factura falló: %s') % errors[0])
+        report_sizes = [len(pdf) for pdf in report_pdfs.values()]
+        reused = len(invoices.filtered('invoice_pdf_report_id')) if 'invoice_pdf_report_id' in invoices._fields else 0
+
+        lines = [
+            _('HTML Bypass: %.1f KB promedio, %.2fs por factura') % (
+                sum(bypass_sizes) / len(bypass_sizes) / 1024, bypass_elapsed / len(invoices)),
+            _('Odoo Invoice Report: %.1f KB promedio, %.2fs por factura (%d PDFs reutilizados)') % (
+                sum(report_sizes) / len(report_sizes) / 1024, report_elapsed / len(invoices), reused),
+        ]
+        _logger.info("PDF engine comparison: bypass sizes=%s %.2fs, report sizes=%s %.2fs (%d reused)",
+                     bypass_sizes, bypass_elapsed, report_sizes, report_elapsed, reused)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('PDF Engines (%d facturas)') % len(invoices),
+                'message': '\n'.join(lines),
+                'type': 'info',
+                'sticky': True,
+            }
+        }
+
+    def action_benchmark_pack_id_parser(self, sample_size=200):
+        """Micro-benchmark del extractor de Pack ID sobre orígenes ODUMBO de muestra
+        y, si hay, sobre los orígenes reales de las últimas órdenes de venta"""
+        self.ensure_one()
+        origins = self.env['sale.order'].search(
+            [('origin', '!=', False)], order='id desc', limit=sample_size).mapped('origin')
+        lines = []
+        for label, texts in ((_('Muestra ODUMBO'), ml_pack_parser.SAMPLE_ORIGINS), (_('Órdenes de venta'), origins)):
+            if not texts:
+                continue
+            result = ml_pack_parser.benchmark(texts, rounds=max(10000 // len(texts), 1))
+            lines.append(_('%s (%d textos): extract %.2f µs por texto') % (
+                label, result['texts'], result['extract_us']))
+            _logger.info("Pack ID parser benchmark %s: %s", label, result)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Pack ID Parser'),
+                'message': '\n'.join(lines),
+                'type': 'info',
+                'sticky': True,
+            }
+        }
+
+    def action_ml_backfill_dry_run(self):
+        """Cuenta las facturas que corregiría el backfill de datos ML, sin modificarlas"""
+        self.ensure_one()
+        stats = self.env['account.move'].sudo()._ml_backfill_from_sale_orders(dry_run=True)
+        return self._ml_backfill_notification(_('Backfill ML Data (Dry Run)'), _(
+            '%(candidates)d facturas a corregir: %(new_ml_sales)d pasarían a ser ventas ML, '
+            '%(with_pack_id)d con Pack ID detectado') % stats)
+
+    def action_ml_backfill(self):
+        """Corrige is_ml_sale/ml_pack_id de todas las facturas desde su orden de venta"""
+        self.ensure_one()
+        stats = self.env['account.move'].sudo()._ml_backfill_from_sale_orders(dry_run=False)
+        return self._ml_backfill_notification(_('Backfill ML Data'), _(
+            '%(updated)d facturas corregidas: %(new_ml_sales)d nuevas ventas ML, '
+            '%(with_pack_id)d con Pack ID, %(enqueued)d encoladas para subir') % stats)
+
+    def _ml_backfill_notification(self, title, message):
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': title,
+                'message': message,
+                'type': 'info',
+                'sticky': True,
+            }
+        }
+
+    def _ml_benchmark_invoices(self, sample_size):
+        """Facturas ML publicadas más recientes, usadas como muestra en los benchmarks"""
+        invoices = self.env['account.move'].search([
+            ('is_ml_sale', '=', True),
+            ('state', '=', 'posted'),
+            ('move_type', 'in', ['out_invoice', 'out_refund']),
+        ], order='id desc', limit=sample_size)
+        if not invoices:
+            raise UserError(_('No hay facturas ML publicadas para el benchmark'))
+        return invoices
+
+    def _ml_pdf_grace_minutes(self):
+        """Espera máxima del upload por el pre-render (None si la etapa está desactivada)"""
+        self.ensure_one()
+        return self.prerender_grace_minutes if self.prerender_pdfs and self.pdf_engine == 'bypass' else None
+
+    def _ml_upload_engine(self):
+        """Motor de upload efectivo: asyncio sólo si httpx está instalado"""
+        self.ensure_one()
+        if self.upload_engine == 'async' and not ml_async.is_available():
+            _logger.warning("Async upload engine selected but httpx is not installed, using thread pool")
+            return 'threads'
+        return self.upload_engine
+
+    def _ml_transmit(self, payloads, deadline):
+        """Sube los PDFs preparados con el motor configurado.
+        Devuelve {invoice_id: resultado} como _ml_transmit_async."""
+        self.ensure_one()
+        if self._ml_upload_engine() == 'async':
+            return self._ml_transmit_async(payloads, deadline)
+        return self._ml_transmit_threads(payloads, deadline)
+
+    def _ml_transmit_threads(self, payloads, deadline):
+        """Sube los PDFs preparados con un pool de hilos sobre la sesión HTTP compartida"""
+        self.ensure_one()
+        if not payloads:
+            return {}
+        uid, context = self.env.uid, dict(self.env.context)
+
+        def post(payload):
+            if time.monotonic() >= deadline:
+                return payload['invoice_id'], None
+            # Cada hilo usa su propio cursor: el env del llamador no es thread-safe
+            with self.pool.cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                body = ml_http.MultipartFileStream(
+                    'fiscal_document', payload['filename'], payload['pdf'], 'application/pdf')
+                try:
+                    response = self.with_env(env)._ml_request(
+                        'POST', ml_async.FISCAL_DOCUMENTS_URL % payload['pack_id'],
+                        data=body,
+                        headers={'Accept': 'application/json', 'Content-Type': body.content_type},
+                        timeout=30,
+                    )
+                except Exception as e:
+                    return payload['invoice_id'], {
+                        'success': False,
+                        'error': f"Error de conexión: {e}",
+                        'error_type': getattr(e, 'error_type', ml_http.ERROR_TRANSIENT),
+                    }
+                return payload['invoice_id'], env['account.move']._ml_upload_result_from_response(
+                    response, payload['pack_id'])
+
+        with ThreadPoolExecutor(max_workers=min(len(payloads), self._ml_db_thread_limit(self.upload_pool_size))) as executor:
+            results = dict(executor.map(post, payloads))
+        return {invoice_id: result for invoice_id, result in results.items() if result is not None}
+
+    @api.model
+    def _ml_db_thread_limit(self, requested):
+        """Hilos con cursor propio que se pueden lanzar sin agotar db_maxconn.
+
+        Cada hilo puede usar hasta CONNECTIONS_PER_UPLOAD_THREAD conexiones del pool
+        del proceso; la mitad del pool queda para el cron y el resto de Odoo.
+        """
+        available = max(1, tools.config['db_maxconn'] // 2 // CONNECTIONS_PER_UPLOAD_THREAD)
+        return max(1, min(requested, available))
+
+    def _ml_fetch_fiscal_documents(self, pack_ids):
+        """Consulta en paralelo los documentos fiscales ya cargados en cada pack.
+
+        Devuelve {pack_id: set de IDs de documento}; None si el pack no pudo
+        consultarse (en ese caso el llamador sube igual).
+        """
+        self.ensure_one()
+        pack_ids = sorted({pack_id for pack_id in pack_ids if pack_id})
+        if not pack_ids:
+            return {}
+        uid, context = self.env.uid, dict(self.env.context)
+
+        def fetch(pack_id):
+            # Cada hilo usa su propio cursor: el env del llamador no es thread-safe
+            with self.pool.cursor() as cr:
+                config = self.with_env(api.Environment(cr, uid, context))
+                try:
+                    response = config._ml_request('GET', ml_async.FISCAL_DOCUMENTS_URL % pack_id, timeout=15)
+                except Exception as e:
+                    _logger.warning("Could not list fiscal documents of pack %s: %s", pack_id, e)
+                    return pack_id, None
+            if response.status_code == 404:
+                return pack_id, set()
+            if response.status_code != 200:
+                _logger.warning("Could not list fiscal documents of pack %s: HTTP %s", pack_id, response.status_code)
+                return pack_id, None
+            try:
+                return pack_id, set(ml_http.extract_document_ids(response.json()))
+            except ValueError:
+                return pack_id, None
+
+        with ThreadPoolExecutor(max_workers=min(len(pack_ids), self._ml_db_thread_limit(self.http_pool_size))) as executor:
+            return dict(executor.map(fetch, pack_ids))
 
     def test_api_connection(self):
         """Test mejorado con manejo de tokens expirados"""
         self.ensure_one()
         try:
-            headers = {'Authorization': f'Bearer {self.access_token}'}
-            response = requests.get('https://api.mercadolibre.com/users/me', headers=headers, timeout=10)
+            # _ml_request renueva el token y reintenta automáticamente ante un 401
+            response = self._ml_request('GET', 'https://api.mercadolibre.com/users/me', timeout=10)
             
             if response.status_code == 200:
                 user_data = response.json()
-                self.write({
-                    'api_status': 'success',
-                    'last_test': fields.Datetime.now(),
-                    'ml_user_id': str(user_data.get('id', ''))
-                })
+                self._ml_set_api_status('success', ml_user_id=str(user_data.get('id', '')))
                 return {
                     'type': 'ir.actions.client', 'tag': 'display_notification',
                     'params': {
@@ -88,19 +752,33 @@ class MercadoLibreConfig(models.Model):
                     }
                 }
             elif response.status_code == 401:
-                # Token expirado
-                self.api_status = 'failed'
-                if self.refresh_token:
-                    return self.refresh_access_token()
-                else:
-                    raise UserError(_('Access token expirado. Renovar manualmente.'))
+                # Token expirado y no se pudo renovar
+                raise UserError(_('Access token expirado. Renovar manualmente.'))
             else:
-                self.api_status = 'failed'
                 raise UserError(_('API connection failed: %s') % response.status_code)
         except Exception as e:
-            self.api_status = 'failed'
+            # El estado se guarda en su propio cursor: el rollback del request no lo deshace
+            self._ml_set_api_status('failed')
             raise UserError(_('Connection error: %s') % str(e))
 
+    def _ml_set_api_status(self, status, ml_user_id=None):
+        """Guarda el resultado del test en un cursor propio.
+
+        Si el test renovó el token, la fila ya fue actualizada y confirmada por el
+        cursor del refresh: escribirla desde la transacción del request daría un
+        error de serialización. Aquí sólo se escriben api_status/last_test (y el
+        usuario ML si cambió); los tokens quedan como los dejó el refresh.
+        """
+        self.ensure_one()
+        vals = {'api_status': status, 'last_test': fields.Datetime.now()}
+        with self.pool.cursor() as cr:
+            config = self.with_env(self.env(cr=cr))
+            if ml_user_id and config.ml_user_id != ml_user_id:
+                vals['ml_user_id'] = ml_user_id
+            config.write(vals)
+        # Descartar los valores (tokens incluidos) leídos antes del refresh
+        self.invalidate_recordset()
+
     def refresh_access_token(self):
         """Renovar access token usando refresh token"""
         self.ensure_one()
@@ -108,31 +786,11 @@ class MercadoLibreConfig(models.Model):
             raise UserError(_('Refresh Token requerido para renovar'))
         
         try:
-            url = 'https://api.mercadolibre.com/oauth/token'
-            data = {
-                'grant_type': 'refresh_token',
-                'client_id': self.client_id,
-                'client_secret': self.client_secret,
-                'refresh_token': self.refresh_token,
+            self._get_access_token(force_refresh=True)
+            return {
+                'type': 'ir.actions.client', 'tag': 'display_notification',
+                'params': {'title': _('Token Renewed'), 'message': _('Access token renovado exitosamente'), 'type': 'success'}
             }
-            
-            response = requests.post(url, data=data, timeout=10)
-            
-            if response.status_code == 200:
-                token_data = response.json()
-                self.write({
-                    'access_token': token_data.get('access_token'),
-                    'refresh_token': token_data.get('refresh_token'),
-                    'last_token_refresh': fields.Datetime.now(),
-                    'api_status': 'not_tested'
-                })
-                
-                return {
-                    'type': 'ir.actions.client', 'tag': 'display_notification',
-                    'params': {'title': _('Token Renewed'), 'message': _('Access token renovado exitosamente'), 'type': 'success'}
-                }
-            else:
-                raise UserError(_('Token refresh failed: %s') % response.status_code)
         except Exception as e:
             raise UserError(_('Token refresh error: %s') % str(e))
 
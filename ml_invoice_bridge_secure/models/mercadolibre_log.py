@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import logging
+import time
+from datetime import datetime, time as dt_time, timedelta
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+
+_logger = logging.getLogger(__name__)
+
+# Filas borradas por sentencia en la retención: cada tramo se confirma por separado
+LOG_DELETE_CHUNK = 10000
 
 class MercadoLibreLog(models.Model):
     _name = 'mercadolibre.log'
@@ -9,14 +18,22 @@ class MercadoLibreLog(models.Model):
     _order = 'create_date desc'
     _rec_name = 'display_name'
 
-    display_name = fields.Char(string='Name', compute='_compute_display_name', store=True)
+    # _rec_name: name_search filtra por display_name con ilike, que sólo puede usar un índice trigram
+    display_name = fields.Char(string='Name', compute='_compute_display_name', store=True, index='trigram')
     # 🔧 CORRECCIÓN CRÍTICA: required=False para permitir logs de cron
     invoice_id = fields.Many2one('account.move', string='Invoice', required=False, ondelete='cascade')
-    ml_pack_id = fields.Char(string='Pack ID')
+    ml_pack_id = fields.Char(string='Pack ID', index='btree_not_null')
     status = fields.Selection([('success', 'Success'), ('error', 'Error')], string='Status', required=True)
     message = fields.Text(string='Message')
     ml_response = fields.Text(string='ML Response')
 
+    def init(self):
+        # Lista ordenada por fecha, filtros por estado y retención por antigüedad
+        create_index(
+            self._cr, 'mercadolibre_log_create_date_status_idx', self._table,
+            ['create_date', 'status', 'invoice_id']
+        )
+
     @api.depends('invoice_id', 'status')
     def _compute_display_name(self):
         for log in self:
@@ -48,6 +65,64 @@ class MercadoLibreLog(models.Model):
             'ml_response': kwargs.get('ml_response'),
         })
 
+    @api.model
+    def _cron_log_maintenance(self):
+        """Retención del log: acumula los días completos en mercadolibre.log.stat y
+        borra los logs más antiguos que Log Retention o que excedan Log Max Records.
+
+        Sólo se borran logs de días ya acumulados (anteriores a hoy, UTC).
+        """
+        config = self.env['mercadolibre.config'].get_active_config()
+        retention_days = config.log_retention_days if config else 90
+        max_records = config.log_max_records if config else 0
+
+        today = fields.Datetime.now().date()
+        self.env['mercadolibre.log.stat']._rollup(today)
+        self.env.cr.commit()
+
+        cutoffs = []
+        if retention_days:
+            cutoffs.append(datetime.combine(today - timedelta(days=retention_days), dt_time.min))
+        if max_records:
+            # Fecha del log número max_records (del más nuevo al más viejo): los anteriores sobran
+            self.env.cr.execute("""
+                SELECT create_date FROM mercadolibre_log
+                 ORDER BY create_date DESC, id DESC
+                OFFSET %s LIMIT 1
+            """, (max_records - 1,))
+            row = self.env.cr.fetchone()
+            if row:
+                cutoffs.append(row[0])
+        if not cutoffs:
+            return 0
+        return self._delete_logs_before(min(max(cutoffs), datetime.combine(today, dt_time.min)))
+
+    @api.model
+    def _delete_logs_before(self, cutoff):
+        """Borra los logs creados antes de `cutoff` en tramos confirmados uno a uno"""
+        self.flush_model()
+        cr = self.env.cr
+        start = time.monotonic()
+        deleted = 0
+        while True:
+            cr.execute("""
+                DELETE FROM mercadolibre_log
+                 WHERE id IN (SELECT id FROM mercadolibre_log
+                               WHERE create_date < %s
+                               ORDER BY create_date
+                               LIMIT %s)
+            """, (cutoff, LOG_DELETE_CHUNK))
+            chunk = cr.rowcount
+            deleted += chunk
+            cr.commit()
+            if chunk < LOG_DELETE_CHUNK:
+                break
+        self.invalidate_model()
+        if deleted:
+            _logger.info("ML log retention: %d logs older than %s deleted in %.1fs",
+                         deleted, cutoff, time.monotonic() - start)
+        return deleted
+
     def action_view_invoice(self):
         """Abrir la factura relacionada al log"""
         self.ensure_one()
@@ -117,25 +192,9 @@ class MercadoLibreLog(models.Model):
         if not failed_logs:
             raise UserError(_('No hay logs con errores seleccionados'))
         
-        success_count = 0
-        error_count = 0
-        
-        for log in failed_logs:
-            try:
-                log.action_retry_upload()
-                success_count += 1
-            except Exception:
-                error_count += 1
-                continue
-        
-        message = _('Retry completed: %d successful, %d failed') % (success_count, error_count)
+        invoices = failed_logs.mapped('invoice_id').filtered(lambda m: m.exists())
+        if not invoices:
+            raise UserError(_('Los logs seleccionados no tienen factura asociada'))
         
-        return {
-            'type': 'ir.actions.client',
-            'tag': 'display_notification',
-            'params': {
-                'title': _('Bulk Retry Results'),
-                'message': message,
-                'type': 'success' if success_count > 0 else 'warning'
-            }
-        }
+        # Upload en lote: una sola pasada de PDFs, uploads concurrentes y escrituras agrupadas
+        return invoices.action_upload_to_ml_bulk()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class MercadoLibreLogStat(models.Model):
+    """Conteo diario de logs por tipo y estado.
+
+    Se acumula antes de que la retención borre los logs, así el historial de
+    uploads y errores se conserva aunque el detalle ya no exista.
+    """
+    _name = 'mercadolibre.log.stat'
+    _description = 'MercadoLibre Daily Log Statistics'
+    _order = 'date desc, log_type, status'
+    _rec_name = 'date'
+
+    date = fields.Date(string='Date (UTC)', required=True, readonly=True, index=True)
+    log_type = fields.Selection([
+        ('invoice', 'Invoice'),
+        ('cron', 'Cron'),
+    ], string='Type', required=True, readonly=True)
+    status = fields.Selection([('success', 'Success'), ('error', 'Error')], string='Status',
+                              required=True, readonly=True)
+    count = fields.Integer(string='Logs', readonly=True, group_operator='sum')
+
+    _sql_constraints = [
+        ('date_type_status_uniq', 'unique(date, log_type, status)', 'Ya existe el conteo de ese día'),
+    ]
+
+    @api.model
+    def _rollup(self, until):
+        """Acumula los logs de los días completos aún no contados, hasta `until` (exclusivo).
+
+        Devuelve la cantidad de filas de conteo escritas.
+        """
+        self.env['mercadolibre.log'].flush_model()
+        cr = self.env.cr
+        cr.execute("SELECT max(date) FROM mercadolibre_log_stat")
+        last_date = cr.fetchone()[0]
+        since = fields.Date.add(last_date, days=1) if last_date else fields.Date.to_date('1970-01-01')
+        if since >= until:
+            return 0
+        cr.execute("""
+            INSERT INTO mercadolibre_log_stat
+                   (date, log_type, status, count, create_uid, create_date, write_uid, write_date)
+            SELECT create_date::date,
+                   CASE WHEN invoice_id IS NULL THEN 'cron' ELSE 'invoice' END,
+                   status, count(*),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM mercadolibre_log
+             WHERE create_date >= %(since)s AND create_date < %(until)s
+             GROUP BY 1, 2, 3
+                ON CONFLICT (date, log_type, status)
+                DO UPDATE SET count = EXCLUDED.count, write_date = EXCLUDED.write_date
+        """, {'uid': self.env.uid, 'since': since, 'until': until})
+        rows = cr.rowcount
+        self.invalidate_model()
+        if rows:
+            _logger.info("ML log rollup: %d daily counters written for %s - %s", rows, since, until)
+        return rows
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Límites del factor adaptativo aplicado tras un 429
+MIN_RATE_FACTOR = 0.1
+RATE_FACTOR_RECOVERY = 0.02
+
+
+class MercadoLibreRateLimit(models.Model):
+    """Token bucket compartido por todos los workers y hilos de cron.
+
+    El estado vive en PostgreSQL y se actualiza con SELECT ... FOR UPDATE en un
+    cursor propio, confirmado inmediatamente, para que el lock de la fila dure
+    sólo lo que tarda el cálculo y nunca quede atado a la transacción del llamador.
+    """
+    _name = 'mercadolibre.rate.limit'
+    _description = 'MercadoLibre API Rate Limit Bucket'
+    _rec_name = 'name'
+
+    name = fields.Char(string='Bucket', required=True, readonly=True)
+    tokens = fields.Float(string='Available Tokens', readonly=True)
+    rate_factor = fields.Float(
+        string='Rate Factor', default=1.0, readonly=True,
+        help='Fracción de la tasa configurada que se usa actualmente. Baja a la mitad '
+             'con cada 429 y se recupera gradualmente'
+    )
+    last_refill = fields.Float(string='Last Refill (epoch)', readonly=True)
+    blocked_until = fields.Float(string='Blocked Until (epoch)', readonly=True)
+
+    _sql_constraints = [
+        ('name_uniq', 'unique(name)', 'El bucket de rate limit debe ser único'),
+    ]
+
+    @api.model
+    def _lock_bucket(self, cr, key, burst):
+        """Bloquea la fila del bucket (creándola si no existe) y devuelve su estado"""
+        query = """
+            SELECT id, tokens, rate_factor, last_refill, blocked_until,
+                   extract(epoch from clock_timestamp())
+              FROM mercadolibre_rate_limit
+             WHERE name = %s
+               FOR UPDATE
+        """
+        cr.execute(query, (key,))
+        row = cr.fetchone()
+        if not row:
+            cr.execute("""
+                INSERT INTO mercadolibre_rate_limit (name, tokens, rate_factor, last_refill, blocked_until)
+                VALUES (%s, %s, 1.0, extract(epoch from clock_timestamp()), 0)
+                ON CONFLICT (name) DO NOTHING
+            """, (key, burst))
+            cr.execute(query, (key,))
+            row = cr.fetchone()
+        return row
+
+    @api.model
+    def _try_acquire(self, key, rate_per_minute, burst):
+        """Intenta consumir un token. Devuelve 0 si lo obtuvo o los segundos a esperar"""
+        with self.pool.cursor() as cr:
+            bucket_id, tokens, factor, last_refill, blocked_until, now = self._lock_bucket(cr, key, burst)
+            now = float(now)
+            factor = factor or 1.0
+
+            if blocked_until and now < blocked_until:
+                return blocked_until - now
+
+            rate = max(rate_per_minute, 1) / 60.0 * factor
+            tokens = min(float(burst), (tokens or 0.0) + max(0.0, now - (last_refill or now)) * rate)
+
+            if tokens >= 1.0:
+                tokens -= 1.0
+                wait_seconds = 0.0
+                factor = min(1.0, factor + RATE_FACTOR_RECOVERY)
+            else:
+                wait_seconds = (1.0 - tokens) / rate
+
+            cr.execute("""
+                UPDATE mercadolibre_rate_limit
+                   SET tokens = %s, rate_factor = %s, last_refill = %s
+                 WHERE id = %s
+            """, (tokens, factor, now, bucket_id))
+            return wait_seconds
+
+    @api.model
+    def _acquire(self, key, rate_per_minute, burst, max_wait=120):
+        """Bloquea hasta obtener un token del bucket. Devuelve False si se supera max_wait"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait_seconds = self._try_acquire(key, rate_per_minute, burst)
+            if wait_seconds <= 0:
+                return True
+            if time.monotonic() + wait_seconds > deadline:
+                _logger.warning("Rate limit bucket %s: could not acquire token within %ss", key, max_wait)
+                return False
+            # Dormir en tramos cortos para que otros workers compitan de forma justa
+            time.sleep(min(wait_seconds, 5.0))
+
+    @api.model
+    def _penalize(self, key, retry_after):
+        """Registra un 429: vacía el bucket, bloquea hasta Retry-After y reduce la tasa"""
+        with self.pool.cursor() as cr:
+            bucket_id, tokens, factor, last_refill, blocked_until, now = self._lock_bucket(cr, key, 0)
+            now = float(now)
+            factor = max(MIN_RATE_FACTOR, (factor or 1.0) / 2.0)
+            cr.execute("""
+                UPDATE mercadolibre_rate_limit
+                   SET tokens = 0, rate_factor = %s, last_refill = %s, blocked_until = %s
+                 WHERE id = %s
+            """, (factor, now, max(blocked_until or 0.0, now + retry_after), bucket_id))
+        _logger.warning("Rate limit bucket %s throttled by MercadoLibre: pausing %.1fs, rate factor %.2f",
+                        key, retry_after, factor)
+
+    @api.model
+    def _parse_retry_after(self, value, default=10.0):
+        """Interpreta el header Retry-After (segundos o fecha HTTP)"""
+        if not value:
+            return default
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return default
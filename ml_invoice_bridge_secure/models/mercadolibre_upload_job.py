@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import random
+from datetime import timedelta
+from odoo import api, fields, models, _
+from odoo.tools.sql import create_index
+
+from ..tools import ml_http
+from .account_move import ML_PENDING_UPLOAD_WHERE
+
+_logger = logging.getLogger(__name__)
+
+# Un job en 'processing' más antiguo que esto se considera huérfano (worker caído).
+# Nunca antes de que termine la ejecución del cron que lo tomó: ver _stale_claim_minutes
+STALE_CLAIM_MINUTES = 60
+# Margen sobre upload_time_limit para lo que sigue en curso al vencer el tiempo
+# (render, upload con reintentos por 429, escritura de resultados)
+STALE_CLAIM_MARGIN_MINUTES = 30
+
+
+class MercadoLibreUploadJob(models.Model):
+    """Cola persistente de facturas a subir a MercadoLibre.
+
+    Se llena al publicar una factura ML y los workers toman trabajo con
+    SELECT ... FOR UPDATE SKIP LOCKED, por lo que dos ejecuciones solapadas del
+    cron nunca procesan la misma factura y la búsqueda de pendientes depende
+    sólo del tamaño del lote, no del historial de facturas. Los jobs se
+    eliminan al subir la factura con éxito.
+
+    Los fallos se reprograman con backoff exponencial según su clasificación;
+    los errores permanentes y los que agotan los intentos pasan a 'dead' y no
+    se reintentan hasta que un usuario los reencole.
+    """
+    _name = 'mercadolibre.upload.job'
+    _description = 'MercadoLibre Upload Job'
+    _order = 'priority desc, next_retry_at, id'
+    _rec_name = 'invoice_id'
+
+    invoice_id = fields.Many2one('account.move', string='Invoice', required=True, ondelete='cascade', readonly=True)
+    ml_pack_id = fields.Char(related='invoice_id.ml_pack_id', string='Pack ID')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('dead', 'Dead Letter'),
+    ], string='State', default='pending', required=True, readonly=True)
+    priority = fields.Integer(string='Priority', default=10, help='Mayor prioridad se procesa primero')
+    attempts = fields.Integer(string='Attempts', default=0, readonly=True)
+    next_retry_at = fields.Datetime(string='Next Attempt', default=fields.Datetime.now, required=True)
+    claimed_at = fields.Datetime(string='Claimed At', readonly=True)
+    claim_count = fields.Integer(string='Claims', default=0, readonly=True,
+                                 help='Veces que un worker tomó el job. Más de una indica un intento '
+                                      'previo que pudo llegar a ML, por lo que se verifica antes de subir')
+    last_error = fields.Text(string='Last Error', readonly=True)
+    error_type = fields.Selection(ml_http.ERROR_TYPES, string='Error Type', readonly=True)
+    render_error_at = fields.Datetime(string='PDF Render Failed At', readonly=True,
+                                      help='Último fallo del pre-render; el job no vuelve a pre-renderizarse por una hora')
+    prerendered_at = fields.Datetime(string='PDF Pre-rendered At', readonly=True,
+                                     help='El pre-render ya generó el PDF. Si no quedó en cache (supera el '
+                                          'tamaño máximo) no se vuelve a pre-renderizar: lo genera el upload')
+
+    _sql_constraints = [
+        ('invoice_uniq', 'unique(invoice_id)', 'Ya existe un job de upload para esta factura'),
+    ]
+
+    def init(self):
+        # Índice parcial para el claim: sólo contiene los jobs pendientes
+        create_index(
+            self._cr, 'mercadolibre_upload_job_claim_idx', self._table,
+            ['priority DESC', 'next_retry_at', 'id'], where="state = 'pending'"
+        )
+
+    @api.model
+    def _enqueue(self, invoices, priority=10):
+        """Encola las facturas indicadas; las que ya tienen job pendiente se adelantan.
+
+        Los jobs en dead-letter no se tocan: sólo action_requeue los revive, así
+        una edición de la factura no los devuelve a la cola con los intentos en cero.
+        """
+        if not invoices:
+            return self.browse()
+        existing = self.search([('invoice_id', 'in', invoices.ids)])
+        # Un job tomado por otro worker se deja terminar
+        existing.filtered(lambda j: j.state == 'pending').write({
+            'state': 'pending',
+            'next_retry_at': fields.Datetime.now(),
+            'claimed_at': False,
+        })
+        for job in existing.filtered(lambda j: j.priority < priority):
+            job.priority = priority
+        new_invoices = invoices - existing.invoice_id
+        return existing | self.create([
+            {'invoice_id': invoice.id, 'priority': priority} for invoice in new_invoices
+        ])
+
+    @api.model
+    def _enqueue_pending_invoices(self):
+        """Encola en un solo INSERT las facturas ML pendientes que aún no tienen job"""
+        self.env['account.move'].flush_model(['is_ml_sale', 'ml_uploaded', 'state', 'ml_pack_id'])
+        # Mismo predicado que el índice parcial account_move_ml_pending_upload_idx
+        self.env.cr.execute(f"""
+            INSERT INTO mercadolibre_upload_job
+                   (invoice_id, state, priority, attempts, claim_count, next_retry_at,
+                    create_uid, create_date, write_uid, write_date)
+            SELECT am.id, 'pending', 10, 0, 0, am.create_date,
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+              FROM account_move am
+             WHERE {ML_PENDING_UPLOAD_WHERE}
+               AND NOT EXISTS (SELECT 1 FROM mercadolibre_upload_job j WHERE j.invoice_id = am.id)
+             ORDER BY am.create_date, am.id
+        """, {'uid': self.env.uid})
+        if self.env.cr.rowcount:
+            _logger.info("Enqueued %d pending ML invoices for upload", self.env.cr.rowcount)
+        return self.env.cr.rowcount
+
+    @api.model
+    def _claim(self, limit, pdf_grace_minutes=None):
+        """Toma hasta `limit` jobs listos en un cursor propio y los marca 'processing'.
+
+        Con `pdf_grace_minutes` (pre-render activo) sólo se toman facturas con el
+        PDF ya generado, salvo que el job lleve más de ese tiempo esperando.
+
+        Devuelve una lista de (job_id, invoice_id). El claim se confirma antes de
+        devolver, así los jobs quedan reservados aunque la transacción del
+        llamador siga abierta.
+        """
+        pdf_join = pdf_filter = ''
+        params = {'limit': limit}
+        if pdf_grace_minutes is not None:
+            pdf_join = 'JOIN account_move am ON am.id = j.invoice_id'
+            pdf_filter = """
+                           AND (am.ml_pdf_cache_key IS NOT NULL
+                                OR j.prerendered_at IS NOT NULL
+                                OR j.create_date < (now() at time zone 'UTC') - make_interval(mins => %(grace)s))"""
+            params['grace'] = pdf_grace_minutes
+        stale_minutes = self._stale_claim_minutes(self.env['mercadolibre.config'].get_active_config())
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                UPDATE mercadolibre_upload_job
+                   SET state = 'pending', claimed_at = NULL
+                 WHERE state = 'processing'
+                   AND claimed_at < (now() at time zone 'UTC') - make_interval(mins => %s)
+            """, (stale_minutes,))
+            cr.execute("""
+                UPDATE mercadolibre_upload_job
+                   SET state = 'processing',
+                       claimed_at = now() at time zone 'UTC',
+                       claim_count = COALESCE(claim_count, 0) + 1,
+                       write_date = now() at time zone 'UTC'
+                 WHERE id IN (
+                        SELECT j.id
+                          FROM mercadolibre_upload_job j
+                          %s
+                         WHERE j.state = 'pending'
+                           AND j.next_retry_at <= now() at time zone 'UTC'%s
+                         ORDER BY j.priority DESC, j.next_retry_at, j.id
+                         LIMIT %%(limit)s
+                           FOR UPDATE OF j SKIP LOCKED
+                 )
+             RETURNING id, invoice_id, priority
+            """ % (pdf_join, pdf_filter), params)
+            rows = cr.fetchall()
+        # RETURNING no respeta el ORDER BY de la subconsulta
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return [(job_id, invoice_id) for job_id, invoice_id, priority in rows]
+
+    @api.model
+    def _stale_claim_minutes(self, config):
+        """Minutos tras los cuales un job en 'processing' se devuelve a la cola.
+
+        Una ejecución del cron puede durar upload_time_limit más lo que ya estaba en
+        curso: reclamar antes sus jobs haría que otra ejecución suba la misma factura.
+        """
+        if not config:
+            return STALE_CLAIM_MINUTES
+        return max(STALE_CLAIM_MINUTES, math.ceil(config.upload_time_limit / 60) + STALE_CLAIM_MARGIN_MINUTES)
+
+    @api.model
+    def _claim_invoices(self, invoices, priority=10):
+        """Encola y toma los jobs de `invoices` en la transacción actual (upload manual).
+
+        El lock de las filas dura hasta el commit del llamador, así el cron no
+        toma las mismas facturas mientras tanto. Los jobs que ya está
+        procesando otro worker se omiten.
+        """
+        jobs = self._enqueue(invoices, priority=priority)
+        if not jobs:
+            return jobs
+        self.flush_model()
+        self.env.cr.execute("""
+            UPDATE mercadolibre_upload_job
+               SET state = 'processing',
+                   claimed_at = now() at time zone 'UTC',
+                   claim_count = COALESCE(claim_count, 0) + 1
+             WHERE id IN (
+                    SELECT id
+                      FROM mercadolibre_upload_job
+                     WHERE id = ANY(%s)
+                       AND state = 'pending'
+                       FOR UPDATE SKIP LOCKED
+             )
+         RETURNING id
+        """, (jobs.ids,))
+        claimed = self.browse([row[0] for row in self.env.cr.fetchall()])
+        self.invalidate_model(['state', 'claimed_at', 'claim_count'])
+        return claimed
+
+    @api.model
+    def _claim_for_render(self, limit):
+        """Jobs pendientes cuya factura aún no tiene PDF ni fue pre-renderizada,
+        bloqueados hasta el commit del llamador.
+
+        El upload los salta (SKIP LOCKED) mientras se renderizan.
+        """
+        self.flush_model()
+        self.env['account.move'].flush_model(['ml_pdf_cache_key'])
+        self.env.cr.execute("""
+            SELECT j.id
+              FROM mercadolibre_upload_job j
+              JOIN account_move am ON am.id = j.invoice_id
+             WHERE j.state = 'pending'
+               AND am.ml_pdf_cache_key IS NULL
+               AND j.prerendered_at IS NULL
+               AND (j.render_error_at IS NULL OR j.render_error_at < (now() at time zone 'UTC') - interval '1 hour')
+             ORDER BY j.priority DESC, j.next_retry_at, j.id
+             LIMIT %s
+               FOR UPDATE OF j SKIP LOCKED
+        """, (limit,))
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _mark_done(self):
+        """Factura subida (o ya no elegible): el job deja de ser necesario"""
+        self.unlink()
+
+    @api.model
+    def _retry_delay(self, config, attempts):
+        """Backoff exponencial con jitter (segundos) para el intento número `attempts`"""
+        delay = min(config.upload_retry_max, config.upload_retry_base * 2 ** max(attempts - 1, 0))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _mark_failed(self, error_msg, error_type=ml_http.ERROR_TRANSIENT):
+        """Reprograma el job según el tipo de error o lo pasa a dead-letter"""
+        config = self.env['mercadolibre.config'].get_active_config()
+        max_attempts = config.upload_max_attempts if config else 8
+        now = fields.Datetime.now()
+        for job in self:
+            attempts = job.attempts + 1
+            vals = {
+                'attempts': attempts,
+                'claimed_at': False,
+                'last_error': error_msg,
+                'error_type': error_type,
+            }
+            # Los errores de autenticación no son culpa de la factura: nunca van a dead-letter
+            is_dead = error_type == ml_http.ERROR_PERMANENT or (
+                error_type == ml_http.ERROR_TRANSIENT and attempts >= max_attempts)
+            if is_dead:
+                vals['state'] = 'dead'
+                job.invoice_id.sudo().upload_status = 'dead'
+                _logger.warning("Upload job for invoice %s moved to dead letter after %d attempts (%s): %s",
+                                job.invoice_id.display_name, attempts, error_type, error_msg)
+            else:
+                delay = self._retry_delay(config, attempts) if config else 900
+                vals.update(state='pending', next_retry_at=now + timedelta(seconds=delay))
+            job.write(vals)
+
+    def action_requeue(self):
+        """Reencolar jobs (ej: dead-letter luego de corregir la factura)"""
+        jobs = self.filtered(lambda j: j.state != 'processing')
+        jobs.write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_retry_at': fields.Datetime.now(),
+            'error_type': False,
+        })
+        jobs.invoice_id.filtered(lambda m: m.upload_status == 'dead').sudo().upload_status = 'pending'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Upload Queue'),
+                'message': _('%d jobs reencolados') % len(jobs),
+                'type': 'success',
+            }
+        }
+
+    @api.model
+    def _pending_count(self):
+        return self.search_count([('state', '=', 'pending')])
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import re
 from odoo import api, fields, models
 
+from ..tools import ml_pack_parser
+
 _logger = logging.getLogger(__name__)
 
 class SaleOrder(models.Model):
@@ -37,21 +38,11 @@ class SaleOrder(models.Model):
             if not is_ml:
                 return {'is_ml_sale': False, 'ml_pack_id': False}
             
-            # Extraer Pack ID usando regex mejorado
-            pack_id_patterns = [
-                r'MercadoLibre Order\s+(\d{10,20})',  # Patrón principal ODUMBO
-                r'ML.*?(\d{13,20})',                   # Números largos después de ML
-                r'Pack.*?(\d{10,20})',                 # Pack seguido de números
-                r'Order.*?(\d{10,20})',                # Order seguido de números
-            ]
-            
-            for pattern in pack_id_patterns:
-                match = re.search(pattern, origin_text, re.IGNORECASE)
-                if match:
-                    pack_id = match.group(1)
-                    if 10 <= len(pack_id) <= 20:  # Validar longitud típica Pack ID ML
-                        _logger.info(f"Extracted ML Pack ID: {pack_id} from origin: {origin_text}")
-                        return {'is_ml_sale': True, 'ml_pack_id': pack_id}
+            # Extraer Pack ID (reglas de orden de venta, precompiladas)
+            pack_id = ml_pack_parser.extract_origin(origin_text)
+            if pack_id:
+                _logger.debug("Extracted ML Pack ID: %s from origin: %s", pack_id, origin_text)
+                return {'is_ml_sale': True, 'ml_pack_id': pack_id}
             
             # Si es ML pero no encontramos Pack ID
             _logger.warning(f"ML sale detected but no Pack ID found in: {origin_text}")
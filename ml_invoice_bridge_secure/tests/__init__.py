@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+
+from . import test_ml_existing_uploads
+from . import test_ml_pack_parser
+from . import test_ml_upload_queue
+from . import test_ml_rate_limit
+from . import test_ml_render
+from . import test_ml_pdf_cache
+from . import test_ml_query_plans
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestMLExistingUploads(TransactionCase):
+    """Detección de documentos ya subidos cuando un pack tiene varios comprobantes"""
+
+    PACK_ID = '2000001234567890'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['mercadolibre.config'].search([]).write({'active': False})
+        cls.config = cls.env['mercadolibre.config'].create({
+            'name': 'Test ML',
+            'client_id': 'client',
+            'client_secret': 'secret',
+            'access_token': 'token',
+        })
+        cls.env.registry.clear_cache()
+        partner = cls.env['res.partner'].create({'name': 'Comprador ML'})
+        cls.invoice = cls.env['account.move'].create({'move_type': 'out_invoice', 'partner_id': partner.id})
+        cls.refund = cls.env['account.move'].create({'move_type': 'out_refund', 'partner_id': partner.id})
+        (cls.invoice | cls.refund).write({'ml_pack_id': cls.PACK_ID})
+
+    def _find(self, moves, documents):
+        config_model = type(self.env['mercadolibre.config'])
+        with patch.object(config_model, '_ml_fetch_fiscal_documents',
+                          return_value={self.PACK_ID: set(documents)}):
+            return moves._ml_find_existing_uploads({})
+
+    def test_refund_does_not_take_invoice_document(self):
+        self.invoice.ml_document_id = 'DOC-INVOICE'
+        existing = self._find(self.invoice | self.refund, {'DOC-INVOICE'})
+        self.assertEqual(existing, {self.invoice.id: 'DOC-INVOICE'})
+
+    def test_refund_matches_only_unclaimed_document(self):
+        self.invoice.ml_document_id = 'DOC-INVOICE'
+        existing = self._find(self.refund, {'DOC-INVOICE', 'DOC-REFUND'})
+        self.assertEqual(existing, {self.refund.id: 'DOC-REFUND'})
+
+    def test_two_moves_without_document_are_uploaded(self):
+        existing = self._find(self.invoice | self.refund, {'DOC-A'})
+        self.assertEqual(existing, {})
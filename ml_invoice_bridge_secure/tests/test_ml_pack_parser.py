@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import TransactionCase, tagged
+
+from ..tools import ml_pack_parser
+
+
+@tagged('post_install', '-at_install')
+class TestMLPackParser(TransactionCase):
+    """Las reglas de Pack ID dan lo mismo en Python y en PostgreSQL"""
+
+    def _extract_sql(self, text):
+        columns = ', '.join('substring(%%(text)s from %%(pattern_%d)s)' % index
+                            for index in range(len(ml_pack_parser.SQL_PATTERNS)))
+        params = {'pattern_%d' % index: pattern for index, pattern in enumerate(ml_pack_parser.SQL_PATTERNS)}
+        self.env.cr.execute('SELECT COALESCE(%s)' % columns, dict(params, text=text))
+        return self.env.cr.fetchone()[0]
+
+    def test_python_and_sql_agree(self):
+        for text in ml_pack_parser.SAMPLE_ORIGINS:
+            with self.subTest(text=text):
+                self.assertEqual(self._extract_sql(text), ml_pack_parser.extract(text))
+
+    def test_invoice_rules(self):
+        self.assertEqual(ml_pack_parser.extract('Pack: 2000003456789012 / Order: 2000003456789013'),
+                         '2000003456789012')
+        self.assertEqual(ml_pack_parser.extract('Order: 4123456789 / Pack: 2000003456789013'),
+                         '2000003456789013')
+        self.assertEqual(ml_pack_parser.extract('ml 4123456789'), '4123456789')
+        self.assertIsNone(ml_pack_parser.extract('ML_4123456789'))
+        self.assertIsNone(ml_pack_parser.extract('Pack ID 1234567890'))
+
+    def test_origin_rules(self):
+        self.assertEqual(ml_pack_parser.extract_origin('MercadoLibre Order 2000005678901234 - Venta confirmada'),
+                         '2000005678901234')
+        self.assertEqual(ml_pack_parser.extract_origin('Pack ID 1234567890'), '1234567890')
+        self.assertIsNone(ml_pack_parser.extract_origin('ml 4123456789'))
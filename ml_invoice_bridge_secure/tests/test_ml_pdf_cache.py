@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from ..models import account_move
+
+PDF = b'%PDF-1.4 ' + b'0' * 2000
+
+
+@tagged('post_install', '-at_install')
+class TestMLPdfCache(TransactionCase):
+    """Cache de PDFs por contenido: reutilización, invalidación y tamaño máximo"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['mercadolibre.config'].search([]).write({'active': False})
+        cls.config = cls.env['mercadolibre.config'].create({
+            'name': 'Test ML',
+            'client_id': 'client',
+            'client_secret': 'secret',
+            'access_token': 'token',
+        })
+        cls.env.registry.clear_cache()
+        partner = cls.env['res.partner'].create({'name': 'Comprador ML'})
+        cls.invoice = cls.env['account.move'].create({'move_type': 'out_invoice', 'partner_id': partner.id})
+
+    def _generate(self, html='<html><body>Factura</body></html>'):
+        """Genera el PDF con el bypass; devuelve (pdf, veces que se llamó al render)"""
+        move_model = type(self.invoice)
+        with patch.object(move_model, '_generate_exact_invoice_html', return_value=html), \
+                patch.object(move_model, '_html_to_pdf_direct', return_value=PDF) as render:
+            pdf = self.invoice._generate_pdf_direct_bypass()
+        return pdf, render.call_count
+
+    def test_same_invoice_is_rendered_once(self):
+        self.assertEqual(self._generate(), (PDF, 1))
+        self.assertTrue(self.invoice.ml_pdf_cache_key)
+        self.assertEqual(self._generate(), (PDF, 0))
+
+    def test_changed_html_is_rendered_again(self):
+        self._generate()
+        self.assertEqual(self._generate('<html><body>Otra factura</body></html>'), (PDF, 1))
+
+    def test_write_drops_cached_pdf(self):
+        self._generate()
+        self.invoice.ref = 'Nueva referencia'
+        self.assertFalse(self.invoice.ml_pdf_cache_key)
+        self.assertFalse(self.invoice._ml_pdf_cache_attachment())
+        self.assertEqual(self._generate(), (PDF, 1))
+
+    def test_upload_fields_keep_cached_pdf(self):
+        self._generate()
+        self.invoice.upload_status = 'error'
+        self.assertTrue(self.invoice.ml_pdf_cache_key)
+        self.assertEqual(self._generate(), (PDF, 0))
+
+    def test_oversized_pdf_is_not_cached(self):
+        with patch.object(account_move, 'ML_PDF_CACHE_MAX_BYTES', len(PDF) - 1):
+            self.assertEqual(self._generate(), (PDF, 1))
+            self.assertFalse(self.invoice.ml_pdf_cache_key)
+            self.assertEqual(self._generate(), (PDF, 1))
+
+    def test_write_resets_prerendered_job(self):
+        job = self.env['mercadolibre.upload.job']._enqueue(self.invoice)
+        self._generate()
+        job.prerendered_at = fields.Datetime.now()
+        self.assertFalse(job._claim_for_render(10))
+        self.invoice.ref = 'Nueva referencia'
+        self.assertFalse(job.prerendered_at)
+        self.assertEqual(job._claim_for_render(10), job)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models.account_move import ML_PENDING_UPLOAD_WHERE
+
+
+@tagged('post_install', '-at_install')
+class TestMLQueryPlans(TransactionCase):
+    """Las consultas ML pueden usar sus índices.
+
+    Con pocas filas PostgreSQL prefiere un seq scan aunque el índice sirva, así
+    que el plan se evalúa con enable_seqscan desactivado: eso confirma que el
+    predicado de la consulta coincide con el del índice.
+    """
+
+    def _plan_indexes(self, plan):
+        """Índices usados en cualquier nodo del plan"""
+        indexes = {plan['Index Name']} if 'Index Name' in plan else set()
+        for subplan in plan.get('Plans', ()):
+            indexes |= self._plan_indexes(subplan)
+        return indexes
+
+    def _assert_uses_index(self, query, index_name):
+        self.env.cr.execute("SET LOCAL enable_seqscan = off")
+        self.env.cr.execute("EXPLAIN (FORMAT JSON) " + query)
+        plan = self.env.cr.fetchone()[0][0]['Plan']
+        self.assertIn(index_name, self._plan_indexes(plan))
+
+    def test_pending_upload_sweep(self):
+        self._assert_uses_index(
+            f"SELECT id FROM account_move WHERE {ML_PENDING_UPLOAD_WHERE} ORDER BY create_date, id LIMIT 100",
+            'account_move_ml_pending_upload_idx')
+
+    def test_upload_status_filter(self):
+        self._assert_uses_index(
+            "SELECT id FROM account_move WHERE is_ml_sale AND upload_status = 'error'",
+            'account_move_ml_upload_status_idx')
+
+    def test_pack_id_lookup(self):
+        self._assert_uses_index(
+            "SELECT id FROM account_move WHERE ml_pack_id = '2000000000000000'",
+            'account_move__ml_pack_id_index')
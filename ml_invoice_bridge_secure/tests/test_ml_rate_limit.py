@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import time
+from email.utils import formatdate
+from unittest.mock import Mock, call, patch
+
+from odoo.tests import TransactionCase, tagged
+
+from ..models import mercadolibre_rate_limit
+from ..models.mercadolibre_config import ML_RATE_LIMIT_BUCKET
+from ..tools import ml_http
+
+
+@tagged('post_install', '-at_install')
+class TestMLRateLimit(TransactionCase):
+    """Token bucket compartido y manejo de 401/429 en _ml_request"""
+
+    BUCKET = 'test_bucket'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['mercadolibre.config'].search([]).write({'active': False})
+        cls.config = cls.env['mercadolibre.config'].create({
+            'name': 'Test ML',
+            'client_id': 'client',
+            'client_secret': 'secret',
+            'access_token': 'token',
+        })
+        cls.env.registry.clear_cache()
+        cls.limiter = cls.env['mercadolibre.rate.limit']
+
+    def setUp(self):
+        super().setUp()
+        # El bucket se actualiza en un cursor propio: en modo test comparte la transacción del test
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+    def _bucket(self):
+        self.env.invalidate_all()
+        return self.limiter.search([('name', '=', self.BUCKET)])
+
+    # Token bucket
+
+    def test_burst_then_wait(self):
+        # 6 por minuto: un token cada 10 segundos
+        self.assertEqual(self.limiter._try_acquire(self.BUCKET, 6, 2), 0)
+        self.assertEqual(self.limiter._try_acquire(self.BUCKET, 6, 2), 0)
+        wait_seconds = self.limiter._try_acquire(self.BUCKET, 6, 2)
+        self.assertGreater(wait_seconds, 9)
+        self.assertLessEqual(wait_seconds, 10)
+
+    def test_penalize_blocks_and_halves_rate(self):
+        self.limiter._try_acquire(self.BUCKET, 60, 5)
+        self.limiter._penalize(self.BUCKET, 30)
+        bucket = self._bucket()
+        self.assertEqual(bucket.tokens, 0)
+        self.assertEqual(bucket.rate_factor, 0.5)
+        wait_seconds = self.limiter._try_acquire(self.BUCKET, 60, 5)
+        self.assertGreater(wait_seconds, 29)
+        self.assertLessEqual(wait_seconds, 30)
+
+    def test_penalize_keeps_minimum_rate(self):
+        for _i in range(10):
+            self.limiter._penalize(self.BUCKET, 0)
+        self.assertEqual(self._bucket().rate_factor, mercadolibre_rate_limit.MIN_RATE_FACTOR)
+
+    def test_rate_recovers_on_success(self):
+        self.limiter._penalize(self.BUCKET, 0)
+        self.limiter._penalize(self.BUCKET, 0)
+        self._bucket().write({'tokens': 5})
+        self.env.flush_all()
+        self.assertEqual(self.limiter._try_acquire(self.BUCKET, 60, 5), 0)
+        self.assertAlmostEqual(self._bucket().rate_factor, 0.25 + mercadolibre_rate_limit.RATE_FACTOR_RECOVERY)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(self.limiter._parse_retry_after('7'), 7.0)
+        self.assertEqual(self.limiter._parse_retry_after('-3'), 0.0)
+        self.assertEqual(self.limiter._parse_retry_after(None), 10.0)
+        self.assertEqual(self.limiter._parse_retry_after('mañana', default=4.0), 4.0)
+        http_date = formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(self.limiter._parse_retry_after(http_date), 60, delta=2)
+
+    # _ml_request
+
+    def _request(self, responses, tokens=('old', 'new'), **kwargs):
+        """Ejecuta _ml_request con respuestas HTTP simuladas.
+
+        Devuelve (respuesta, sesión, mock de _get_access_token, mock de _penalize).
+        """
+        session = Mock()
+        session.request.side_effect = [Mock(status_code=status, headers=headers) for status, headers in responses]
+        config_model = type(self.config)
+        limiter_model = type(self.limiter)
+        with patch.object(ml_http, 'get_session', return_value=session), \
+                patch.object(config_model, '_get_access_token', side_effect=list(tokens)) as get_token, \
+                patch.object(limiter_model, '_acquire', return_value=True), \
+                patch.object(limiter_model, '_penalize') as penalize:
+            response = self.config._ml_request('GET', 'https://api.mercadolibre.com/test', **kwargs)
+        return response, session, get_token, penalize
+
+    def _authorization(self, session):
+        return [c.kwargs['headers']['Authorization'] for c in session.request.call_args_list]
+
+    def test_401_refreshes_token_once(self):
+        response, session, get_token, _penalize = self._request([(401, {}), (200, {})])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._authorization(session), ['Bearer old', 'Bearer new'])
+        self.assertEqual(get_token.call_args_list[1], call(force_refresh=True, stale_token='old'))
+
+    def test_second_401_is_returned(self):
+        response, session, _get_token, _penalize = self._request([(401, {}), (401, {})])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(session.request.call_count, 2)
+
+    def test_401_without_new_token_is_returned(self):
+        response, session, _get_token, _penalize = self._request([(401, {})], tokens=('old', 'old'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(session.request.call_count, 1)
+
+    def test_429_waits_retry_after(self):
+        response, session, _get_token, penalize = self._request(
+            [(429, {'Retry-After': '7'}), (200, {})], tokens=('old', 'old'))
+        self.assertEqual(response.status_code, 200)
+        penalize.assert_called_once_with(ML_RATE_LIMIT_BUCKET, 7.0)
+        self.assertEqual(session.request.call_count, 2)
+
+    def test_429_gives_up_after_max_retries(self):
+        response, session, _get_token, penalize = self._request(
+            [(429, {})] * 3, tokens=('old',) * 3, max_throttle_retries=2)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(session.request.call_count, 3)
+        self.assertEqual(penalize.call_count, 3)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+import io
+from unittest.mock import patch
+
+from odoo.exceptions import UserError
+from odoo.tests import TransactionCase, tagged
+from odoo.tools.pdf import PdfFileReader
+
+from ..tools import ml_render
+
+PAGE_BREAK = '<div style="page-break-after: always">Página 1</div><div>Página 2</div>'
+
+
+@tagged('post_install', '-at_install')
+class TestMLRenderBatch(TransactionCase):
+    """Render por lotes: separación por outline y fallback por factura"""
+
+    def _html(self, body):
+        return f'<html><head><meta charset="utf-8"/></head><body>{body}</body></html>'
+
+    def _page_count(self, pdf):
+        return PdfFileReader(io.BytesIO(pdf)).getNumPages()
+
+    def test_batch_is_split_by_outline(self):
+        if not ml_render.wkhtmltopdf_path():
+            self.skipTest('wkhtmltopdf no está instalado')
+        documents = [self._html('Factura A'), self._html(PAGE_BREAK), self._html('Factura C')]
+        with patch.object(ml_render, 'html_to_pdf', side_effect=AssertionError('render individual')):
+            pdfs = ml_render.html_to_pdf_batch(documents)
+        self.assertEqual([self._page_count(pdf) for pdf in pdfs], [1, 2, 1])
+
+    def test_batch_split_as_files(self):
+        if not ml_render.wkhtmltopdf_path():
+            self.skipTest('wkhtmltopdf no está instalado')
+        pdf_files = ml_render.html_to_pdf_batch([self._html('Factura A'), self._html('Factura B')], as_file=True)
+        for pdf_file in pdf_files:
+            with pdf_file:
+                self.assertEqual(PdfFileReader(pdf_file).getNumPages(), 1)
+
+    def test_unsplittable_batch_renders_one_by_one(self):
+        documents = [self._html('A'), self._html('B')]
+        with patch.object(ml_render, 'service_available', return_value=False), \
+                patch.object(ml_render, '_render_batch_with_subprocess', return_value=None), \
+                patch.object(ml_render, 'html_to_pdf', side_effect=[b'pdf-a', b'pdf-b']) as html_to_pdf:
+            pdfs = ml_render.html_to_pdf_batch(documents)
+        self.assertEqual(pdfs, [b'pdf-a', b'pdf-b'])
+        self.assertEqual(html_to_pdf.call_count, 2)
+
+    def test_failed_batch_isolates_the_broken_invoice(self):
+        documents = [self._html('A'), self._html('rota'), self._html('C')]
+        error = UserError('Error generando PDF')
+        with patch.object(ml_render, 'service_available', return_value=False), \
+                patch.object(ml_render, '_render_batch_with_subprocess', side_effect=UserError('lote')), \
+                patch.object(ml_render, 'html_to_pdf', side_effect=[b'pdf-a', error, b'pdf-c']):
+            pdfs = ml_render.html_to_pdf_batch(documents)
+        self.assertEqual(pdfs, [b'pdf-a', error, b'pdf-c'])
+
+    def test_split_marker_only_in_batch(self):
+        rendered = []
+
+        def run(html_contents, *args, **kwargs):
+            rendered.append(list(html_contents))
+            return b'%PDF'
+
+        def run_to_file(html_contents, *args, **kwargs):
+            run(html_contents)
+            return io.BytesIO(b'%PDF')
+
+        with patch.object(ml_render, 'service_available', return_value=False), \
+                patch.object(ml_render, '_run_wkhtmltopdf', side_effect=run), \
+                patch.object(ml_render, '_run_wkhtmltopdf_to_file', side_effect=run_to_file), \
+                patch.object(ml_render, '_split_by_outline', return_value=[b'a', b'b']):
+            ml_render.html_to_pdf(self._html('Sola'))
+            ml_render.html_to_pdf_batch([self._html('Sola')])
+            ml_render.html_to_pdf_batch([self._html('A'), self._html('B')])
+        single, single_batch, batch = rendered
+        self.assertNotIn('ml-doc-', single[0])
+        self.assertNotIn('ml-doc-', single_batch[0])
+        self.assertEqual(['ml-doc-%d' % index in html for index, html in enumerate(batch)], [True, True])
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from ..models import mercadolibre_upload_job
+from ..tools import ml_http
+
+
+@tagged('post_install', '-at_install')
+class TestMLUploadQueue(TransactionCase):
+    """Claim, reclamo de jobs huérfanos, backoff y dead-letter de la cola de upload"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['mercadolibre.config'].search([]).write({'active': False})
+        cls.config = cls.env['mercadolibre.config'].create({
+            'name': 'Test ML',
+            'client_id': 'client',
+            'client_secret': 'secret',
+            'access_token': 'token',
+            'upload_max_attempts': 3,
+            'upload_retry_base': 60,
+            'upload_retry_max': 600,
+        })
+        cls.env.registry.clear_cache()
+        partner = cls.env['res.partner'].create({'name': 'Comprador ML'})
+        cls.invoice = cls.env['account.move'].create({'move_type': 'out_invoice', 'partner_id': partner.id})
+        cls.Job = cls.env['mercadolibre.upload.job']
+
+    def setUp(self):
+        super().setUp()
+        # _claim trabaja en un cursor propio: en modo test comparte la transacción del test
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+        self.job = self.Job._enqueue(self.invoice)
+
+    def _claim(self, limit=10):
+        self.env.flush_all()
+        claimed = self.Job._claim(limit)
+        self.env.invalidate_all()
+        return claimed
+
+    def test_claim_marks_processing(self):
+        self.assertEqual(self._claim(), [(self.job.id, self.invoice.id)])
+        self.assertEqual(self.job.state, 'processing')
+        self.assertEqual(self.job.claim_count, 1)
+        self.assertTrue(self.job.claimed_at)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        self._claim()
+        self.assertEqual(self._claim(), [])
+
+    def test_claim_waits_for_next_retry(self):
+        self.job.next_retry_at = fields.Datetime.now() + timedelta(minutes=5)
+        self.assertEqual(self._claim(), [])
+
+    def test_claim_invoices_skips_processing_job(self):
+        self._claim()
+        self.assertFalse(self.Job._claim_invoices(self.invoice))
+
+    def test_stale_claim_is_reclaimed(self):
+        stale_minutes = self.Job._stale_claim_minutes(self.config)
+        self._claim()
+        self.job.claimed_at = fields.Datetime.now() - timedelta(minutes=stale_minutes + 1)
+        self.assertEqual(self._claim(), [(self.job.id, self.invoice.id)])
+        self.assertEqual(self.job.claim_count, 2)
+
+    def test_recent_claim_is_not_reclaimed(self):
+        stale_minutes = self.Job._stale_claim_minutes(self.config)
+        self._claim()
+        self.job.claimed_at = fields.Datetime.now() - timedelta(minutes=stale_minutes - 5)
+        self.assertEqual(self._claim(), [])
+
+    def test_stale_window_covers_cron_time_limit(self):
+        self.config.upload_time_limit = 3 * 3600
+        self.assertEqual(self.Job._stale_claim_minutes(self.config),
+                         180 + mercadolibre_upload_job.STALE_CLAIM_MARGIN_MINUTES)
+
+    def test_transient_failure_backs_off(self):
+        self.job.attempts = 1
+        with patch.object(mercadolibre_upload_job.random, 'uniform', return_value=1.0):
+            before = fields.Datetime.now()
+            self.job._mark_failed('timeout', ml_http.ERROR_TRANSIENT)
+        self.assertEqual(self.job.state, 'pending')
+        self.assertEqual(self.job.attempts, 2)
+        self.assertFalse(self.job.claimed_at)
+        # Segundo intento: base * 2
+        delay = (self.job.next_retry_at - before).total_seconds()
+        self.assertAlmostEqual(delay, 120, delta=2)
+
+    def test_backoff_is_capped(self):
+        with patch.object(mercadolibre_upload_job.random, 'uniform', return_value=1.0):
+            self.assertEqual(self.Job._retry_delay(self.config, 10), 600)
+
+    def test_transient_failure_dies_at_max_attempts(self):
+        self.job.attempts = 2
+        self.job._mark_failed('timeout', ml_http.ERROR_TRANSIENT)
+        self.assertEqual(self.job.state, 'dead')
+        self.assertEqual(self.invoice.upload_status, 'dead')
+
+    def test_permanent_failure_dies_at_once(self):
+        self.job._mark_failed('bad request', ml_http.ERROR_PERMANENT)
+        self.assertEqual(self.job.state, 'dead')
+        self.assertEqual(self.job.attempts, 1)
+        self.assertEqual(self.invoice.upload_status, 'dead')
+
+    def test_auth_failure_never_dies(self):
+        self.job.attempts = 10
+        self.job._mark_failed('token expired', ml_http.ERROR_AUTH)
+        self.assertEqual(self.job.state, 'pending')
+        self.assertEqual(self.job.error_type, ml_http.ERROR_AUTH)
+        self.assertNotEqual(self.invoice.upload_status, 'dead')
+
+    def test_dead_job_is_not_revived_by_enqueue(self):
+        self.job._mark_failed('bad request', ml_http.ERROR_PERMANENT)
+        self.Job._enqueue(self.invoice)
+        self.assertEqual(self.job.state, 'dead')
+        self.job.action_requeue()
+        self.assertEqual(self.job.state, 'pending')
+        self.assertEqual(self.job.attempts, 0)
+        self.assertEqual(self.invoice.upload_status, 'pending')
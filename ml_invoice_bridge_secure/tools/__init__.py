@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Utilidades sin ORM (no usan env, cursores ni modelos): pueden usarse desde
+# hilos del pool de upload. Sólo importan de odoo excepciones y odoo.tools.
+
+from . import ml_http
+from . import ml_async
+from . import ml_render
+from . import ml_invoice_html
+from . import ml_pack_parser
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+
+_logger = logging.getLogger(__name__)
+
+# Dependencias opcionales: sin httpx el motor async no está disponible y el
+# cron usa el pool de hilos; sin h2 se usa HTTP/1.1 con keep-alive
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+FISCAL_DOCUMENTS_URL = 'https://api.mercadolibre.com/packs/%s/fiscal_documents'
+
+
+def is_available():
+    return httpx is not None
+
+
+async def _post_fiscal_document(client, semaphore, payload, token, hooks, deadline, max_throttle_retries):
+    """Sube un PDF respetando el semáforo de concurrencia y el token bucket compartido"""
+    loop = asyncio.get_running_loop()
+    response = None
+    async with semaphore:
+        for attempt in range(max_throttle_retries + 1):
+            if time.monotonic() >= deadline:
+                # No iniciado: el job vuelve a la cola sin consumir un intento
+                return payload['invoice_id'], None
+
+            # El token bucket vive en PostgreSQL: se consulta fuera del event loop
+            if not await loop.run_in_executor(None, hooks['acquire']):
+                return payload['invoice_id'], None
+
+            # El PDF puede ser un archivo abierto: rebobinarlo en cada reenvío
+            if hasattr(payload['pdf'], 'seek'):
+                payload['pdf'].seek(0)
+            try:
+                response = await client.post(
+                    FISCAL_DOCUMENTS_URL % payload['pack_id'],
+                    files={'fiscal_document': (payload['filename'], payload['pdf'], 'application/pdf')},
+                    headers={'Authorization': f'Bearer {token}'},
+                )
+            except httpx.HTTPError as e:
+                return payload['invoice_id'], e
+
+            if response.status_code != 429:
+                return payload['invoice_id'], response
+
+            retry_after = hooks['parse_retry_after'](response.headers.get('Retry-After'))
+            await loop.run_in_executor(None, hooks['penalize'], retry_after)
+    return payload['invoice_id'], response
+
+
+async def _transmit(payloads, token, concurrency, hooks, deadline, timeout, max_throttle_retries):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        limits=limits,
+        timeout=timeout,
+        headers={'Accept': 'application/json'},
+    ) as client:
+        return await asyncio.gather(*[
+            _post_fiscal_document(client, semaphore, payload, token, hooks, deadline, max_throttle_retries)
+            for payload in payloads
+        ])
+
+
+def transmit(payloads, token, concurrency, hooks, deadline, timeout=30, max_throttle_retries=3):
+    """Sube muchos PDFs multiplexados en un único event loop.
+
+    payloads: lista de dicts con invoice_id, pack_id, filename y pdf (bytes o
+    archivo binario abierto, que httpx envía por bloques).
+    hooks: callables bloqueantes 'acquire', 'penalize' y 'parse_retry_after' del
+    rate limiter compartido. No usa el ORM, por lo que puede correr mientras la
+    transacción del llamador sigue abierta.
+
+    Devuelve {invoice_id: respuesta httpx | excepción | None si no se inició}.
+    """
+    if not payloads:
+        return {}
+    start = time.monotonic()
+    results = asyncio.run(_transmit(payloads, token, concurrency, hooks, deadline, timeout, max_throttle_retries))
+    _logger.info("Async ML transmit: %d documents in %.1fs (concurrency %d, http2=%s)",
+                 len(payloads), time.monotonic() - start, concurrency, HTTP2_AVAILABLE)
+    return dict(results)
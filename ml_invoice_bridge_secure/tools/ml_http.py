@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _build_session(pool_size):
+    """Crea una sesión con keep-alive, pool de conexiones y reintentos de conexión"""
+    retry = Retry(
+        total=3,
+        connect=3,
+        # Sólo se reintentan lecturas en métodos idempotentes: un POST cortado
+        # después de enviarse pudo haber sido aceptado por MercadoLibre
+        read=2,
+        status=0,
+        backoff_factor=0.5,
+        allowed_methods=frozenset({'GET', 'HEAD', 'OPTIONS'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Accept': 'application/json', 'Connection': 'keep-alive'})
+    return session
+
+
+def get_session(pool_size=10):
+    """Devuelve la sesión HTTP del proceso actual para el tamaño de pool pedido.
+
+    La sesión se reutiliza entre facturas, ejecuciones de cron y requests del
+    mismo worker. Se indexa por PID porque las conexiones abiertas no pueden
+    compartirse entre procesos tras el fork de los workers de Odoo.
+    """
+    key = (os.getpid(), pool_size)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                _logger.info("Creating MercadoLibre HTTP session (pool size %d, pid %d)", pool_size, key[0])
+                session = _sessions[key] = _build_session(pool_size)
+    return session
+
+
+# Clasificación de errores de upload (define reintentos y dead-letter)
+ERROR_TRANSIENT = 'transient'
+ERROR_AUTH = 'auth'
+ERROR_PERMANENT = 'permanent'
+
+ERROR_TYPES = [
+    (ERROR_TRANSIENT, 'Transient'),
+    (ERROR_AUTH, 'Authentication'),
+    (ERROR_PERMANENT, 'Permanent'),
+]
+
+
+def classify_status(status_code):
+    """Clasifica un código HTTP de respuesta de MercadoLibre"""
+    if status_code in (401, 403):
+        return ERROR_AUTH
+    if status_code in (408, 425, 429) or status_code >= 500:
+        return ERROR_TRANSIENT
+    return ERROR_PERMANENT
+
+
+class MLUploadError(UserError):
+    """Error de upload que conserva su clasificación para la política de reintentos"""
+
+    def __init__(self, message, error_type=ERROR_TRANSIENT):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+def extract_document_ids(data):
+    """IDs de documentos fiscales en una respuesta de /packs/{id}/fiscal_documents.
+
+    Acepta las variantes que devuelve la API: {'ids': [...]}, {'id': ...},
+    {'fiscal_documents': [{'id': ...}, ...]} o directamente una lista.
+    """
+    if not data:
+        return []
+    if isinstance(data, dict):
+        if data.get('ids'):
+            return [str(doc_id) for doc_id in data['ids']]
+        if data.get('id'):
+            return [str(data['id'])]
+        data = data.get('fiscal_documents') or data.get('results') or []
+    ids = []
+    for item in data if isinstance(data, list) else []:
+        doc_id = item.get('id') if isinstance(item, dict) else item
+        if doc_id:
+            ids.append(str(doc_id))
+    return ids
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_sha256(fileobj):
+    """SHA-256 de un archivo leído por bloques; deja el archivo al inicio"""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def file_size(fileobj):
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+class MultipartFileStream:
+    """Cuerpo multipart/form-data con un único archivo, leído por bloques.
+
+    requests lo envía en streaming con Content-Length (sin copiar el PDF a
+    memoria). Admite seek(0) para que _ml_request pueda reenviarlo.
+    """
+
+    def __init__(self, field_name, filename, fileobj, content_type='application/octet-stream'):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+        self._head = (
+            '--%s\r\n'
+            'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            'Content-Type: %s\r\n\r\n' % (boundary, field_name, filename.replace('"', ''), content_type)
+        ).encode('utf-8')
+        self._tail = ('\r\n--%s--\r\n' % boundary).encode('ascii')
+        self._file = fileobj
+        self._length = len(self._head) + file_size(fileobj) + len(self._tail)
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if offset != 0 or whence != os.SEEK_SET:
+            raise ValueError('MultipartFileStream only supports rewinding')
+        self._file.seek(0)
+        self._part = 0
+        self._pending = self._head
+
+    def tell(self):
+        # super_len de requests usa len() y no debe descontar lo ya leído
+        return 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._length
+        out = []
+        while size > 0 and self._part < 3:
+            if self._part == 1:
+                chunk = self._file.read(min(size, CHUNK_SIZE))
+                if not chunk:
+                    self._part = 2
+                    self._pending = self._tail
+                    continue
+            else:
+                chunk, self._pending = self._pending[:size], self._pending[size:]
+                if not self._pending:
+                    self._part += 1
+                    self._pending = b''
+            out.append(chunk)
+            size -= len(chunk)
+        return b''.join(out)
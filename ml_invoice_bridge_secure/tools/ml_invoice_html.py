@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+# Plantilla HTML de la factura ML. Las partes estáticas (encabezado y CSS) se
+# arman una sola vez por proceso; cada factura sólo rellena valores ya
+# calculados (escapando el texto libre) y une sus filas con join.
+
+from html import escape
+
+HTML_HEAD = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <style>
+        @page {
+            size: A4;
+            margin: 10mm;
+        }
+        
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }
+        
+        body {
+            font-family: Arial, sans-serif;
+            font-size: 11px;
+            line-height: 1.4;
+            color: #000;
+        }
+        
+        /* Header con 3 columnas */
+        .header {
+            display: table;
+            width: 100%;
+            margin-bottom: 20px;
+        }
+        
+        .header-left {
+            display: table-cell;
+            width: 40%;
+            vertical-align: top;
+        }
+        
+        .header-center {
+            display: table-cell;
+            width: 20%;
+            text-align: center;
+            vertical-align: top;
+            padding: 0 10px;
+        }
+        
+        .header-right {
+            display: table-cell;
+            width: 40%;
+            vertical-align: top;
+            text-align: right;
+        }
+        
+        /* Logo circular */
+        .logo-container {
+            width: 60px;
+            height: 60px;
+            border-radius: 50%;
+            overflow: hidden;
+            background: #1a237e;
+            display: inline-block;
+            margin-bottom: 10px;
+        }
+        
+        .logo {
+            width: 100%;
+            height: 100%;
+            object-fit: contain;
+        }
+        
+        .company-name {
+            font-size: 14px;
+            font-weight: bold;
+            margin: 5px 0;
+        }
+        
+        .company-info {
+            font-size: 10px;
+            line-height: 1.3;
+            color: #333;
+        }
+        
+        /* Tipo de factura */
+        .doc-type-box {
+            font-size: 48px;
+            font-weight: bold;
+            border: 3px solid #000;
+            width: 80px;
+            height: 80px;
+            display: inline-flex;
+            align-items: center;
+            justify-content: center;
+            margin: 10px auto;
+        }
+        
+        .doc-code {
+            font-size: 10px;
+            margin-top: 5px;
+        }
+        
+        .invoice-title {
+            font-size: 20px;
+            font-weight: bold;
+            color: #1a237e;
+            margin-bottom: 10px;
+        }
+        
+        .invoice-details {
+            font-size: 11px;
+            line-height: 1.6;
+            text-align: left;
+        }
+        
+        /* Sección cliente */
+        .client-section {
+            background: #f5f5f5;
+            padding: 15px;
+            margin: 20px 0;
+            border-radius: 5px;
+        }
+        
+        .client-grid {
+            display: table;
+            width: 100%;
+        }
+        
+        .client-col {
+            display: table-cell;
+            width: 50%;
+            padding-right: 20px;
+        }
+        
+        .client-row {
+            margin-bottom: 5px;
+        }
+        
+        .client-label {
+            font-weight: bold;
+            color: #555;
+            display: inline-block;
+            min-width: 120px;
+        }
+        
+        /* Tabla de items */
+        .items-table {
+            width: 100%;
+            border-collapse: collapse;
+            margin: 20px 0;
+        }
+        
+        .items-table th {
+            background: #1a237e;
+            color: white;
+            padding: 10px;
+            text-align: left;
+            font-weight: normal;
+        }
+        
+        .items-table td {
+            padding: 10px;
+            border-bottom: 1px solid #e0e0e0;
+        }
+        
+        .items-table th.text-right,
+        .items-table td.text-right {
+            text-align: right;
+        }
+        
+        .items-table th.text-center,
+        .items-table td.text-center {
+            text-align: center;
+        }
+        
+        /* Totales */
+        .totals-section {
+            margin-top: 30px;
+            text-align: right;
+        }
+        
+        .total-box {
+            display: inline-block;
+            background: #1a237e;
+            color: white;
+            padding: 15px 30px;
+            font-size: 18px;
+            font-weight: bold;
+            border-radius: 5px;
+            margin-top: 10px;
+        }
+        
+        .total-words {
+            margin-top: 10px;
+            font-style: italic;
+        }
+        
+        /* Régimen transparencia */
+        .transparencia-box {
+            background: #fff3cd;
+            border: 1px solid #ffeaa7;
+            padding: 10px;
+            margin: 20px 0;
+            border-radius: 5px;
+        }
+        
+        /* Footer */
+        .footer {
+            margin-top: 40px;
+            padding-top: 20px;
+            border-top: 2px solid #e0e0e0;
+        }
+        
+        .footer-content {
+            display: table;
+            width: 100%;
+        }
+        
+        .footer-left {
+            display: table-cell;
+            width: 70%;
+            vertical-align: top;
+        }
+        
+        .footer-right {
+            display: table-cell;
+            width: 30%;
+            text-align: center;
+            vertical-align: top;
+        }
+        
+        .cae-info {
+            background: #f5f5f5;
+            padding: 10px;
+            border-radius: 5px;
+            margin-bottom: 10px;
+        }
+        
+        .qr-code {
+            width: 120px;
+            height: 120px;
+        }
+        
+        .page-info {
+            text-align: center;
+            margin-top: 20px;
+            font-size: 10px;
+            color: #666;
+        }
+    </style>
+</head>
+"""
+
+BODY_TEMPLATE = """<body>
+    <!-- HEADER -->
+    <div class="header">
+        <div class="header-left">
+            <div class="logo-container">
+                {logo_html}
+            </div>
+            <div class="company-name">{company_name}</div>
+            <div class="company-info">
+                {company_street}<br>
+                {company_city} - {company_state} - 
+                {company_zip} - {company_country}<br>
+                {company_website} - {company_email}
+            </div>
+        </div>
+        
+        <div class="header-center">
+            <div class="doc-type-box">{doc_letter}</div>
+            <div class="doc-code">Cod. {doc_type_code}</div>
+        </div>
+        
+        <div class="header-right">
+            <div class="invoice-title">{doc_type_name}</div>
+            <div class="invoice-details">
+                <strong>Número:</strong> {doc_number}<br>
+                <strong>Fecha:</strong> {invoice_date}<br>
+                <strong>IVA Responsable Inscripto</strong><br>
+                <strong>CUIT:</strong> {company_vat}<br>
+                <strong>IIBB:</strong> {gross_income}<br>
+                <strong>Inicio de las actividades:</strong> {start_date}
+            </div>
+        </div>
+    </div>
+    
+    <!-- CLIENTE -->
+    <div class="client-section">
+        <div class="client-grid">
+            <div class="client-col">
+                <div class="client-row">
+                    <span class="client-label">Cliente:</span> {partner_name}
+                </div>
+                <div class="client-row">
+                    <span class="client-label">Domicilio:</span> {partner_street}, {partner_city}
+                </div>
+                <div class="client-row">
+                    <span class="client-label">Cond. IVA:</span> {partner_resp_type}
+                </div>
+            </div>
+            <div class="client-col">
+                <div class="client-row">
+                    <span class="client-label">DNI:</span> {partner_vat}
+                </div>
+                <div class="client-row">
+                    <span class="client-label">Fecha de vencimiento:</span> {invoice_date_due}
+                </div>
+                <div class="client-row">
+                    <span class="client-label">Origen:</span> {invoice_origin}
+                </div>
+            </div>
+        </div>
+    </div>
+    
+    <!-- ITEMS -->
+    <table class="items-table">
+        <thead>
+            <tr>
+                <th style="width: 50%;">Descripción</th>
+                <th style="width: 15%;" class="text-center">Cantidad</th>
+                <th style="width: 17%;" class="text-right">Precio unitario</th>
+                <th style="width: 18%;" class="text-right">Importe</th>
+            </tr>
+        </thead>
+        <tbody>
+            {items_html}
+        </tbody>
+    </table>
+    
+    <!-- TOTALES -->
+    <div class="totals-section">
+        <div class="total-box">
+            Total $ {amount_total}
+        </div>
+        <div class="total-words">
+            Importe total con letra:<br>
+            {total_words}
+        </div>
+    </div>
+    
+    <!-- Régimen de transparencia - Solo para facturas B -->
+    {transparencia_html}
+    
+    <!-- Términos -->
+    <div style="margin: 10px 0;">
+        Términos y condiciones: {terms_url}/terms
+    </div>
+    
+    <!-- FOOTER con CAE y QR -->
+    <div class="footer">
+        <div class="footer-content">
+            <div class="footer-left">
+                <div class="cae-info">
+                    <strong>CAE:</strong> {cae}<br>
+                    <strong>Fecha de vencimiento CAE:</strong> {cae_due}
+                </div>
+            </div>
+            <div class="footer-right">
+                <img src="{qr_src}" class="qr-code" />
+            </div>
+        </div>
+    </div>
+    
+    <div class="page-info">
+        Página: 1 / 1
+    </div>
+</body>
+</html>
+"""
+
+ROW_TEMPLATE = """
+                <tr>
+                    <td>{description}</td>
+                    <td class="text-center">{quantity} {uom}</td>
+                    <td class="text-right">${price}</td>
+                    <td class="text-right">$ {subtotal}</td>
+                </tr>
+                """
+
+EMPTY_ROWS_HTML = """
+            <tr>
+                <td colspan="4" style="text-align: center; padding: 20px; color: #999;">
+                    No se encontraron líneas de productos
+                </td>
+            </tr>
+            """
+
+LOGO_PLACEHOLDER_HTML = '<div style="width:100%;height:100%;background:#1a237e;"></div>'
+
+TRANSPARENCIA_TEMPLATE = """<div class="transparencia-box">
+        <strong>Régimen de Transparencia Fiscal al Consumidor (Ley 27.743)</strong><br>
+        IVA Contenido $ {iva_contenido}
+    </div>"""
+
+# Valores que ya son HTML (o URLs generadas por el módulo) y no se escapan
+RAW_FIELDS = {'logo_html', 'items_html', 'transparencia_html', 'qr_src'}
+
+
+def format_number(num):
+    """Formato de números argentino: 1.234,56"""
+    return f"{num:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+def render_rows(rows):
+    """Filas de la tabla de items. `rows`: dicts con description, quantity, uom, price y subtotal"""
+    if not rows:
+        return EMPTY_ROWS_HTML
+    return ''.join(
+        ROW_TEMPLATE.format(
+            description=escape(row['description']),
+            quantity=format_number(row['quantity']),
+            uom=escape(row['uom']),
+            price=format_number(row['price']),
+            subtotal=format_number(row['subtotal']),
+        )
+        for row in rows
+    )
+
+
+def logo_html(logo_src):
+    if not logo_src:
+        return LOGO_PLACEHOLDER_HTML
+    return f'<img src="{logo_src}" class="logo" />'
+
+
+def render_invoice(values):
+    """HTML completo de la factura a partir de valores ya calculados"""
+    body = BODY_TEMPLATE.format(**{
+        key: value if key in RAW_FIELDS else escape(str(value))
+        for key, value in values.items()
+    })
+    return HTML_HEAD + body
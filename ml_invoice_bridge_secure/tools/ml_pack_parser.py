@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Extracción del Pack ID de MercadoLibre desde textos de origen (ODUMBO,
+# referencias de factura), con expresiones precompiladas una sola vez.
+
+import re
+import time
+
+# Reglas de account.move (facturas y el backfill en SQL), en orden: gana el
+# primer patrón que encuentra algo. Son las de siempre: un número de 13-20
+# dígitos en cualquier lugar, o 10-20 dígitos después de "order", "ml" o
+# "pack" separados por ":" o espacios.
+# Todos los cuantificadores son greedy, así PostgreSQL (substring ... from,
+# que busca el match más largo) devuelve lo mismo que Python; por eso los
+# flags van en línea con (?i) y la misma lista sirve para los dos motores.
+INVOICE_PATTERNS = (
+    r'(\d{13,20})',
+    r'(?i)order[:\s]+(\d{10,20})',
+    r'(?i)ml[:\s]+(\d{10,20})',
+    r'(?i)pack[:\s]+(\d{10,20})',
+)
+
+# Patrones para COALESCE(substring(origin from ...), ...) en el mismo orden
+SQL_PATTERNS = INVOICE_PATTERNS
+
+# Reglas de sale.order para los orígenes de ODUMBO. Usan .*? (no greedy): en
+# PostgreSQL cambiarían el resultado, así que sólo se aplican en Python.
+ORIGIN_PATTERNS = (
+    r'(?i)MercadoLibre Order\s+(\d{10,20})',  # patrón principal ODUMBO
+    r'(?i)ML.*?(\d{13,20})',                   # números largos después de ML
+    r'(?i)Pack.*?(\d{10,20})',                 # Pack seguido de números
+    r'(?i)Order.*?(\d{10,20})',                # Order seguido de números
+)
+
+_INVOICE_RES = tuple(re.compile(pattern) for pattern in INVOICE_PATTERNS)
+_ORIGIN_RES = tuple(re.compile(pattern) for pattern in ORIGIN_PATTERNS)
+
+# Orígenes reales de ODUMBO y referencias manuales, para el micro-benchmark
+# y para comprobar que Python y SQL_PATTERNS coinciden
+SAMPLE_ORIGINS = [
+    'MercadoLibre Order 2000005678901234',
+    'MercadoLibre Order 2000005678901234 - Venta confirmada',
+    'ML Order #2000004567891234',
+    'Venta confirmada ODUMBO ML: 2000003456789012',
+    'Pack: 2000003456789012 / Order: 2000003456789013',
+    'Order: 4123456789 / Pack: 2000003456789013',
+    'Pack ID 1234567890',
+    'ml 4123456789',
+    'ML_4123456789',
+    'ORDER:4123456789',
+    'Order 12345678901234567890123',
+    'S00123',
+    'S00456, S00457',
+    'Factura manual cliente mostrador',
+    '',
+]
+
+
+def _search(regexes, text):
+    if not text:
+        return None
+    text = str(text)
+    for regex in regexes:
+        match = regex.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def extract(text):
+    """Pack ID encontrado en `text` con las reglas de factura, o None"""
+    return _search(_INVOICE_RES, text)
+
+
+def extract_origin(text):
+    """Pack ID encontrado en el origen de una orden de venta, o None"""
+    return _search(_ORIGIN_RES, text)
+
+
+def benchmark(texts=None, rounds=1000):
+    """Micro-benchmark de extract. Devuelve microsegundos por texto."""
+    texts = texts or SAMPLE_ORIGINS
+    calls = len(texts) * rounds
+
+    start = time.perf_counter()
+    for _round in range(rounds):
+        for text in texts:
+            extract(text)
+    extract_us = (time.perf_counter() - start) * 1e6 / calls
+
+    return {
+        'texts': len(texts),
+        'calls': calls,
+        'extract_us': extract_us,
+    }
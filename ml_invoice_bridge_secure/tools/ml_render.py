@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import io
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+import requests
+
+from odoo.exceptions import UserError
+from odoo.tools.misc import find_in_path
+
+_logger = logging.getLogger(__name__)
+
+# Opciones para generar PDF similar al original
+WKHTMLTOPDF_ARGS = [
+    '--encoding', 'utf-8',
+    '--page-size', 'A4',
+    '--margin-top', '10',
+    '--margin-right', '10',
+    '--margin-bottom', '10',
+    '--margin-left', '10',
+    '--disable-smart-shrinking',
+    '--print-media-type',
+]
+
+# Perfiles de calidad: resolución, muestreo/compresión de imágenes y si se
+# reescribe el PDF resultante. La maquetación no cambia entre perfiles.
+PDF_PROFILES = {
+    # Igual al render histórico: para archivo e impresión
+    'archive': {
+        'args': ['--dpi', '300', '--image-dpi', '600', '--image-quality', '94'],
+        'optimize': False,
+    },
+    # Liviano para subir a MercadoLibre: imágenes a 150 DPI en JPEG q75 y
+    # reescritura que descarta objetos sin referencia y comprime el contenido
+    'upload': {
+        'args': ['--dpi', '150', '--image-dpi', '150', '--image-quality', '75'],
+        'optimize': True,
+    },
+}
+DEFAULT_PROFILE = 'archive'
+
+# El resultado del health check del servicio de render se reutiliza por este lapso
+SERVICE_CHECK_SECONDS = 60
+
+# Encabezado de inicio de cada documento en un render por lotes: wkhtmltopdf
+# lo registra en el outline del PDF y con eso se separan las facturas. Sólo se
+# agrega en los lotes; al estar posicionado en absoluto no desplaza el contenido,
+# así la factura queda maquetada igual que en un render individual
+SPLIT_MARKER = ('<h1 style="position:absolute;top:0;left:0;font-size:1px;line-height:1px;height:1px;'
+                'margin:0;padding:0;color:transparent;overflow:hidden">ml-doc-%d</h1>')
+
+_slots = {}
+_slots_lock = threading.Lock()
+# service_url -> (disponible, vencimiento monotonic)
+_service_state = {}
+
+
+@functools.lru_cache(maxsize=1)
+def wkhtmltopdf_path():
+    """Ruta de wkhtmltopdf, resuelta una sola vez por proceso"""
+    try:
+        return find_in_path('wkhtmltopdf')
+    except IOError:
+        return None
+
+
+def _render_slots(pool_size):
+    """Semáforo que limita los wkhtmltopdf simultáneos del proceso"""
+    key = (os.getpid(), pool_size)
+    slots = _slots.get(key)
+    if slots is None:
+        with _slots_lock:
+            slots = _slots.setdefault(key, threading.BoundedSemaphore(max(pool_size, 1)))
+    return slots
+
+
+def profile_settings(profile):
+    """Configuración del perfil (el perfil por defecto si no existe)"""
+    return PDF_PROFILES.get(profile) or PDF_PROFILES[DEFAULT_PROFILE]
+
+
+def profile_signature(profile):
+    """Identifica la salida de un perfil: forma parte de la clave del cache de PDFs"""
+    settings = profile_settings(profile)
+    return ' '.join(WKHTMLTOPDF_ARGS + settings['args'] + (['--optimize'] if settings['optimize'] else []))
+
+
+def _spool(chunks):
+    """Vuelca los bloques a un archivo temporal anónimo y lo deja al inicio"""
+    pdf_file = tempfile.TemporaryFile()
+    for chunk in chunks:
+        pdf_file.write(chunk)
+    pdf_file.seek(0)
+    return pdf_file
+
+
+def _set_service_state(service_url, healthy):
+    _service_state[service_url] = (healthy, time.monotonic() + SERVICE_CHECK_SECONDS)
+    return healthy
+
+
+def service_available(service_url, timeout=5, force=False):
+    """Health check del servicio de render (GET {url}/health), cacheado SERVICE_CHECK_SECONDS"""
+    if not service_url:
+        return False
+    healthy, valid_until = _service_state.get(service_url, (False, 0))
+    if not force and valid_until > time.monotonic():
+        return healthy
+    try:
+        response = requests.get(service_url.rstrip('/') + '/health', timeout=timeout)
+        if response.status_code < 500:
+            return _set_service_state(service_url, True)
+        _logger.warning("PDF render service %s unhealthy: HTTP %s", service_url, response.status_code)
+    except requests.RequestException as e:
+        _logger.warning("PDF render service %s unreachable: %s", service_url, e)
+    return _set_service_state(service_url, False)
+
+
+def _render_with_service(html_content, service_url, timeout, as_file, profile):
+    """POST del HTML al servicio de render externo (recibe text/html, devuelve application/pdf).
+    El perfil viaja en X-PDF-Profile para servicios que lo soporten."""
+    response = requests.post(
+        service_url,
+        data=html_content.encode('utf-8'),
+        headers={
+            'Content-Type': 'text/html; charset=utf-8',
+            'Accept': 'application/pdf',
+            'X-PDF-Profile': profile or DEFAULT_PROFILE,
+        },
+        timeout=timeout,
+        stream=as_file,
+    )
+    if response.status_code != 200:
+        raise UserError(f"Error generando PDF en el servicio de render: HTTP {response.status_code}")
+    if as_file:
+        with response:
+            return _spool(response.iter_content(64 * 1024))
+    return response.content
+
+
+def _run_wkhtmltopdf(html_contents, pdf_file, pool_size, timeout, profile, extra_args=()):
+    """Ejecuta wkhtmltopdf con uno o más documentos HTML; el PDF sale por stdout.
+
+    Con `pdf_file` (archivo abierto) el PDF se escribe ahí; si no, se devuelven
+    los bytes. Un único documento entra por stdin, sin tocar el disco. Un lote
+    necesita un archivo HTML por documento: se borran aunque el render falle.
+    """
+    wkhtmltopdf = wkhtmltopdf_path()
+    if not wkhtmltopdf:
+        raise UserError("wkhtmltopdf no está instalado en el servidor")
+
+    html_paths = []
+    try:
+        if len(html_contents) == 1:
+            sources, html_input = ['-'], html_contents[0].encode('utf-8')
+        else:
+            for html_content in html_contents:
+                with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', suffix='.html',
+                                                 delete=False) as html_file:
+                    html_paths.append(html_file.name)
+                    html_file.write(html_content)
+            sources, html_input = html_paths, None
+
+        with _render_slots(pool_size):
+            process = subprocess.Popen(
+                [wkhtmltopdf] + WKHTMLTOPDF_ARGS + profile_settings(profile)['args'] + list(extra_args)
+                + sources + ['-'],
+                stdin=subprocess.PIPE if html_input is not None else subprocess.DEVNULL,
+                stdout=pdf_file if pdf_file is not None else subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            try:
+                out, err = process.communicate(input=html_input, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise UserError(f"wkhtmltopdf no terminó en {timeout}s")
+
+        if process.returncode != 0:
+            _logger.error("wkhtmltopdf error: %s", err.decode(errors='replace'))
+            raise UserError(f"Error generando PDF: {err.decode(errors='replace')}")
+        return out
+    finally:
+        for path in html_paths:
+            os.unlink(path)
+
+
+def _run_wkhtmltopdf_to_file(html_contents, pool_size, timeout, profile, extra_args=()):
+    """Como _run_wkhtmltopdf, pero devuelve el PDF en un archivo temporal anónimo
+    (sin nombre en disco: el sistema lo libera al cerrarlo, incluso si el worker muere)"""
+    pdf_file = tempfile.TemporaryFile()
+    try:
+        _run_wkhtmltopdf(html_contents, pdf_file, pool_size, timeout, profile, extra_args)
+    except BaseException:
+        pdf_file.close()
+        raise
+    # wkhtmltopdf escribió por un descriptor heredado: volver al inicio
+    pdf_file.seek(0)
+    return pdf_file
+
+
+def _write_pages(reader, first_page, last_page, as_file, compress):
+    """Copia un rango de páginas a un PDF nuevo.
+
+    PdfFileWriter sólo escribe los objetos alcanzables desde las páginas
+    copiadas, así que los objetos sin uso quedan afuera; con `compress` además
+    se comprimen los content streams.
+    """
+    from odoo.tools.pdf import PdfFileWriter
+
+    writer = PdfFileWriter()
+    for number in range(first_page, last_page):
+        page = reader.getPage(number)
+        if compress:
+            compress_streams = getattr(page, 'compress_content_streams', None) or page.compressContentStreams
+            compress_streams()
+        writer.addPage(page)
+    stream = tempfile.TemporaryFile() if as_file else io.BytesIO()
+    writer.write(stream)
+    stream.seek(0)
+    return stream if as_file else stream.getvalue()
+
+
+def optimize_pdf(pdf, as_file=False):
+    """Reescribe el PDF descartando objetos sin uso y comprimiendo su contenido.
+
+    `pdf` puede ser bytes o un archivo abierto (que se cierra). Si la
+    reescritura falla o no reduce el tamaño se devuelve el original.
+    """
+    from odoo.tools.pdf import PdfFileReader
+
+    source = pdf if hasattr(pdf, 'read') else io.BytesIO(pdf)
+    original_size = os.fstat(source.fileno()).st_size if as_file else len(pdf)
+    try:
+        reader = PdfFileReader(source)
+        optimized = _write_pages(reader, 0, reader.getNumPages(), as_file, compress=True)
+    except Exception as e:
+        _logger.warning("PDF optimization skipped: %s", e)
+        source.seek(0)
+        return pdf
+    optimized_size = os.fstat(optimized.fileno()).st_size if as_file else len(optimized)
+    if optimized_size >= original_size:
+        if as_file:
+            optimized.close()
+        source.seek(0)
+        return pdf
+    if as_file:
+        pdf.close()
+    return optimized
+
+
+def _render_with_subprocess(html_content, pool_size, timeout, as_file, profile):
+    """Un proceso wkhtmltopdf por documento, limitado a `pool_size` simultáneos"""
+    if as_file:
+        return _run_wkhtmltopdf_to_file([html_content], pool_size, timeout, profile)
+    return _run_wkhtmltopdf([html_content], None, pool_size, timeout, profile)
+
+
+def html_to_pdf(html_content, service_url=None, pool_size=4, timeout=60, as_file=False, profile=None):
+    """Convierte HTML a PDF.
+
+    Usa el servicio de render externo si está configurado y responde;
+    si no, o si falla, lanza wkhtmltopdf como subproceso. Con as_file=True
+    devuelve un archivo binario abierto (ya desvinculado del disco) en lugar
+    de bytes. `profile` es una clave de PDF_PROFILES.
+    """
+    pdf = None
+    if service_available(service_url):
+        try:
+            pdf = _render_with_service(html_content, service_url, timeout, as_file, profile)
+        except (requests.RequestException, UserError) as e:
+            _logger.warning("PDF render service failed, falling back to wkhtmltopdf subprocess: %s", e)
+            _set_service_state(service_url, False)
+    if pdf is None:
+        pdf = _render_with_subprocess(html_content, pool_size, timeout, as_file, profile)
+    if profile_settings(profile)['optimize']:
+        pdf = optimize_pdf(pdf, as_file)
+    return pdf
+
+
+def _add_split_marker(html_content, index):
+    """Inserta el encabezado que marca el inicio del documento en el outline"""
+    marker = SPLIT_MARKER % index
+    body = html_content.find('<body')
+    if body == -1:
+        return marker + html_content
+    body_end = html_content.index('>', body) + 1
+    return html_content[:body_end] + marker + html_content[body_end:]
+
+
+def _split_by_outline(pdf_file, count, as_file, compress=False):
+    """Separa un PDF por lotes en `count` documentos según su outline.
+
+    Mismo criterio que ir.actions.report de Odoo: una entrada de primer nivel
+    por documento y la primera en la página 0. Devuelve None si no coincide.
+    """
+    from odoo.tools.pdf import PdfFileReader
+
+    reader = PdfFileReader(pdf_file)
+    root = reader.trailer['/Root']
+    if '/Outlines' not in root or '/First' not in root['/Outlines']:
+        return None
+    starts = []
+    node = root['/Outlines']['/First']
+    while True:
+        starts.append(root['/Dests'][node['/Dest']][0])
+        if '/Next' not in node:
+            break
+        node = node['/Next']
+    starts = sorted(set(starts))
+    if len(starts) != count or starts[0] != 0:
+        return None
+
+    documents = []
+    for i, first_page in enumerate(starts):
+        last_page = starts[i + 1] if i + 1 < len(starts) else reader.getNumPages()
+        documents.append(_write_pages(reader, first_page, last_page, as_file, compress))
+    return documents
+
+
+def _render_batch_with_subprocess(html_contents, pool_size, timeout, as_file, profile):
+    """Renderiza todos los documentos en una sola invocación de wkhtmltopdf.
+
+    Es el único lugar donde se agrega SPLIT_MARKER: un lote de un solo documento
+    se renderiza como cualquier otro, sin marcador ni outline.
+    """
+    if len(html_contents) < 2:
+        return [html_to_pdf(html_content, None, pool_size, timeout, as_file, profile)
+                for html_content in html_contents]
+    marked = [_add_split_marker(html_content, index) for index, html_content in enumerate(html_contents)]
+    pdf_file = _run_wkhtmltopdf_to_file(marked, pool_size, timeout * len(marked), profile,
+                                        extra_args=['--outline', '--outline-depth', '1'])
+    # La separación ya reescribe cada documento: la optimización del perfil se hace ahí
+    with pdf_file:
+        return _split_by_outline(pdf_file, len(marked), as_file,
+                                 compress=profile_settings(profile)['optimize'])
+
+
+def html_to_pdf_batch(html_contents, service_url=None, pool_size=4, timeout=60, as_file=False, profile=None):
+    """Convierte varios documentos HTML a PDF pagando el arranque de wkhtmltopdf una sola vez.
+
+    Devuelve una lista alineada con `html_contents` con el PDF (bytes o archivo
+    abierto) o la excepción de ese documento. Si el lote falla o no puede
+    separarse, cada documento se renderiza por separado para aislar el error.
+    """
+    if len(html_contents) > 1 and not service_available(service_url):
+        try:
+            documents = _render_batch_with_subprocess(html_contents, pool_size, timeout, as_file, profile)
+            if documents is not None:
+                return documents
+            _logger.warning("Batch PDF of %d documents could not be split, rendering one by one",
+                            len(html_contents))
+        except Exception as e:
+            _logger.warning("Batch PDF render of %d documents failed, rendering one by one: %s",
+                            len(html_contents), e)
+
+    results = []
+    for html_content in html_contents:
+        try:
+            results.append(html_to_pdf(html_content, service_url, pool_size, timeout, as_file, profile))
+        except Exception as e:
+            results.append(e)
+    return results